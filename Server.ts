@@ -11,11 +11,13 @@ import customErrors from "./api/customErrors";
 import modelsUtil from "./models/util/util";
 import api from "./api/V1";
 import fileProcessingApi from "./api/fileProcessing";
+import compression from "./api/compression";
 
 log.info("Starting Full Noise.");
 config.loadConfigFromArgs(true);
 
 const app: Application = express();
+app.use(compression);
 app.use(bodyParser.urlencoded({ extended: false, limit: "2Mb" }));
 app.use(bodyParser.json());
 app.use(passport.initialize());
@@ -45,6 +47,7 @@ app.use(customErrors.errorHandler);
 
 // Add file processing API.
 const fileProcessingApp = express();
+fileProcessingApp.use(compression);
 fileProcessingApp.use(bodyParser.urlencoded({ extended: false, limit: "2Mb" }));
 fileProcessingApi(fileProcessingApp);
 http.createServer(fileProcessingApp).listen(config.fileProcessing.port);
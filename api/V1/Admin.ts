@@ -19,6 +19,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import middleware from "../middleware";
 import auth from "../auth";
 import models from "../../models";
+import passwords from "../../models/util/passwords";
 import responseUtil from "./responseUtil";
 import { body, param } from "express-validator/check";
 import { Application } from "express";
@@ -49,10 +50,39 @@ export default function (app: Application, baseUrl: string) {
         request.body.user,
         request.body.permission
       );
+      auth.forgetEntity("user", request.body.user.id);
       responseUtil.send(response, {
         statusCode: 200,
         messages: ["Users global permission updated."]
       });
     })
   );
+
+  /**
+   * @api {get} /api/v1/admin/password_queue Get password hashing queue stats
+   * @apiName GetPasswordQueue
+   * @apiGroup Admin
+   * @apiDescription Reports how busy password hashing and comparison is.
+   * Registrations and logins wait in this queue when more of them arrive at
+   * once than bcrypt is allowed threads for.
+   *
+   * @apiUse V1ResponseSuccess
+   * @apiSuccess {Integer} active Password operations currently running.
+   * @apiSuccess {Integer} queueDepth Password operations waiting to run.
+   * @apiSuccess {Integer} maxQueueDepth The most operations that have been
+   * waiting at once since the server started.
+   *
+   * @apiUse V1ResponseError
+   */
+  app.get(
+    `${apiUrl}/password_queue`,
+    [auth.authenticateAdmin],
+    middleware.requestWrapper(async (request, response) => {
+      responseUtil.send(response, {
+        statusCode: 200,
+        messages: [],
+        ...passwords.passwordQueueStats()
+      });
+    })
+  );
 }
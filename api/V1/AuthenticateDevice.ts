@@ -41,15 +41,16 @@ export default function (app: Application) {
     "/authenticate_device",
     [body("password").exists(), middleware.getDevice(body)],
     middleware.requestWrapper(async (request, response) => {
-      const passwordMatch = await request.body.device.comparePassword(
-        request.body.password
-      );
+      const device = request.body.device;
+      const passwordMatch =
+        device.passwordMatched ||
+        (await device.comparePassword(request.body.password));
       if (passwordMatch) {
         return responseUtil.send(response, {
           statusCode: 200,
           messages: ["Successful login."],
-          id: request.body.device.id,
-          token: "JWT " + auth.createEntityJWT(request.body.device)
+          id: device.id,
+          token: "JWT " + auth.createEntityJWT(device)
         });
       } else {
         return responseUtil.send(response, {
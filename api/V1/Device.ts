@@ -373,6 +373,7 @@ export default function (app: Application, baseUrl: string) {
         request.body.group,
         request.body.newPassword
       );
+      auth.forgetEntity("device", request.device.id);
       return responseUtil.send(response, {
         statusCode: 200,
         messages: ["Registered the device again."],
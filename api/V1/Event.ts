@@ -54,6 +54,38 @@ export default function (app: Application, baseUrl: string) {
     middleware.requestWrapper(eventUtil.uploadEvent)
   );
 
+  /**
+   * @api {post} /api/v1/events/batch Add many new events at once
+   * @apiName AddEventBatch
+   * @apiGroup Events
+   * @apiDescription This call is used to upload a batch of events, which may
+   * be of different types, in one request.  Each entry in `events` takes the
+   * same parameters as `POST /api/v1/events`.  All of the events are added
+   * together, or none are.
+   *
+   * @apiUse V1DeviceAuthorizationHeader
+   *
+   * @apiParam {JSON[]} events Array of up to 1000 events, each with `dateTimes`
+   * and either `eventDetailId` or `description`.
+   * @apiParamExample {JSON} Example events:
+   * {
+   *   "events": [
+   *     {"description": {"type": "rpi-power-on"}, "dateTimes": ["2021-06-01T05:00:00.000Z"]},
+   *     {"eventDetailId": 3, "dateTimes": ["2021-06-01T05:01:00.000Z", "2021-06-01T05:02:00.000Z"]}
+   *   ]
+   * }
+   *
+   * @apiUse V1ResponseSuccess
+   * @apiSuccess {Integer} eventsAdded Number of events added
+   * @apiSuccess {Integer[]} eventDetailIds Id of the Event Detail record used for each entry in events
+   * @apiuse V1ResponseError
+   */
+  app.post(
+    apiUrl + "/batch",
+    [auth.authenticateDevice, ...eventUtil.eventBatchAuth],
+    middleware.requestWrapper(eventUtil.uploadEventBatch)
+  );
+
   /**
    * @api {post} /api/v1/events/device/:deviceID Add new events on behalf of device
    * @apiName AddEventOnBehalf
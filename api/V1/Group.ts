@@ -82,6 +82,7 @@ export default function (app: Application, baseUrl: string) {
         groupname: request.body.groupname
       });
       await newGroup.addUser(request.user.id, { through: { admin: true } });
+      request.user.clearAccessCache();
       return responseUtil.send(response, {
         statusCode: 200,
         groupId: newGroup.id,
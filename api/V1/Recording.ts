@@ -21,6 +21,7 @@ import middleware from "../middleware";
 import auth from "../auth";
 import recordingUtil, { RecordingQuery } from "./recordingUtil";
 import responseUtil from "./responseUtil";
+import util from "./util";
 import models from "../../models";
 // @ts-ignore
 import * as csv from "fast-csv";
@@ -31,6 +32,7 @@ import { Track } from "../../models/Track";
 import { Op } from "sequelize";
 import jwt from "jsonwebtoken";
 import config from "../../config";
+import log from "../../logging";
 
 export default (app: Application, baseUrl: string) => {
   const apiUrl = `${baseUrl}/recordings`;
@@ -75,7 +77,11 @@ export default (app: Application, baseUrl: string) => {
    * @apiParam {JSON} data Metadata about the recording.   Valid tags are:
    * <ul>
    * <li>(REQUIRED) type: 'thermalRaw', or 'audio'
-   * <li>fileHash - Optional sha1 hexadecimal formatted hash of the file to be uploaded
+   * <li>fileHash - Optional sha1 hexadecimal formatted hash of the file to be uploaded.  If the device has
+   * already uploaded a recording with this hash (and the same recordingDateTime, if given)
+   * the file is not stored again and the existing recordingId is returned.  Send the data field
+   * before the file part so a duplicate can be spotted before the file is stored.  It is also checked
+   * against the hash of the received file, and the upload fails if they differ.
    * <li>duration
    * <li>recordingDateTime
    * <li>location
@@ -113,6 +119,112 @@ export default (app: Application, baseUrl: string) => {
     middleware.requestWrapper(recordingUtil.makeUploadHandler())
   );
 
+  /**
+   * @api {post} /api/v1/recordings/uploads Start a chunked recording upload
+   * @apiName PostRecordingUpload
+   * @apiGroup Recordings
+   * @apiDescription Starts a resumable upload session for a large recording.
+   * The file is then sent in chunks using `PUT /api/v1/recordings/uploads/:uploadId`
+   * and the recording is created by `POST /api/v1/recordings/uploads/:uploadId/finalize`.
+   * If a chunk fails only that chunk needs to be sent again.  A session that
+   * receives nothing for 7 days is discarded.
+   *
+   * If `data` has a fileHash matching a recording the device has already
+   * uploaded no session is started, and the existing recordingId is returned.
+   *
+   * @apiUse V1DeviceAuthorizationHeader
+   *
+   * @apiParam {JSON} data Metadata about the recording, as for `POST /api/v1/recordings`.
+   * @apiParam {Number} size Size of the file in bytes.
+   * @apiParam {String} [filename] Name of the file being uploaded.
+   *
+   * @apiUse V1ResponseSuccess
+   * @apiSuccess {String} uploadId ID of the upload session.
+   * @apiSuccess {Number} recordingId ID of the existing recording, for a duplicate upload.
+   * @apiSuccess {Number} offset Number of bytes received so far.
+   * @apiuse V1ResponseError
+   */
+  app.post(
+    `${apiUrl}/uploads`,
+    [
+      auth.authenticateDevice,
+      middleware.parseJSON("data", body),
+      body("size").isInt({ min: 1 }).toInt(),
+      body("filename").isString().optional()
+    ],
+    middleware.requestWrapper(
+      util.createUploadSession(recordingUtil.findDuplicateRecording)
+    )
+  );
+
+  /**
+   * @api {get} /api/v1/recordings/uploads/:uploadId Get the progress of a chunked upload
+   * @apiName GetRecordingUpload
+   * @apiGroup Recordings
+   *
+   * @apiUse V1DeviceAuthorizationHeader
+   *
+   * @apiUse V1ResponseSuccess
+   * @apiSuccess {Number} size Size of the file in bytes.
+   * @apiSuccess {Number} offset Number of bytes, from the start of the file,
+   * received without gaps.  The upload continues from here.
+   * @apiuse V1ResponseError
+   */
+  app.get(
+    `${apiUrl}/uploads/:uploadId`,
+    [auth.authenticateDevice, param("uploadId").isUUID()],
+    middleware.requestWrapper(util.getUploadStatus)
+  );
+
+  /**
+   * @api {put} /api/v1/recordings/uploads/:uploadId Upload a chunk of a recording
+   * @apiName PutRecordingUploadChunk
+   * @apiGroup Recordings
+   * @apiDescription The request body is the raw bytes of the chunk, which
+   * must have a Content-Length.  Sending a chunk again for the same offset
+   * replaces it.
+   *
+   * @apiUse V1DeviceAuthorizationHeader
+   *
+   * @apiParam {Number} offset Byte offset of the chunk within the file.
+   *
+   * @apiUse V1ResponseSuccess
+   * @apiSuccess {Number} offset Number of bytes, from the start of the file,
+   * received without gaps.
+   * @apiuse V1ResponseError
+   */
+  app.put(
+    `${apiUrl}/uploads/:uploadId`,
+    [
+      auth.authenticateDevice,
+      param("uploadId").isUUID(),
+      query("offset").isInt({ min: 0 }).toInt()
+    ],
+    middleware.requestWrapper(util.uploadChunk)
+  );
+
+  /**
+   * @api {post} /api/v1/recordings/uploads/:uploadId/finalize Finish a chunked recording upload
+   * @apiName PostRecordingUploadFinalize
+   * @apiGroup Recordings
+   * @apiDescription Assembles the uploaded chunks and adds the recording.
+   * Fails if any part of the file hasn't been received.  Finishing an
+   * upload that has already been finished returns the same recordingId.
+   * If the assembled file doesn't match the fileHash in `data` the session
+   * is discarded and the file must be uploaded again in a new session.
+   *
+   * @apiUse V1DeviceAuthorizationHeader
+   *
+   * @apiUse V1ResponseSuccess
+   * @apiSuccess {Number} recordingId ID of the recording.
+   * @apiuse V1ResponseError
+   */
+  app.post(
+    `${apiUrl}/uploads/:uploadId/finalize`,
+    [auth.authenticateDevice, param("uploadId").isUUID()],
+    middleware.requestWrapper(recordingUtil.makeFinalizeUploadHandler())
+  );
+
   /**
    * @api {post} /api/v1/recordings/device/:devicename/group/:groupname Add a new recording on behalf of device using group
    * @apiName PostRecordingOnBehalfUsingGroup
@@ -263,6 +375,19 @@ export default (app: Application, baseUrl: string) => {
    * @apiGroup Recordings
    *
    * @apiParam {string} view-mode (Optional) - can be set to "user"
+   * @apiParam {String} [cursor] Return the recordings following this cursor
+   * (taken from `nextCursor` in a previous response) instead of using an
+   * offset. Can't be combined with `order`.
+   * @apiParam {JSON} [fields] Array of the fields to return for each recording,
+   * e.g. `["recordingDateTime", "Tags"]`.  The id is always returned.  Fields can
+   * be any of the recording's attributes returned by default, or the associated
+   * `Group`, `Station`, `Tags`, `Tracks` and `Device`.  All fields are returned if
+   * this isn't given.
+   * @apiParam {String} [countMode] `exact` (the default) to count all matching
+   * recordings, or `none` to skip counting them, which is quicker for large
+   * or tag filtered queries.  `count` is null when the count is skipped.
+   * Otherwise it is the number of recordings matching the query, including
+   * those before the cursor, so it is the same for every page.
    *
    * @apiUse V1UserAuthorizationHeader
    * @apiUse BaseQueryParams
@@ -270,11 +395,22 @@ export default (app: Application, baseUrl: string) => {
    * @apiUse MoreQueryParams
    * @apiUse FilterOptions
    * @apiUse V1ResponseSuccessQuery
+   * @apiSuccess {String} nextCursor Cursor for the next page of recordings,
+   * or null if there are no more or a custom order was given.
+   * @apiSuccess {Boolean} hasMore Whether there are more recordings after
+   * this page.
    * @apiUse V1ResponseError
    */
   app.get(
     apiUrl,
-    [auth.authenticateUser, middleware.viewMode(), ...queryValidators],
+    [
+      auth.authenticateUser,
+      middleware.viewMode(),
+      ...queryValidators,
+      query("cursor").isString().optional(),
+      middleware.parseArray("fields", query).optional(),
+      query("countMode").isIn(["exact", "none"]).optional()
+    ],
     middleware.requestWrapper(
       async (request: e.Request, response: e.Response) => {
         const result = await recordingUtil.query(
@@ -286,6 +422,8 @@ export default (app: Application, baseUrl: string) => {
           limit: request.query.limit,
           offset: request.query.offset,
           count: result.count,
+          hasMore: result.hasMore,
+          nextCursor: result.nextCursor,
           rows: result.rows
         });
       }
@@ -396,7 +534,10 @@ export default (app: Application, baseUrl: string) => {
    * @apiGroup Recordings
    * @apiDescription Parameters are as per GET /api/V1/recordings. On
    * success (status 200), the response body will contain CSV
-   * formatted details of the selected recordings.
+   * formatted details of the selected recordings. The rows are streamed
+   * in batches as they are read from the database. A visits report starts
+   * with a summary of all its visits, so its visits (at most 5000) are all
+   * worked out before any rows are sent.
    *
    * @apiUse V1UserAuthorizationHeader
    * @apiParam {String} [jwt] Signed JWT as produced by the [Token](#api-Authentication-Token) endpoint
@@ -419,12 +560,30 @@ export default (app: Application, baseUrl: string) => {
     middleware.requestWrapper(async (request, response) => {
       // 10 minute timeout because the query can take a while to run
       // when the result set is large.
-      const rows = await recordingUtil.report(request);
+      const rows = recordingUtil.report(request);
+      // Wait for the first row so that query errors are still returned
+      // as an error response.
+      let row = await rows.next();
       response.status(200).set({
         "Content-Type": "text/csv",
         "Content-Disposition": "attachment; filename=recordings.csv"
       });
-      csv.writeToStream(response, rows);
+      const csvStream = csv.format();
+      csvStream.pipe(response);
+      try {
+        while (!row.done) {
+          if (!csvStream.write(row.value)) {
+            await new Promise((resolve) => csvStream.once("drain", resolve));
+          }
+          row = await rows.next();
+        }
+        csvStream.end();
+      } catch (e) {
+        // The headers have gone so the best we can do is cut the
+        // response short so that the client sees it is incomplete.
+        log.error(`Error while streaming report: ${e}`);
+        response.destroy();
+      }
     })
   );
 
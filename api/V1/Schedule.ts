@@ -63,6 +63,9 @@ export default (app: Application, baseUrl: string) => {
         { ScheduleId: instance.id },
         { where: { id: deviceIds } }
       );
+      for (const deviceId of deviceIds) {
+        auth.forgetEntity("device", deviceId);
+      }
 
       return responseUtil.send(response, {
         statusCode: 200,
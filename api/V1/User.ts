@@ -125,6 +125,7 @@ export default function (app: Application, baseUrl: string) {
         where: {},
         fields: user.apiSettableFields as string[]
       });
+      auth.forgetEntity("user", request.user.id);
       responseUtil.send(response, {
         statusCode: 200,
         messages: ["Updated user."]
@@ -5,6 +5,8 @@ import { Event } from "../../models/Event";
 import { User } from "../../models/User";
 
 import { QueryOptions } from "../../models/Event";
+import { DetailSnapshotId } from "../../models/DetailSnapshot";
+import { ClientError } from "../customErrors";
 
 import responseUtil from "./responseUtil";
 import { body, oneOf } from "express-validator/check";
@@ -12,6 +14,7 @@ import { groupSystemErrors } from "./systemError";
 import moment, { Moment } from "moment";
 
 const EVENT_TYPE_REGEXP = /^[A-Z0-9/-]+$/i;
+const MAX_EVENT_BATCH_SIZE = 1000;
 
 async function errors(request: any, admin?: boolean) {
   const query = request.query;
@@ -74,6 +77,69 @@ async function uploadEvent(request, response) {
   });
 }
 
+async function uploadEventBatch(request, response) {
+  const events = request.body.events;
+
+  // Look up each distinct description once, however many events share it.
+  const descriptionIds = new Map<string, DetailSnapshotId>();
+  for (const event of events) {
+    if (event.eventDetailId) {
+      continue;
+    }
+    const { type, details } = event.description;
+    const key = JSON.stringify([type, details]);
+    if (!descriptionIds.has(key)) {
+      const detail = await models.DetailSnapshot.getOrCreateMatching(
+        type,
+        details
+      );
+      descriptionIds.set(key, detail.id);
+    }
+  }
+
+  const givenIds = Array.from(
+    new Set<DetailSnapshotId>(
+      events.filter((event) => event.eventDetailId).map((e) => e.eventDetailId)
+    )
+  );
+  if (givenIds.length > 0) {
+    const found = await models.DetailSnapshot.count({
+      where: { id: givenIds }
+    });
+    if (found !== givenIds.length) {
+      throw new ClientError("Unknown eventDetailId in events.");
+    }
+  }
+
+  const eventDetailIds = events.map(
+    (event) =>
+      event.eventDetailId ||
+      descriptionIds.get(
+        JSON.stringify([event.description.type, event.description.details])
+      )
+  );
+  const eventList = [];
+  events.forEach((event, i) => {
+    for (const time of event.dateTimes) {
+      eventList.push({
+        DeviceId: request.device.id,
+        EventDetailId: eventDetailIds[i],
+        dateTime: time
+      });
+    }
+  });
+
+  // Sequelize sends all of the rows as a single multi-row INSERT.
+  await models.Event.bulkCreate(eventList);
+
+  return responseUtil.send(response, {
+    statusCode: 200,
+    messages: ["Added events."],
+    eventsAdded: eventList.length,
+    eventDetailIds
+  });
+}
+
 async function powerEventsPerDevice(
   request: any,
   admin?: boolean
@@ -116,6 +182,37 @@ const eventAuth = [
   )
 ];
 
+const eventBatchAuth = [
+  body("events").custom((events) => {
+    if (!Array.isArray(events)) {
+      throw new Error("Value should be an array.");
+    }
+    if (events.length === 0 || events.length > MAX_EVENT_BATCH_SIZE) {
+      throw new Error(
+        `Between 1 and ${MAX_EVENT_BATCH_SIZE} events can be sent at once.`
+      );
+    }
+    return true;
+  }),
+  middleware.isDateArray(
+    "events.*.dateTimes",
+    "List of times event occured is required."
+  ),
+  body("events.*.eventDetailId").isInt().optional().toInt(),
+  body("events.*.description.type").matches(EVENT_TYPE_REGEXP).optional(),
+  body("events.*").custom((event) => {
+    if (
+      !event.eventDetailId &&
+      !(event.description && event.description.type)
+    ) {
+      throw new Error(
+        "Either 'eventDetailId' or 'description.type' must be specified for each event."
+      );
+    }
+    return true;
+  })
+];
+
 export class PowerEvents {
   lastReported: Moment | null;
   lastStarted: Moment | null;
@@ -183,7 +280,9 @@ export class PowerEvents {
 
 export default {
   eventAuth,
+  eventBatchAuth,
   uploadEvent,
+  uploadEventBatch,
   errors,
   powerEventsPerDevice,
   EVENT_TYPE_REGEXP
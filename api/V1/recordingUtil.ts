@@ -64,6 +64,9 @@ export interface RecordingQuery extends Request {
     offset: null | number;
     limit: null | number;
     order: null | Order;
+    cursor?: string;
+    fields?: string[];
+    countMode?: "exact" | "none";
     distinct: boolean;
     type: string;
     audiobait: null | boolean;
@@ -144,7 +147,44 @@ export async function tryToMatchRecordingToStation(
 }
 
 function makeUploadHandler(mungeData?: (any) => any) {
-  return util.multipartUpload("raw", async (request, data, key) => {
+  return util.multipartUpload(
+    "raw",
+    makeRecordingBuilder(mungeData),
+    findDuplicateRecording
+  );
+}
+
+// Looks for a recording from the same device with the same file hash (and
+// the same recordingDateTime when one is given), returning its id.
+async function findDuplicateRecording(
+  request,
+  data
+): Promise<RecordingId | null> {
+  if (!data.fileHash) {
+    return null;
+  }
+  const where: any = {
+    DeviceId: request.device.id,
+    rawFileHash: data.fileHash
+  };
+  if (data.recordingDateTime) {
+    where.recordingDateTime = data.recordingDateTime;
+  }
+  const recording = await models.Recording.findOne({
+    where,
+    attributes: ["id"]
+  });
+  return recording ? recording.id : null;
+}
+
+function makeFinalizeUploadHandler(mungeData?: (any) => any) {
+  return util.finalizeUpload("raw", makeRecordingBuilder(mungeData));
+}
+
+// Returns a function that creates the recording for a file that has been
+// uploaded to key.
+function makeRecordingBuilder(mungeData?: (any) => any) {
+  return async (request, data, key) => {
     if (mungeData) {
       data = mungeData(data);
     }
@@ -257,15 +297,22 @@ function makeUploadHandler(mungeData?: (any) => any) {
       }
     }
     return recording;
-  });
+  };
 }
 
 // Returns a promise for the recordings query specified in the
-// request.
+// request.  With a countMode of "none" the matching recordings aren't
+// counted, and count is null; hasMore still says whether there are more
+// recordings after this page.
 async function query(
   request: RecordingQuery,
   type?
-): Promise<{ rows: Recording[]; count: number }> {
+): Promise<{
+  rows: Recording[];
+  count: number | null;
+  hasMore: boolean;
+  nextCursor: string | null;
+}> {
   if (type) {
     request.query.where.type = type;
   }
@@ -280,8 +327,39 @@ async function query(
     request.query.order,
     request.body.viewAsSuperAdmin
   );
+  builder.selectFields(request.query.fields);
+  builder.addCursor(request.query.cursor);
   builder.query.distinct = true;
-  const result = await models.Recording.findAndCountAll(builder.get());
+  let result;
+  if (request.query.countMode === "none" || request.query.cursor) {
+    // Fetch one recording more than was asked for to tell whether there
+    // are any more, rather than working it out from the count.
+    const limit = builder.query.limit;
+    builder.query.limit = limit + 1;
+    const rows = await models.Recording.findAll(builder.get());
+    builder.query.limit = limit;
+    result = {
+      rows: rows.slice(0, limit),
+      count: null,
+      hasMore: rows.length > limit
+    };
+    if (request.query.countMode !== "none") {
+      // As with offset paging this counts every matching recording, not
+      // just those after the cursor.
+      result.count = await models.Recording.count(builder.countOptions());
+    }
+  } else {
+    const { rows, count } = await models.Recording.findAndCountAll(
+      builder.get()
+    );
+    result = {
+      rows,
+      count,
+      hasMore: builder.query.offset + rows.length < count
+    };
+  }
+  const cursor = builder.nextCursor(result.rows);
+  const nextCursor = result.hasMore ? cursor : null;
 
   // This gives less location precision if the user isn't admin.
   const filterOptions = models.Recording.makeFilterOptions(
@@ -292,19 +370,29 @@ async function query(
     rec.filterData(filterOptions);
     return handleLegacyTagFieldsForGetOnRecording(rec);
   });
-  return result;
+  return { ...result, nextCursor };
 }
 
-// Returns a promise for report rows for a set of recordings. Takes
-// the same parameters as query() above.
-async function report(request: RecordingQuery) {
+// Number of recordings read from the database at a time when
+// generating a report.
+const REPORT_BATCH_SIZE = 500;
+
+// Yields report rows for a set of recordings. Takes the same parameters
+// as query() above.
+async function* report(request: RecordingQuery): AsyncGenerator<any[]> {
   if (request.query.type == "visits") {
-    return reportVisits(request);
+    yield* reportVisits(request);
+    return;
   }
-  return reportRecordings(request);
+  yield* reportRecordings(request);
 }
 
-async function reportRecordings(request: RecordingQuery) {
+// Recordings are read in batches, following the query order with a
+// cursor where possible, so that only one batch is held in memory at a
+// time.
+async function* reportRecordings(
+  request: RecordingQuery
+): AsyncGenerator<any[]> {
   const includeAudiobait: boolean = request.query.audiobait;
   const builder = (
     await new models.Recording.queryBuilder().init(
@@ -318,7 +406,8 @@ async function reportRecordings(request: RecordingQuery) {
     )
   )
     .addColumn("comment")
-    .addColumn("additionalMetadata");
+    .addColumn("additionalMetadata")
+    .addCursor();
 
   if (includeAudiobait) {
     builder.addAudioEvents();
@@ -329,43 +418,11 @@ async function reportRecordings(request: RecordingQuery) {
     attributes: ["name"]
   });
 
-  // NOTE: Not even going to try to attempt to add typing info to this bundle
-  //  of properties...
-  const result: any[] = await models.Recording.findAll(builder.get());
-
   const filterOptions = models.Recording.makeFilterOptions(
     request.user,
     request.filterOptions
   );
 
-  const audioFileNames = new Map();
-  const audioEvents: Map<
-    RecordingId,
-    { timestamp: Date; volume: number; fileId: FileId }
-  > = new Map();
-
-  if (includeAudiobait) {
-    // Our DB schema doesn't allow us to easily get from a audio event
-    // recording to a audio file name so do some work first to look these up.
-    const audioFileIds: Set<number> = new Set();
-    for (const r of result) {
-      const event = findLatestEvent(r.Device.Events);
-      if (event && event.EventDetail) {
-        const fileId = event.EventDetail.details.fileId;
-        audioEvents[r.id] = {
-          timestamp: event.dateTime,
-          volume: event.EventDetail.details.volume,
-          fileId
-        };
-        audioFileIds.add(fileId);
-      }
-    }
-    // Bulk look up file details of played audio events.
-    for (const f of await models.File.getMultiple(Array.from(audioFileIds))) {
-      audioFileNames[f.id] = f.details.name;
-    }
-  }
-
   const recording_url_base = config.server.recording_url_base || "";
 
   const labels = [
@@ -397,82 +454,136 @@ async function reportRecordings(request: RecordingQuery) {
   }
   labels.push("URL", "Cacophony Index", "Species Classification");
 
-  const out = [labels];
+  let remaining = builder.query.limit;
+  let labelsSent = false;
+  while (remaining > 0) {
+    builder.query.limit = Math.min(remaining, REPORT_BATCH_SIZE);
+    // NOTE: Not even going to try to attempt to add typing info to this bundle
+    //  of properties...
+    const result: any[] = await models.Recording.findAll(builder.get());
+    remaining -= result.length;
+    if (result.length < builder.query.limit) {
+      remaining = 0;
+    } else if (builder.defaultOrder) {
+      builder.addCursor(builder.nextCursor(result));
+    } else {
+      builder.query.offset += result.length;
+    }
 
-  for (const r of result) {
-    r.filterData(filterOptions);
+    // The labels are held back until the first batch has been read so
+    // that query errors can still be reported as an error response.
+    if (!labelsSent) {
+      yield labels;
+      labelsSent = true;
+    }
 
-    const automatic_track_tags = new Set();
-    const human_track_tags = new Set();
-    for (const track of r.Tracks) {
-      for (const tag of track.TrackTags) {
-        const subject = tag.what || tag.detail;
-        if (tag.automatic) {
-          automatic_track_tags.add(subject);
-        } else {
-          human_track_tags.add(subject);
+    const { audioFileNames, audioEvents } = includeAudiobait
+      ? await findAudioBaitEvents(result)
+      : { audioFileNames: new Map(), audioEvents: new Map() };
+
+    for (const r of result) {
+      r.filterData(filterOptions);
+
+      const automatic_track_tags = new Set();
+      const human_track_tags = new Set();
+      for (const track of r.Tracks) {
+        for (const tag of track.TrackTags) {
+          const subject = tag.what || tag.detail;
+          if (tag.automatic) {
+            automatic_track_tags.add(subject);
+          } else {
+            human_track_tags.add(subject);
+          }
         }
       }
-    }
 
-    const recording_tags = r.Tags.map((t) => t.what || t.detail);
-
-    const cacophonyIndex = getCacophonyIndex(r);
-    const speciesClassifications = getSpeciesIdentification(r);
-
-    const thisRow = [
-      r.id,
-      r.type,
-      r.Group.groupname,
-      r.Device.devicename,
-      r.Station ? r.Station.name : "",
-      moment(r.recordingDateTime).tz(config.timeZone).format("YYYY-MM-DD"),
-      moment(r.recordingDateTime).tz(config.timeZone).format("HH:mm:ss"),
-      r.location ? r.location.coordinates[0] : "",
-      r.location ? r.location.coordinates[1] : "",
-      r.duration,
-      r.batteryLevel,
-      r.comment,
-      r.Tracks.length,
-      formatTags(automatic_track_tags),
-      formatTags(human_track_tags),
-      formatTags(recording_tags)
-    ];
-
-    if (includeAudiobait) {
-      let audioBaitName = "";
-      let audioBaitTime = null;
-      let audioBaitDelta = null;
-      let audioBaitVolume = null;
-      const audioEvent = audioEvents[r.id];
-      if (audioEvent) {
-        audioBaitName = audioFileNames[audioEvent.fileId];
-        audioBaitTime = moment(audioEvent.timestamp);
-        audioBaitDelta = moment
-          .duration(r.recordingDateTime - audioBaitTime)
-          .asMinutes()
-          .toFixed(1);
-        audioBaitVolume = audioEvent.volume;
+      const recording_tags = r.Tags.map((t) => t.what || t.detail);
+
+      const cacophonyIndex = getCacophonyIndex(r);
+      const speciesClassifications = getSpeciesIdentification(r);
+
+      const thisRow = [
+        r.id,
+        r.type,
+        r.Group.groupname,
+        r.Device.devicename,
+        r.Station ? r.Station.name : "",
+        moment(r.recordingDateTime).tz(config.timeZone).format("YYYY-MM-DD"),
+        moment(r.recordingDateTime).tz(config.timeZone).format("HH:mm:ss"),
+        r.location ? r.location.coordinates[0] : "",
+        r.location ? r.location.coordinates[1] : "",
+        r.duration,
+        r.batteryLevel,
+        r.comment,
+        r.Tracks.length,
+        formatTags(automatic_track_tags),
+        formatTags(human_track_tags),
+        formatTags(recording_tags)
+      ];
+
+      if (includeAudiobait) {
+        let audioBaitName = "";
+        let audioBaitTime = null;
+        let audioBaitDelta = null;
+        let audioBaitVolume = null;
+        const audioEvent = audioEvents[r.id];
+        if (audioEvent) {
+          audioBaitName = audioFileNames[audioEvent.fileId];
+          audioBaitTime = moment(audioEvent.timestamp);
+          audioBaitDelta = moment
+            .duration(r.recordingDateTime - audioBaitTime)
+            .asMinutes()
+            .toFixed(1);
+          audioBaitVolume = audioEvent.volume;
+        }
+
+        thisRow.push(
+          audioBaitName,
+          audioBaitTime
+            ? audioBaitTime.tz(config.timeZone).format("HH:mm:ss")
+            : "",
+          audioBaitDelta,
+          audioBaitVolume
+        );
       }
 
       thisRow.push(
-        audioBaitName,
-        audioBaitTime
-          ? audioBaitTime.tz(config.timeZone).format("HH:mm:ss")
-          : "",
-        audioBaitDelta,
-        audioBaitVolume
+        urljoin(recording_url_base, r.id.toString()),
+        cacophonyIndex,
+        speciesClassifications
       );
+      yield thisRow;
     }
+  }
+}
 
-    thisRow.push(
-      urljoin(recording_url_base, r.id.toString()),
-      cacophonyIndex,
-      speciesClassifications
-    );
-    out.push(thisRow);
+async function findAudioBaitEvents(recordings: any[]) {
+  const audioFileNames = new Map();
+  const audioEvents: Map<
+    RecordingId,
+    { timestamp: Date; volume: number; fileId: FileId }
+  > = new Map();
+
+  // Our DB schema doesn't allow us to easily get from a audio event
+  // recording to a audio file name so do some work first to look these up.
+  const audioFileIds: Set<number> = new Set();
+  for (const r of recordings) {
+    const event = findLatestEvent(r.Device.Events);
+    if (event && event.EventDetail) {
+      const fileId = event.EventDetail.details.fileId;
+      audioEvents[r.id] = {
+        timestamp: event.dateTime,
+        volume: event.EventDetail.details.volume,
+        fileId
+      };
+      audioFileIds.add(fileId);
+    }
   }
-  return out;
+  // Bulk look up file details of played audio events.
+  for (const f of await models.File.getMultiple(Array.from(audioFileIds))) {
+    audioFileNames[f.id] = f.details.name;
+  }
+  return { audioFileNames, audioEvents };
 }
 
 function getCacophonyIndex(recording: Recording): string | null {
@@ -656,7 +767,9 @@ function handleLegacyTagFieldsForGet(tag) {
 
 function handleLegacyTagFieldsForGetOnRecording(recording) {
   recording = recording.get({ plain: true });
-  recording.Tags = recording.Tags.map(handleLegacyTagFieldsForGet);
+  if (recording.Tags) {
+    recording.Tags = recording.Tags.map(handleLegacyTagFieldsForGet);
+  }
   return recording;
 }
 
@@ -986,12 +1099,16 @@ function reportDeviceVisits(deviceMap: DeviceVisitMap) {
   return device_summary_out;
 }
 
-async function reportVisits(request: RecordingQuery) {
+// The device summary at the top of a visits report needs every visit, so
+// unlike the recordings report the visits (at most maxVisitQueryResults of
+// them) are all worked out before the first row is sent.  Only the rows for
+// one visit are built at a time.
+async function* reportVisits(request: RecordingQuery): AsyncGenerator<any[]> {
   const results = await queryVisits(request);
-  const out = reportDeviceVisits(results.summary.deviceMap);
+  yield* reportDeviceVisits(results.summary.deviceMap);
   const recordingUrlBase = config.server.recording_url_base || "";
-  out.push([]);
-  out.push([
+  yield [];
+  yield [
     "Visit ID",
     "Group",
     "Device",
@@ -1006,9 +1123,10 @@ async function reportVisits(request: RecordingQuery) {
     "# Events",
     "Audio Played",
     "URL"
-  ]);
+  ];
 
   for (const visit of results.visits) {
+    const out = [];
     addVisitRow(out, visit);
 
     const audioEvents = visit.audioBaitEvents.sort(function (a, b) {
@@ -1041,8 +1159,8 @@ async function reportVisits(request: RecordingQuery) {
     for (const audioEvent of audioEvents.reverse()) {
       addAudioBaitRow(out, audioEvent);
     }
+    yield* out;
   }
-  return out;
 }
 
 function addVisitRow(out: any, visit: Visit) {
@@ -1191,6 +1309,8 @@ async function sendAlerts(recID: number) {
 
 export default {
   makeUploadHandler,
+  makeFinalizeUploadHandler,
+  findDuplicateRecording,
   query,
   report,
   get,
@@ -18,7 +18,6 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import middleware from "../middleware";
 import auth from "../auth";
-import stream from "stream";
 import config from "../../config";
 import log from "../../logging";
 import modelsUtil from "../../models/util/util";
@@ -40,6 +39,8 @@ export default function (app: Application, baseUrl: string) {
    * from a successful [GetRecording](#api-Recordings-GetRecording)
    * request. Authentication using the Authorization header is also
    * supported.
+   * @apiHeader {String} [Range] A single byte range of the file to return,
+   * e.g. `bytes=1024-`. Partial content is returned with status 206.
    *
    * @apiSuccess {file} file Raw data stream of the file.
    *
@@ -59,50 +60,85 @@ export default function (app: Application, baseUrl: string) {
       }
 
       const s3 = modelsUtil.openS3();
-      const params = {
+      const params: { Bucket: string; Key: string; Range?: string } = {
         Bucket: config.s3.bucket,
         Key: key
       };
 
-      s3.getObject(params, function (err, data) {
-        if (err) {
-          log.error("Error with s3 getObject.");
-          log.error(err.stack);
-          return responseUtil.serverError(response, err);
-        }
+      let total;
+      try {
+        total = (await s3.headObject(params).promise()).ContentLength;
+      } catch (err) {
+        log.error("Error with s3 headObject.");
+        log.error(err.stack);
+        return responseUtil.serverError(response, err);
+      }
 
-        if (!request.headers.range) {
+      response.setHeader("Accept-Ranges", "bytes");
+      response.setHeader("Content-type", mimeType);
+      if (request.headers.range) {
+        const range = parseRange(request.headers.range, total);
+        if (range === undefined) {
+          response.setHeader("Content-Range", `bytes */${total}`);
+          return response.status(416).end();
+        }
+        if (range !== null) {
+          const [start, end] = range;
+          params.Range = `bytes=${start}-${end}`;
           response.setHeader(
-            "Content-disposition",
-            "attachment; filename=" + filename
+            "Content-Range",
+            `bytes ${start}-${end}/${total}`
           );
-          response.setHeader("Content-type", mimeType);
-          response.setHeader("Content-Length", data.ContentLength);
-          response.write(data.Body, "binary");
-          return response.end(null, "binary");
+          response.setHeader("Content-Length", end - start + 1);
+          response.status(206);
         }
+      }
+      if (!params.Range) {
+        response.setHeader(
+          "Content-disposition",
+          "attachment; filename=" + filename
+        );
+        response.setHeader("Content-Length", total);
+      }
 
-        const range = request.headers.range;
-        const positions = range.replace(/bytes=/, "").split("-");
-        const start = parseInt(positions[0], 10);
-        const total = (data.Body as Buffer).length;
-        const end = positions[1] ? parseInt(positions[1], 10) : total - 1;
-        const chunksize = end - start + 1;
-
-        const headers = {
-          "Content-Range": "bytes " + start + "-" + end + "/" + total,
-          "Content-Length": chunksize,
-          "Accept-Ranges": "bytes",
-          "Content-type": mimeType
-        };
-
-        response.writeHead(206, headers);
-
-        const bufStream = new stream.PassThrough();
-        const b2 = (data.Body as Buffer).slice(start, end + 1);
-        bufStream.end(b2);
-        bufStream.pipe(response);
+      // Stream the object rather than holding it all in memory.
+      const body = s3.getObject(params).createReadStream();
+      body.on("error", (err) => {
+        log.error("Error with s3 getObject.");
+        log.error(err.stack);
+        response.destroy(err);
       });
+      body.pipe(response);
     })
   );
 }
+
+// Parses a single byte range from a Range header.  Returns the first
+// and last byte positions, null if the header should be ignored, or
+// undefined if the range can't be satisfied.
+function parseRange(
+  header: string,
+  total: number
+): [number, number] | null | undefined {
+  const match = /^bytes=(\d*)-(\d*)$/.exec(header.trim());
+  if (!match || (match[1] === "" && match[2] === "")) {
+    // Multiple or malformed ranges are ignored and the whole file sent.
+    return null;
+  }
+  let start, end;
+  if (match[1] === "") {
+    // A suffix range, giving the number of bytes at the end of the file.
+    start = Math.max(total - parseInt(match[2], 10), 0);
+    end = total - 1;
+  } else {
+    start = parseInt(match[1], 10);
+    end =
+      match[2] === ""
+        ? total - 1
+        : Math.min(parseInt(match[2], 10), total - 1);
+  }
+  if (start > end || start >= total) {
+    return undefined;
+  }
+  return [start, end];
+}
@@ -24,13 +24,37 @@ import responseUtil from "./responseUtil";
 import config from "../../config";
 import modelsUtil from "../../models/util/util";
 import crypto from "crypto";
+import { Readable, Transform } from "stream";
+import { ClientError } from "../customErrors";
 
-function multipartUpload(keyPrefix, buildRecord) {
+function newObjectKey(keyPrefix: string): string {
+  return keyPrefix + "/" + moment().format("YYYY/MM/DD/") + uuidv4();
+}
+
+// Passes data through unchanged, adding it to hash on the way.
+function hashingStream(hash: crypto.Hash): Transform {
+  return new Transform({
+    transform(chunk, encoding, callback) {
+      hash.update(chunk);
+      callback(null, chunk);
+    }
+  });
+}
+
+// findDuplicate, if given, is called with the upload's data and returns
+// the id of an existing record for the same file.  In that case the file
+// is discarded and the existing id returned.  If the data field arrives
+// before the file part this happens before anything is stored, otherwise
+// the stored file is deleted again once the form has been read.
+function multipartUpload(keyPrefix, buildRecord, findDuplicate?) {
   return (request, response) => {
-    const key = keyPrefix + "/" + moment().format("YYYY/MM/DD/") + uuidv4();
+    const key = newObjectKey(keyPrefix);
+    const hash = crypto.createHash("sha1");
     let data;
     let filename;
     let upload;
+    let duplicateId;
+    let checkedForDuplicate = false;
 
     // Note regarding multiparty: there are no guarantees about the
     // order that the field and part handlers will be called. You need
@@ -60,18 +84,29 @@ function multipartUpload(keyPrefix, buildRecord) {
       }
       filename = part.filename;
 
-      upload = modelsUtil
-        .openS3()
-        .upload({
-          Bucket: config.s3.bucket,
-          Key: key,
-          Body: part
-        })
-        .promise()
-        .catch((err) => {
-          return err;
-        });
-      log.debug("Started streaming upload to bucket...");
+      upload = (async () => {
+        // The data field normally arrives before the file, so a duplicate
+        // can be spotted before anything is written to the bucket.
+        if (data && findDuplicate) {
+          checkedForDuplicate = true;
+          duplicateId = await findDuplicate(request, data);
+          if (duplicateId) {
+            part.resume();
+            return;
+          }
+        }
+        log.debug("Started streaming upload to bucket...");
+        return modelsUtil
+          .openS3()
+          .upload({
+            Bucket: config.s3.bucket,
+            Key: key,
+            Body: part.pipe(hashingStream(hash))
+          })
+          .promise();
+      })().catch((err) => {
+        return err;
+      });
     });
 
     // Handle any errors. If this is called, the close handler
@@ -99,76 +134,402 @@ function multipartUpload(keyPrefix, buildRecord) {
         return;
       }
 
-      let dbRecord;
-      try {
-        // Wait for the upload to complete.
-        const uploadResult = await upload;
-        if (uploadResult instanceof Error) {
-          responseUtil.serverError(response, uploadResult);
-          return;
-        }
-        log.info("Finished streaming upload to object store. Key:", key);
-
-        // Optional file integrity check, opt-in to be backward compatible with existing clients.
-        if (data.fileHash) {
-          // TODO: ***Maybe*** check if fileHash already exists in DB?  We may actually want to allow duplicate files though,
-          //  so maybe rather than disallowing the entry being created, we should just make a new recording that
-          //  references the same data (fileKey, tracks etc) as the existing recording?  Then we just want to make sure
-          //  we stop running our script to prune duplicates.
-
-          log.info("Checking file hash. Key:", key);
-          // Read the full file back from s3 and hash it
-          const fileData = await modelsUtil
-            .openS3()
-            .getObject({
-              Bucket: config.s3.bucket,
-              Key: key
-            })
-            .promise()
-            .catch((err) => {
-              return err;
-            });
-          const checkHash = crypto
-            .createHash("sha1")
-            // @ts-ignore
-            .update(new Uint8Array(fileData.Body), "binary")
-            .digest("hex");
-          if (data.fileHash !== checkHash) {
-            log.error("File hash check failed, deleting key:", key);
-            // Hash check failed, delete the file from s3, and return an error which the client can respond to to decide
-            // whether or not to retry immediately.
-            await modelsUtil
-              .openS3()
-              .deleteObject({
-                Bucket: config.s3.bucket,
-                Key: key
-              })
-              .promise()
-              .catch((err) => {
-                return err;
-              });
-            responseUtil.invalidDatapointUpload(
-              response,
-              "Uploaded file integrity check failed, please retry."
-            );
-            return;
-          }
+      // Wait for the upload to complete.
+      const uploadResult = await upload;
+      if (uploadResult instanceof Error) {
+        responseUtil.serverError(response, uploadResult);
+        return;
+      }
+      if (!checkedForDuplicate && findDuplicate) {
+        // The data field came after the file, so the file has been stored.
+        duplicateId = await findDuplicate(request, data).catch((err) => {
+          log.warn("Failed to check for a duplicate upload:", err.message);
+          return null;
+        });
+        if (duplicateId) {
+          await deleteS3Object(key).catch((err) =>
+            log.warn("Failed to delete duplicate upload:", err.message)
+          );
         }
+      }
+      if (duplicateId) {
+        log.info("Upload is a duplicate of", duplicateId);
+        responseUtil.validRecordingUpload(response, duplicateId);
+        return;
+      }
+      log.info("Finished streaming upload to object store. Key:", key);
+      await saveUpload(
+        request,
+        response,
+        buildRecord,
+        data,
+        key,
+        filename,
+        hash.digest("hex")
+      );
+    });
 
-        data.filename = filename;
+    form.parse(request);
+  };
+}
 
-        // Store a record for the upload.
-        dbRecord = await buildRecord(request, data, key);
-        await dbRecord.validate();
-        await dbRecord.save();
-      } catch (err) {
-        responseUtil.serverError(response, err);
+// Check the integrity of an object that has been uploaded to key, then
+// store a record for it.  receivedHash is the SHA-1 of the bytes that were
+// streamed to the object store.  Returns the id of the stored record, or
+// null if it wasn't stored.
+async function saveUpload(
+  request,
+  response,
+  buildRecord,
+  data,
+  key,
+  filename,
+  receivedHash: string
+): Promise<number | null> {
+  let dbRecord;
+  try {
+    // Optional file integrity check, opt-in to be backward compatible with existing clients.
+    if (data.fileHash && data.fileHash !== receivedHash) {
+      log.error("File hash check failed, deleting key:", key);
+      // Hash check failed, delete the file from s3, and return an error which the client can respond to to decide
+      // whether or not to retry immediately.
+      await deleteS3Object(key).catch((err) => {
+        return err;
+      });
+      responseUtil.invalidDatapointUpload(
+        response,
+        "Uploaded file integrity check failed, please retry."
+      );
+      return null;
+    }
+
+    data.filename = filename;
+
+    // Store a record for the upload.
+    dbRecord = await buildRecord(request, data, key);
+    await dbRecord.validate();
+    await dbRecord.save();
+  } catch (err) {
+    responseUtil.serverError(response, err);
+    return null;
+  }
+  responseUtil.validRecordingUpload(response, dbRecord.id);
+  return dbRecord.id;
+}
+
+// Chunked upload sessions.
+//
+// A session lets a device send a large file as a series of chunks and
+// resume after a dropped connection by sending only the chunks that
+// didn't arrive.  All of the session state lives in the object store
+// under uploads/<deviceId>/<uploadId>/: the upload details in
+// session.json and each chunk as its own object, named after its byte
+// offset.  When the session is finalised the chunks are streamed, in
+// order, into a single object and the recording is created from that.
+// The session and its chunks are then replaced by complete.json, which
+// records the recording's id so that a repeated finalise gets the same
+// answer.
+
+const UPLOAD_SESSION_PREFIX = "uploads";
+const CHUNK_OFFSET_DIGITS = 15;
+
+interface UploadSession {
+  data: any;
+  size: number;
+  filename?: string;
+}
+
+function uploadSessionKey(device, uploadId: string): string {
+  return `${UPLOAD_SESSION_PREFIX}/${device.id}/${uploadId}`;
+}
+
+function chunkKey(sessionKey: string, offset: number): string {
+  return `${sessionKey}/chunks/${String(offset).padStart(
+    CHUNK_OFFSET_DIGITS,
+    "0"
+  )}`;
+}
+
+// Returns the id of the recording made by finalising the session, or null
+// if it hasn't been finalised.
+async function completedUpload(sessionKey: string): Promise<number | null> {
+  const object = await modelsUtil
+    .openS3()
+    .getObject({
+      Bucket: config.s3.bucket,
+      Key: `${sessionKey}/complete.json`
+    })
+    .promise()
+    .catch((err) => {
+      if (err.code === "NoSuchKey") {
+        return null;
+      }
+      throw err;
+    });
+  if (object == null) {
+    return null;
+  }
+  return JSON.parse(object.Body.toString()).recordingId;
+}
+
+async function readUploadSession(sessionKey: string): Promise<UploadSession> {
+  const object = await modelsUtil
+    .openS3()
+    .getObject({
+      Bucket: config.s3.bucket,
+      Key: `${sessionKey}/session.json`
+    })
+    .promise()
+    .catch((err) => {
+      if (err.code === "NoSuchKey") {
+        throw new ClientError("Unknown upload session.");
+      }
+      throw err;
+    });
+  return JSON.parse(object.Body.toString());
+}
+
+// Returns a map from the offset of each chunk received so far to its length.
+async function receivedChunks(
+  sessionKey: string
+): Promise<Map<number, number>> {
+  const chunks = new Map();
+  const prefix = `${sessionKey}/chunks/`;
+  let continuationToken;
+  do {
+    const listing = await modelsUtil
+      .openS3()
+      .listObjectsV2({
+        Bucket: config.s3.bucket,
+        Prefix: prefix,
+        ContinuationToken: continuationToken
+      })
+      .promise();
+    for (const object of listing.Contents) {
+      chunks.set(Number(object.Key.slice(prefix.length)), object.Size);
+    }
+    continuationToken = listing.NextContinuationToken;
+  } while (continuationToken);
+  return chunks;
+}
+
+// The number of bytes, from the start of the file, that have been
+// received without any gaps.
+function contiguousOffset(chunks: Map<number, number>): number {
+  let offset = 0;
+  while (chunks.get(offset) > 0) {
+    offset += chunks.get(offset);
+  }
+  return offset;
+}
+
+// findDuplicate is as for multipartUpload.  If it finds an existing
+// record no session is created, and its id is returned as recordingId
+// without the client having sent any of the file.
+function createUploadSession(findDuplicate?) {
+  return async (request, response) => {
+    const data = request.body.data;
+    if (findDuplicate) {
+      const duplicateId = await findDuplicate(request, data);
+      if (duplicateId) {
+        log.info("Upload is a duplicate of", duplicateId);
+        responseUtil.validRecordingUpload(response, duplicateId);
         return;
       }
-      responseUtil.validRecordingUpload(response, dbRecord.id);
+    }
+
+    const uploadId = uuidv4();
+    const session: UploadSession = {
+      data,
+      size: request.body.size,
+      filename: request.body.filename
+    };
+    await modelsUtil
+      .openS3()
+      .putObject({
+        Bucket: config.s3.bucket,
+        Key: `${uploadSessionKey(request.device, uploadId)}/session.json`,
+        Body: JSON.stringify(session)
+      })
+      .promise();
+    responseUtil.send(response, {
+      statusCode: 200,
+      messages: ["Upload session created."],
+      uploadId,
+      offset: 0
     });
+  };
+}
 
-    form.parse(request);
+async function getUploadStatus(request, response) {
+  const sessionKey = uploadSessionKey(request.device, request.params.uploadId);
+  const session = await readUploadSession(sessionKey);
+  responseUtil.send(response, {
+    statusCode: 200,
+    messages: [],
+    size: session.size,
+    offset: contiguousOffset(await receivedChunks(sessionKey))
+  });
+}
+
+async function uploadChunk(request, response) {
+  const sessionKey = uploadSessionKey(request.device, request.params.uploadId);
+  const session = await readUploadSession(sessionKey);
+  const offset = request.query.offset;
+  const length = Number(request.headers["content-length"]);
+  if (!(length > 0) || offset + length > session.size) {
+    throw new ClientError("Chunk does not fit within the upload.");
+  }
+
+  // Count what actually arrives so that a chunk cut short by a dropped
+  // connection isn't kept.
+  let received = 0;
+  const body = new Transform({
+    transform(chunk, encoding, callback) {
+      received += chunk.length;
+      callback(null, chunk);
+    }
+  });
+  request.on("aborted", () => body.destroy(new Error("Chunk upload aborted")));
+  const key = chunkKey(sessionKey, offset);
+  await modelsUtil
+    .openS3()
+    .upload({
+      Bucket: config.s3.bucket,
+      Key: key,
+      Body: request.pipe(body)
+    })
+    .promise();
+  if (received !== length) {
+    await deleteS3Object(key);
+    throw new ClientError("Chunk was incomplete, please retry.");
+  }
+
+  responseUtil.send(response, {
+    statusCode: 200,
+    messages: ["Chunk received."],
+    offset: contiguousOffset(await receivedChunks(sessionKey))
+  });
+}
+
+async function deleteUploadSession(sessionKey: string, chunks: number[]) {
+  const keys = [`${sessionKey}/session.json`].concat(
+    chunks.map((offset) => chunkKey(sessionKey, offset))
+  );
+  // deleteObjects accepts at most 1000 keys at a time.
+  for (let i = 0; i < keys.length; i += 1000) {
+    await modelsUtil
+      .openS3()
+      .deleteObjects({
+        Bucket: config.s3.bucket,
+        Delete: {
+          Objects: keys.slice(i, i + 1000).map((Key) => ({ Key })),
+          Quiet: true
+        }
+      })
+      .promise();
+  }
+}
+
+function finalizeUpload(keyPrefix, buildRecord) {
+  return async (request, response) => {
+    const sessionKey = uploadSessionKey(
+      request.device,
+      request.params.uploadId
+    );
+    const completedId = await completedUpload(sessionKey);
+    if (completedId != null) {
+      responseUtil.validRecordingUpload(response, completedId);
+      return;
+    }
+    const session = await readUploadSession(sessionKey);
+    const chunks = await receivedChunks(sessionKey);
+    const received = contiguousOffset(chunks);
+    if (received < session.size) {
+      throw new ClientError(
+        `Upload is incomplete, received ${received} of ${session.size} bytes.`
+      );
+    }
+
+    const offsets = [];
+    for (let offset = 0; offset < session.size; offset += chunks.get(offset)) {
+      offsets.push(offset);
+    }
+    async function* concatenateChunks() {
+      for (const offset of offsets) {
+        yield* modelsUtil
+          .openS3()
+          .getObject({
+            Bucket: config.s3.bucket,
+            Key: chunkKey(sessionKey, offset)
+          })
+          .createReadStream();
+      }
+    }
+
+    const key = newObjectKey(keyPrefix);
+    const hash = crypto.createHash("sha1");
+    await modelsUtil
+      .openS3()
+      .upload({
+        Bucket: config.s3.bucket,
+        Key: key,
+        Body: Readable.from(concatenateChunks()).pipe(hashingStream(hash))
+      })
+      .promise();
+    log.info("Finished assembling chunked upload. Key:", key);
+
+    const chunkOffsets = Array.from(chunks.keys());
+    const receivedHash = hash.digest("hex");
+    if (session.data.fileHash && session.data.fileHash !== receivedHash) {
+      // Finalising again would assemble the same bad chunks, so the session
+      // is discarded and the file has to be uploaded again.
+      log.error("Chunked upload hash check failed, discarding:", sessionKey);
+      await deleteS3Object(key).catch((err) => err);
+      await deleteUploadSession(sessionKey, chunkOffsets).catch((err) =>
+        log.warn("Failed to clean up upload session:", err.message)
+      );
+      responseUtil.invalidDatapointUpload(
+        response,
+        "Uploaded file integrity check failed, please start a new upload."
+      );
+      return;
+    }
+
+    const recordingId = await saveUpload(
+      request,
+      response,
+      buildRecord,
+      session.data,
+      key,
+      session.filename,
+      receivedHash
+    );
+    if (recordingId == null) {
+      // The chunks are kept so that finalising can be retried, but the
+      // assembled object would be left behind by every attempt.  Sessions
+      // that are never finalised are removed by prune-objects once they
+      // have been idle for a while.
+      await deleteS3Object(key).catch((err) =>
+        log.warn("Failed to delete assembled upload:", err.message)
+      );
+      return;
+    }
+
+    await modelsUtil
+      .openS3()
+      .putObject({
+        Bucket: config.s3.bucket,
+        Key: `${sessionKey}/complete.json`,
+        Body: JSON.stringify({ recordingId })
+      })
+      .promise()
+      .catch((err) =>
+        log.warn("Failed to mark upload session complete:", err.message)
+      );
+    await deleteUploadSession(sessionKey, chunkOffsets).catch((err) =>
+      log.warn("Failed to clean up upload session:", err.message)
+    );
   };
 }
 
@@ -205,5 +566,9 @@ export default {
   getS3Object,
   deleteS3Object,
   getS3ObjectFileSize,
-  multipartUpload
+  multipartUpload,
+  createUploadSession,
+  getUploadStatus,
+  uploadChunk,
+  finalizeUpload
 };
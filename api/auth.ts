@@ -129,12 +129,60 @@ const authenticate = function (
   };
 };
 
+// Users and devices referenced by JWTs are remembered for a short time so
+// that most authenticated requests don't need to query for them.  Only
+// their values are kept and each request gets its own instance built from
+// them, so nothing set on an instance while handling one request is seen by
+// another.  Routes that change a user or device must call forgetEntity.
+const ENTITY_CACHE_SIZE = 1000;
+const ENTITY_CACHE_TTL_MS = 30 * 1000;
+
+const entityCache: Map<string, { values: any; expires: number }> = new Map();
+
+function entityCacheKey(type: string, id: number | string): string {
+  return `${type}:${id}`;
+}
+
+async function lookupCachedEntity(model, type: string, id) {
+  const key = entityCacheKey(type, id);
+  const cached = entityCache.get(key);
+  if (cached) {
+    // Reinsert so that the Map's insertion order is also recency order.
+    entityCache.delete(key);
+    if (cached.expires > Date.now()) {
+      entityCache.set(key, cached);
+      return model.build(cached.values, { isNewRecord: false, raw: true });
+    }
+  }
+
+  const entity = await model.findByPk(id);
+  if (entity) {
+    entityCache.set(key, {
+      values: entity.get({ plain: true }),
+      expires: Date.now() + ENTITY_CACHE_TTL_MS
+    });
+    if (entityCache.size > ENTITY_CACHE_SIZE) {
+      // Evict the least recently used entry.
+      entityCache.delete(entityCache.keys().next().value);
+    }
+  }
+  return entity;
+}
+
+/*
+ * Forget a user or device so that the next request authenticating as it
+ * fetches it from the database again.
+ */
+function forgetEntity(type: "user" | "device", id: number) {
+  entityCache.delete(entityCacheKey(type, id));
+}
+
 async function lookupEntity(jwtDecoded) {
   switch (jwtDecoded._type) {
     case "user":
-      return models.User.findByPk(jwtDecoded.id);
+      return lookupCachedEntity(models.User, "user", jwtDecoded.id);
     case "device":
-      return models.Device.findByPk(jwtDecoded.id);
+      return lookupCachedEntity(models.Device, "device", jwtDecoded.id);
     case "fileDownload":
       return jwtDecoded;
     default:
@@ -162,7 +210,7 @@ const authenticateAdmin = async (req, res, next) => {
   if (jwtDecoded._type != "user") {
     return res.status(403).json({ messages: ["Admin has to be a user"] });
   }
-  const user = await models.User.findByPk(jwtDecoded.id);
+  const user = await lookupEntity(jwtDecoded);
   if (!user) {
     return res
       .status(401)
@@ -322,6 +370,7 @@ const userHasWriteAccessToGroup = async (request, response, next) => {
 
 export default {
   createEntityJWT,
+  forgetEntity,
   authenticateUser,
   authenticateDevice,
   authenticateAny,
@@ -0,0 +1,54 @@
+/*
+cacophony-api: The Cacophony Project API server
+Copyright (C) 2018  The Cacophony Project
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*/
+
+import compression from "compression";
+import { Request, Response } from "express";
+
+// Responses smaller than this (in bytes) are sent uncompressed as the
+// saving isn't worth the CPU time.
+const COMPRESSION_THRESHOLD = 1024;
+
+// Only these content types are compressed.  Recordings and other uploaded
+// files are mostly already compressed, and are served with byte ranges
+// which must refer to the stored bytes.
+const COMPRESSIBLE_TYPES = [
+  "application/json",
+  "application/javascript",
+  "text/csv",
+  "text/css",
+  "text/html",
+  "text/plain"
+];
+
+function shouldCompress(request: Request, response: Response): boolean {
+  const contentType = response.getHeader("Content-Type");
+  if (!contentType) {
+    return false;
+  }
+  const mimeType = String(contentType).split(";")[0].trim().toLowerCase();
+  return (
+    COMPRESSIBLE_TYPES.includes(mimeType) &&
+    compression.filter(request, response)
+  );
+}
+
+// Compresses responses with gzip or deflate, as accepted by the client.
+export default compression({
+  threshold: COMPRESSION_THRESHOLD,
+  filter: shouldCompress
+});
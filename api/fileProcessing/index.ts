@@ -14,6 +14,14 @@ import {
 export default function (app: Application) {
   const apiUrl = "/api/fileProcessing";
 
+  // The most recordings that can be claimed by a single request.
+  const maxBatchCount = 100;
+  // The longest a request can wait for a recording to process.
+  const maxWaitSeconds = 60;
+  // How often a waiting request checks the database again, to pick up
+  // recordings queued through another server.
+  const waitPollMs = 5000;
+
   /**
    * @api {get} /api/fileProcessing Get a new file processing job
    * @apiName getNewFileProcessingJob
@@ -21,22 +29,92 @@ export default function (app: Application) {
    *
    * @apiParam {String} type Type of recording.
    * @apiParam {String} state Processing state.
+   * @apiParam {Integer} [count] Claim up to this many recordings (at most 100)
+   * at once. They are returned as a `recordings` array instead of a single
+   * `recording`.
+   * @apiParam {Integer} [wait] If there is nothing to process, wait up to
+   * this many seconds (at most 60) for a recording to become available
+   * before responding.
    */
   app.get(apiUrl, async (request: Request, response: Response) => {
     log.info(`${request.method} Request: ${request.url}`);
     const type = request.query.type as RecordingType;
     const state = request.query.state as RecordingProcessingState;
-    const recording = await models.Recording.getOneForProcessing(type, state);
-    if (recording == null) {
+    const errorMessages = [];
+    let count = 1;
+    if (request.query.count != null) {
+      count = parseInt(request.query.count as string);
+      if (isNaN(count) || count < 1 || count > maxBatchCount) {
+        errorMessages.push(
+          `'count' field needs to be a number from 1 to ${maxBatchCount}.`
+        );
+      }
+    }
+    let wait = 0;
+    if (request.query.wait != null) {
+      wait = parseInt(request.query.wait as string);
+      if (isNaN(wait) || wait < 0 || wait > maxWaitSeconds) {
+        errorMessages.push(
+          `'wait' field needs to be a number from 0 to ${maxWaitSeconds}.`
+        );
+      }
+    }
+    if (errorMessages.length > 0) {
+      return response.status(400).json({
+        messages: errorMessages
+      });
+    }
+
+    // Stop waiting as soon as the worker goes away, so that nothing is
+    // claimed for a request that can no longer be answered.
+    let closed = false;
+    const requestClosed = new Promise<void>((resolve) =>
+      response.on("close", () => {
+        closed = true;
+        resolve();
+      })
+    );
+
+    const deadline = Date.now() + wait * 1000;
+    let recordings = await models.Recording.getBatchForProcessing(
+      type,
+      state,
+      count
+    );
+    while (recordings.length == 0 && !closed && Date.now() < deadline) {
+      await Promise.race([
+        models.Recording.waitForProcessing(
+          type,
+          state,
+          Math.min(deadline - Date.now(), waitPollMs)
+        ),
+        requestClosed
+      ]);
+      if (closed) {
+        log.debug("File processing request closed while waiting.");
+        break;
+      }
+      recordings = await models.Recording.getBatchForProcessing(
+        type,
+        state,
+        count
+      );
+    }
+
+    if (recordings.length == 0) {
       log.debug("No file to be processed.");
       return response.status(204).json();
-    } else {
+    }
+    if (request.query.count != null) {
       return response.status(200).json({
-        // FIXME(jon): Test that dataValues is even a thing.  It's not a publicly
-        //  documented sequelize property.
-        recording: (recording as any).dataValues
+        recordings: recordings.map((recording) => (recording as any).dataValues)
       });
     }
+    return response.status(200).json({
+      // FIXME(jon): Test that dataValues is even a thing.  It's not a publicly
+      //  documented sequelize property.
+      recording: (recordings[0] as any).dataValues
+    });
   });
 
   /**
@@ -109,6 +187,7 @@ export default function (app: Application) {
 
         recording.set("jobKey", null);
         recording.set("processingStartTime", null);
+        recording.set("processingHeartbeat", null);
       }
       const nextJob = recording.getNextState();
       recording.set("processingState", nextJob);
@@ -138,6 +217,43 @@ export default function (app: Application) {
     }
   });
 
+  /**
+   * @api {post} /api/fileProcessing/:id/heartbeat Show a processing job is still running
+   * @apiName fileProcessingHeartbeat
+   * @apiGroup FileProcessing
+   *
+   * @apiDescription Records that the worker holding a job is still alive,
+   * extending its lease. Workers should call this regularly while
+   * processing a recording so that stale jobs can be told apart from
+   * long running ones.
+   *
+   * @apiParam {String} jobKey Key given when requesting the job.
+   *
+   * @apiUse V1ResponseSuccess
+   * @apiuse V1ResponseError
+   */
+  app.post(
+    `${apiUrl}/:id/heartbeat`,
+    [param("id").isInt().toInt(), body("jobKey").isString()],
+    middleware.requestWrapper(async (request: Request, response) => {
+      const [updated] = await models.Recording.update(
+        { processingHeartbeat: new Date().toISOString() },
+        { where: { id: request.params.id, jobKey: request.body.jobKey } }
+      );
+      if (updated == 0) {
+        responseUtil.send(response, {
+          statusCode: 400,
+          messages: ["No job for that recording and jobKey."]
+        });
+        return;
+      }
+      responseUtil.send(response, {
+        statusCode: 200,
+        messages: ["Heartbeat recorded."]
+      });
+    })
+  );
+
   /**
    * @api {post} /api/fileProcessing/tags Add a tag to a recording
    * @apiName tagRecordingAfterFileProcessing
@@ -242,6 +358,79 @@ export default function (app: Application) {
     })
   );
 
+  /**
+   * @api {post} /api/fileProcessing/:id/tracks/batch Add tracks and their tags to a recording
+   * @apiName PostTracksWithTags
+   * @apiGroup FileProcessing
+   *
+   * @apiDescription Adds all the tracks found for a recording, along with
+   * their automatic tags, in a single transaction.
+   *
+   * @apiParam {JSON} tracks Array of tracks. Each track has `data` which
+   * defines the track, and optionally `tags`, an array of objects with
+   * `what`, `confidence` and `data` fields.
+   * @apiParam {JSON} algorithm Tracking algorithm details, as passed to
+   * (#FileProcessing:Algorithm).
+   *
+   * @apiUse V1ResponseSuccess
+   * @apiSuccess {JSON} tracks Array of `trackId` and `trackTagIds` for the
+   * new tracks, in the order given.
+   *
+   * @apiuse V1ResponseError
+   *
+   */
+  app.post(
+    `${apiUrl}/:id/tracks/batch`,
+    [
+      param("id").isInt().toInt(),
+      middleware.parseJSON("tracks", body),
+      middleware.parseJSON("algorithm", body)
+    ],
+    middleware.requestWrapper(async (request: Request, response) => {
+      const tracks = request.body.tracks;
+      if (
+        !Array.isArray(tracks) ||
+        !tracks.every(
+          (track) => track.data != null && (track.tags || []).every(isValidTag)
+        )
+      ) {
+        responseUtil.send(response, {
+          statusCode: 400,
+          messages: [
+            "'tracks' must be an array of tracks with data and valid tags."
+          ]
+        });
+        return;
+      }
+      const recording = await models.Recording.findByPk(request.params.id);
+      if (!recording) {
+        responseUtil.send(response, {
+          statusCode: 400,
+          messages: ["No such recording."]
+        });
+        return;
+      }
+      const algorithm = await models.DetailSnapshot.getOrCreateMatching(
+        "algorithm",
+        request.body.algorithm
+      );
+      const added = await recording.addTracks(tracks, algorithm.id);
+      responseUtil.send(response, {
+        statusCode: 200,
+        messages: ["Tracks added."],
+        tracks: added
+      });
+    })
+  );
+
+  function isValidTag(tag): boolean {
+    return (
+      tag != null &&
+      typeof tag.what === "string" &&
+      typeof tag.confidence === "number"
+    );
+  }
+
   /**
    * @api {delete} /api/fileProcessing/:id/tracks Delete all tracks for a recording
    * @apiName DeleteTracks
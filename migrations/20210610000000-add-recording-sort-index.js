@@ -0,0 +1,17 @@
+"use strict";
+
+module.exports = {
+  up: async (queryInterface) => {
+    // Matches the default recording query order so keyset pagination can
+    // seek straight to the next page.
+    await queryInterface.sequelize.query(
+      `CREATE INDEX recordings_sort_datetime_id ON "Recordings" ((COALESCE("recordingDateTime", '1970-01-01')) DESC, id DESC);`
+    );
+  },
+
+  down: async (queryInterface) => {
+    await queryInterface.sequelize.query(
+      `DROP INDEX recordings_sort_datetime_id;`
+    );
+  }
+};
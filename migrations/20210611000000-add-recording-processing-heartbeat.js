@@ -0,0 +1,14 @@
+"use strict";
+module.exports = {
+  up: async function (queryInterface, Sequelize) {
+    await queryInterface.addColumn(
+      "Recordings",
+      "processingHeartbeat",
+      Sequelize.DATE
+    );
+  },
+
+  down: async function (queryInterface) {
+    await queryInterface.removeColumn("Recordings", "processingHeartbeat");
+  }
+};
@@ -0,0 +1,16 @@
+"use strict";
+
+module.exports = {
+  up: function (queryInterface) {
+    return queryInterface.addIndex("Recordings", {
+      fields: ["DeviceId", "rawFileHash"]
+    });
+  },
+
+  down: function (queryInterface) {
+    return queryInterface.removeIndex("Recordings", [
+      "DeviceId",
+      "rawFileHash"
+    ]);
+  }
+};
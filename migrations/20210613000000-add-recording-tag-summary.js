@@ -0,0 +1,144 @@
+"use strict";
+
+// Each recording keeps a summary of the labels of its tags so that tag mode
+// queries can be answered from indexed columns on "Recordings" rather than by
+// searching "Tags" and "TrackTags" for every candidate recording.
+//
+// "<kind>TrackTags" holds the what of the tags on the recording's unarchived
+// tracks and "<kind>RecordingTags" the what and detail of its recording tags,
+// where kind is "human", "automatic" or nothing for tags of any kind.  Every
+// tag also contributes '*', and '*interesting' if it counts as interesting.
+// The columns are kept up to date by triggers on "Tags", "Tracks" and
+// "TrackTags".
+const summaryColumns = [
+  ["trackTags", "track_tag_labels(recording_id, NULL)"],
+  ["humanTrackTags", "track_tag_labels(recording_id, false)"],
+  ["automaticTrackTags", "track_tag_labels(recording_id, true)"],
+  ["recordingTags", "recording_tag_labels(recording_id, NULL)"],
+  ["humanRecordingTags", "recording_tag_labels(recording_id, false)"],
+  ["automaticRecordingTags", "recording_tag_labels(recording_id, true)"]
+];
+
+module.exports = {
+  up: async function (queryInterface) {
+    const query = (sql) => queryInterface.sequelize.query(sql);
+
+    for (const [column] of summaryColumns) {
+      await query(
+        `ALTER TABLE "Recordings" ADD COLUMN "${column}" TEXT[] NOT NULL DEFAULT '{}'`
+      );
+      await query(
+        `CREATE INDEX "recordings_${column}" ON "Recordings" USING GIN ("${column}")`
+      );
+    }
+
+    await query(`
+      CREATE FUNCTION track_tag_labels(recording_id INTEGER, is_automatic BOOLEAN)
+      RETURNS TEXT[] AS $$
+        SELECT COALESCE(array_agg(DISTINCT label), '{}') FROM (
+          SELECT unnest(ARRAY[
+            '*',
+            tt."what",
+            CASE WHEN tt."what" != 'bird' AND tt."what" != 'false positive'
+              THEN '*interesting' END
+          ]) AS label
+          FROM "Tracks" t JOIN "TrackTags" tt ON tt."TrackId" = t.id
+          WHERE t."RecordingId" = recording_id
+            AND t."archivedAt" IS NULL
+            AND (is_automatic IS NULL OR tt.automatic = is_automatic)
+        ) labels WHERE label IS NOT NULL
+      $$ LANGUAGE SQL STABLE`);
+
+    await query(`
+      CREATE FUNCTION recording_tag_labels(recording_id INTEGER, is_automatic BOOLEAN)
+      RETURNS TEXT[] AS $$
+        SELECT COALESCE(array_agg(DISTINCT label), '{}') FROM (
+          SELECT unnest(ARRAY[
+            '*',
+            t."what",
+            t."detail",
+            CASE WHEN (t."what" IS NULL OR t."what" != 'bird')
+              AND (t."detail" IS NULL OR t."detail" != 'false positive')
+              THEN '*interesting' END
+          ]) AS label
+          FROM "Tags" t
+          WHERE t."RecordingId" = recording_id
+            AND (is_automatic IS NULL OR t.automatic = is_automatic)
+        ) labels WHERE label IS NOT NULL
+      $$ LANGUAGE SQL STABLE`);
+
+    await query(`
+      CREATE FUNCTION update_recording_tag_summary(recording_id INTEGER)
+      RETURNS VOID AS $$
+        UPDATE "Recordings" SET
+          ${summaryColumns
+            .map(([column, labels]) => `"${column}" = ${labels}`)
+            .join(",\n          ")}
+        WHERE id = recording_id
+      $$ LANGUAGE SQL`);
+
+    await query(`
+      CREATE FUNCTION recording_tag_summary_trigger() RETURNS TRIGGER AS $$
+      BEGIN
+        IF TG_OP != 'INSERT' THEN
+          PERFORM update_recording_tag_summary(OLD."RecordingId");
+        END IF;
+        IF TG_OP != 'DELETE' THEN
+          PERFORM update_recording_tag_summary(NEW."RecordingId");
+        END IF;
+        RETURN NULL;
+      END
+      $$ LANGUAGE plpgsql`);
+
+    await query(`
+      CREATE FUNCTION track_tag_summary_trigger() RETURNS TRIGGER AS $$
+      BEGIN
+        IF TG_OP != 'INSERT' THEN
+          PERFORM update_recording_tag_summary(t."RecordingId")
+            FROM "Tracks" t WHERE t.id = OLD."TrackId";
+        END IF;
+        IF TG_OP != 'DELETE' THEN
+          PERFORM update_recording_tag_summary(t."RecordingId")
+            FROM "Tracks" t WHERE t.id = NEW."TrackId";
+        END IF;
+        RETURN NULL;
+      END
+      $$ LANGUAGE plpgsql`);
+
+    await query(`
+      CREATE TRIGGER tags_update_recording_tag_summary
+      AFTER INSERT OR UPDATE OR DELETE ON "Tags"
+      FOR EACH ROW EXECUTE PROCEDURE recording_tag_summary_trigger()`);
+    await query(`
+      CREATE TRIGGER tracks_update_recording_tag_summary
+      AFTER UPDATE OF "archivedAt", "RecordingId" OR DELETE ON "Tracks"
+      FOR EACH ROW EXECUTE PROCEDURE recording_tag_summary_trigger()`);
+    await query(`
+      CREATE TRIGGER track_tags_update_recording_tag_summary
+      AFTER INSERT OR UPDATE OR DELETE ON "TrackTags"
+      FOR EACH ROW EXECUTE PROCEDURE track_tag_summary_trigger()`);
+
+    await query(`
+      SELECT update_recording_tag_summary(id) FROM "Recordings" r
+      WHERE EXISTS (SELECT 1 FROM "Tags" WHERE "RecordingId" = r.id)
+        OR EXISTS (SELECT 1 FROM "Tracks" WHERE "RecordingId" = r.id)`);
+  },
+
+  down: async function (queryInterface) {
+    const query = (sql) => queryInterface.sequelize.query(sql);
+
+    await query(
+      `DROP TRIGGER track_tags_update_recording_tag_summary ON "TrackTags"`
+    );
+    await query(`DROP TRIGGER tracks_update_recording_tag_summary ON "Tracks"`);
+    await query(`DROP TRIGGER tags_update_recording_tag_summary ON "Tags"`);
+    await query("DROP FUNCTION track_tag_summary_trigger()");
+    await query("DROP FUNCTION recording_tag_summary_trigger()");
+    await query("DROP FUNCTION update_recording_tag_summary(INTEGER)");
+    await query("DROP FUNCTION recording_tag_labels(INTEGER, BOOLEAN)");
+    await query("DROP FUNCTION track_tag_labels(INTEGER, BOOLEAN)");
+    for (const [column] of summaryColumns) {
+      await query(`ALTER TABLE "Recordings" DROP COLUMN "${column}"`);
+    }
+  }
+};
@@ -0,0 +1,97 @@
+"use strict";
+
+// "CacophonyIndexHours" holds, for each device and UTC hour, the sum and
+// count of the cacophony index scores of the audio recordings made in that
+// hour.  A trigger on "Recordings" keeps it up to date as recordings are
+// uploaded, analysed, changed or deleted.
+module.exports = {
+  up: async function (queryInterface) {
+    const query = (sql) => queryInterface.sequelize.query(sql);
+
+    await query(`
+      CREATE TABLE "CacophonyIndexHours" (
+        "DeviceId" INTEGER NOT NULL
+          REFERENCES "Devices" (id) ON DELETE CASCADE ON UPDATE CASCADE,
+        "hour" TIMESTAMP WITH TIME ZONE NOT NULL,
+        "sum" DOUBLE PRECISION NOT NULL,
+        "count" INTEGER NOT NULL,
+        PRIMARY KEY ("DeviceId", "hour")
+      )`);
+
+    await query(`
+      CREATE FUNCTION cacophony_index_scores(metadata JSONB)
+      RETURNS SETOF DOUBLE PRECISION AS $$
+        SELECT (entry->>'index_percent')::DOUBLE PRECISION
+        FROM jsonb_array_elements(
+          CASE WHEN jsonb_typeof(metadata->'analysis'->'cacophony_index') = 'array'
+            THEN metadata->'analysis'->'cacophony_index'
+            ELSE '[]'::JSONB END
+        ) entry
+      $$ LANGUAGE SQL IMMUTABLE`);
+
+    await query(`
+      CREATE FUNCTION utc_hour(t TIMESTAMP WITH TIME ZONE)
+      RETURNS TIMESTAMP WITH TIME ZONE AS $$
+        SELECT date_trunc('hour', t AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'
+      $$ LANGUAGE SQL IMMUTABLE`);
+
+    await query(`
+      CREATE FUNCTION update_cacophony_index_hours() RETURNS TRIGGER AS $$
+      BEGIN
+        IF TG_OP != 'INSERT' AND OLD."type" = 'audio' THEN
+          UPDATE "CacophonyIndexHours" h
+          SET "sum" = h."sum" - scores.total, "count" = h."count" - scores.n
+          FROM (
+            SELECT sum(score) AS total, count(score) AS n
+            FROM cacophony_index_scores(OLD."additionalMetadata") score
+          ) scores
+          WHERE h."DeviceId" = OLD."DeviceId"
+            AND h."hour" = utc_hour(OLD."recordingDateTime")
+            AND scores.n > 0;
+        END IF;
+        IF TG_OP != 'DELETE' AND NEW."type" = 'audio'
+          AND NEW."DeviceId" IS NOT NULL
+          AND NEW."recordingDateTime" IS NOT NULL THEN
+          INSERT INTO "CacophonyIndexHours" ("DeviceId", "hour", "sum", "count")
+          SELECT NEW."DeviceId", utc_hour(NEW."recordingDateTime"),
+            sum(score), count(score)
+          FROM cacophony_index_scores(NEW."additionalMetadata") score
+          HAVING count(score) > 0
+          ON CONFLICT ("DeviceId", "hour") DO UPDATE SET
+            "sum" = "CacophonyIndexHours"."sum" + EXCLUDED."sum",
+            "count" = "CacophonyIndexHours"."count" + EXCLUDED."count";
+        END IF;
+        RETURN NULL;
+      END
+      $$ LANGUAGE plpgsql`);
+
+    await query(`
+      CREATE TRIGGER recordings_update_cacophony_index_hours
+      AFTER INSERT OR DELETE
+        OR UPDATE OF "additionalMetadata", "recordingDateTime", "DeviceId", "type"
+      ON "Recordings"
+      FOR EACH ROW EXECUTE PROCEDURE update_cacophony_index_hours()`);
+
+    await query(`
+      INSERT INTO "CacophonyIndexHours" ("DeviceId", "hour", "sum", "count")
+      SELECT "DeviceId", utc_hour("recordingDateTime"), sum(score), count(score)
+      FROM "Recordings", cacophony_index_scores("additionalMetadata") score
+      WHERE "type" = 'audio'
+        AND "DeviceId" IS NOT NULL
+        AND "recordingDateTime" IS NOT NULL
+      GROUP BY 1, 2
+      HAVING count(score) > 0`);
+  },
+
+  down: async function (queryInterface) {
+    const query = (sql) => queryInterface.sequelize.query(sql);
+
+    await query(
+      `DROP TRIGGER recordings_update_cacophony_index_hours ON "Recordings"`
+    );
+    await query("DROP FUNCTION update_cacophony_index_hours()");
+    await query("DROP FUNCTION utc_hour(TIMESTAMP WITH TIME ZONE)");
+    await query("DROP FUNCTION cacophony_index_scores(JSONB)");
+    await query('DROP TABLE "CacophonyIndexHours"');
+  }
+};
@@ -14,7 +14,6 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 */
 
 import { AuthorizationError, ClientError } from "../api/customErrors";
-import bcrypt from "bcrypt";
 import { format } from "util";
 import Sequelize, { FindOptions } from "sequelize";
 import { ModelCommon, ModelStaticCommon } from "./index";
@@ -25,6 +24,7 @@ import { DeviceUsersStatic } from "./DeviceUsers";
 import { ScheduleId } from "./Schedule";
 import { Event } from "./Event";
 import { AccessLevel } from "./GroupUsers";
+import passwords from "./util/passwords";
 
 const Op = Sequelize.Op;
 export type DeviceId = number;
@@ -36,6 +36,9 @@ export interface Device extends Sequelize.Model, ModelCommon<Device> {
   devicename: string;
   groupname: string;
   password?: string;
+  // Set when the device was found by wherePasswordMatches, so the password
+  // it was looked up with doesn't need to be compared again.
+  passwordMatched?: boolean;
   comparePassword: (password: string) => Promise<boolean>;
   reregister: (
     devicename: string,
@@ -202,6 +205,7 @@ export default function (
     }
 
     await device.addUser(userToAdd.id, { through: { admin: admin } });
+    userToAdd.clearAccessCache();
     return true;
   };
 
@@ -233,6 +237,7 @@ export default function (
     for (const i in deviceUsers) {
       await deviceUsers[i].destroy();
     }
+    userToRemove.clearAccessCache();
     return true;
   };
 
@@ -343,20 +348,21 @@ export default function (
 
   Device.wherePasswordMatches = async function (devices, password) {
     // checks if there is a unique devicename and password match, else returns null
-    const validDevices = [];
-    let passwordMatch = false;
-    for (let i = 0; i < devices.length; i++) {
-      passwordMatch = await devices[i].comparePassword(password);
-      if (passwordMatch) {
-        validDevices.push(devices[i]);
-      }
-    }
+    // The comparisons run concurrently so this takes about as long as one.
+    const matches = await Promise.all(
+      devices.map((device) => device.comparePassword(password))
+    );
+    const validDevices = devices.filter((device, i) => matches[i]);
     if (validDevices.length == 1) {
+      validDevices[0].passwordMatched = true;
       return validDevices[0];
     } else {
       if (validDevices.length > 1) {
         throw new Error(
-          format("Multiple devices match %s and supplied password", name)
+          format(
+            "Multiple devices match %s and supplied password",
+            validDevices[0].devicename
+          )
         );
       }
       return null;
@@ -384,6 +390,59 @@ export default function (
     });
   };
 
+  // The cacophony index is answered from "CacophonyIndexHours", which keeps
+  // the sum and count of each device's scores per UTC hour.  Only the hours
+  // that lie wholly inside the window are taken from there; recordings in
+  // the partial hours at either end of the window are read directly so the
+  // result is the same as averaging every score in the window.
+  //
+  // FIXME(jon): So the problem is that we're inserting recordings into the databases without
+  //  saying how to interpret the timestamps, so they are interpreted as being NZ time when they come in.
+  //  This happens to work when both the inserter and the DB are in the same timezone, but otherwise will
+  //  lead to spurious values.  Need to standardize input time.
+  function cacophonyIndexScores(
+    deviceId,
+    from: Date,
+    windowSizeInHours: number,
+    hourSql: (timeColumn: string) => string
+  ) {
+    const secondsPerHour = 60 * 60;
+    const windowEnd = Math.ceil(from.getTime() / 1000);
+    const windowStart = windowEnd - windowSizeInHours * secondsPerHour;
+    let wholeHoursStart =
+      Math.ceil(windowStart / secondsPerHour) * secondsPerHour;
+    let wholeHoursEnd = Math.floor(windowEnd / secondsPerHour) * secondsPerHour;
+    if (wholeHoursEnd <= wholeHoursStart) {
+      wholeHoursStart = wholeHoursEnd = windowEnd;
+    }
+
+    const sql = `
+  select ${hourSql('"hour"')} as hour, "sum" as total, "count" as n
+  from "CacophonyIndexHours"
+  where "DeviceId" = :deviceId
+    and "hour" >= to_timestamp(:wholeHoursStart)
+    and "hour" < to_timestamp(:wholeHoursEnd)
+  union all
+  select ${hourSql('"recordingDateTime"')} as hour, score as total, 1 as n
+  from "Recordings", cacophony_index_scores("additionalMetadata") score
+  where "DeviceId" = :deviceId
+    and "type" = 'audio'
+    and score is not null
+    and "recordingDateTime" between to_timestamp(:windowStart) and to_timestamp(:windowEnd)
+    and not ("recordingDateTime" >= to_timestamp(:wholeHoursStart)
+      and "recordingDateTime" < to_timestamp(:wholeHoursEnd))`;
+    return {
+      sql,
+      replacements: {
+        deviceId,
+        windowStart,
+        windowEnd,
+        wholeHoursStart,
+        wholeHoursEnd
+      }
+    };
+  }
+
   Device.getCacophonyIndex = async function (
     authUser,
     deviceId,
@@ -391,25 +450,20 @@ export default function (
     windowSizeInHours
   ) {
     windowSizeInHours = Math.abs(windowSizeInHours);
-    const windowEndTimestampUtc = Math.ceil(from.getTime() / 1000);
     // Make sure the user can see the device:
     await authUser.checkUserControlsDevices([deviceId]);
 
-    // FIXME(jon): So the problem is that we're inserting recordings into the databases without
-    //  saying how to interpret the timestamps, so they are interpreted as being NZ time when they come in.
-    //  This happens to work when both the inserter and the DB are in the same timezone, but otherwise will
-    //  lead to spurious values.  Need to standardize input time.
-
-    const [result, _extra] =
-      await sequelize.query(`select round((avg(cacophony_index.scores))::numeric, 2) as cacophony_index from
-(select
-	(jsonb_array_elements("additionalMetadata"->'analysis'->'cacophony_index')->>'index_percent')::float as scores
-from
-	"Recordings"
-where
-	"DeviceId" = ${deviceId}
-	and "type" = 'audio'
-	and "recordingDateTime" at time zone 'UTC' between (to_timestamp(${windowEndTimestampUtc}) at time zone 'UTC' - interval '${windowSizeInHours} hours') and to_timestamp(${windowEndTimestampUtc}) at time zone 'UTC') as cacophony_index;`);
+    const scores = cacophonyIndexScores(
+      deviceId,
+      from,
+      windowSizeInHours,
+      () => "null"
+    );
+    const [result, _extra] = await sequelize.query(
+      `select round((sum(total) / nullif(sum(n), 0))::numeric, 2) as cacophony_index
+from (${scores.sql}) as cacophony_index;`,
+      { replacements: scores.replacements }
+    );
     const index = result[0].cacophony_index;
     if (index !== null) {
       return Number(index);
@@ -424,28 +478,29 @@ where
     windowSizeInHours
   ) {
     windowSizeInHours = Math.abs(windowSizeInHours);
-    // We need to take the time down to the previous hour, so remove 1 second
-    const windowEndTimestampUtc = Math.ceil(from.getTime() / 1000);
     // Make sure the user can see the device:
     await authUser.checkUserControlsDevices([deviceId]);
     // Get a spread of 24 results with each result falling into an hour bucket.
-    const [results, extra] = await sequelize.query(`select
+    // The hour of day of an hour in "CacophonyIndexHours" is that of every
+    // recording in it, as long as the database's time zone is offset from
+    // UTC by whole hours.
+    const scores = cacophonyIndexScores(
+      deviceId,
+      from,
+      windowSizeInHours,
+      (timeColumn) => `date_part('hour', ${timeColumn})`
+    );
+    const [results, extra] = await sequelize.query(
+      `select
 	hour,
-	round((avg(scores))::numeric, 2) as index
-from
-(select
-	date_part('hour', "recordingDateTime") as hour,
-	(jsonb_array_elements("additionalMetadata"->'analysis'->'cacophony_index')->>'index_percent')::float as scores
-from
-	"Recordings"
-where
-	"DeviceId" = ${deviceId}
-	and "type" = 'audio'
-	and "recordingDateTime" at time zone 'UTC' between (to_timestamp(${windowEndTimestampUtc}) at time zone 'UTC' - interval '${windowSizeInHours} hours') and to_timestamp(${windowEndTimestampUtc}) at time zone 'UTC'
-) as cacophony_index
+	round((sum(total) / sum(n))::numeric, 2) as index
+from (${scores.sql}) as cacophony_index
 group by hour
+having sum(n) > 0
 order by hour;
-`);
+`,
+      { replacements: scores.replacements }
+    );
     // TODO(jon): Do we want to validate that there is enough data in a given hour
     //  to get a reasonable index histogram?
     return results.map((item) => ({
@@ -573,16 +628,7 @@ order by hour;
   };
 
   Device.prototype.comparePassword = function (password) {
-    const device = this;
-    return new Promise(function (resolve, reject) {
-      bcrypt.compare(password, device.password, function (err, isMatch) {
-        if (err) {
-          reject(err);
-        } else {
-          resolve(isMatch);
-        }
-      });
-    });
+    return passwords.comparePassword(password, this.password);
   };
 
   // Returns users that have access to this device either via group
@@ -708,15 +754,8 @@ function afterValidate(device: Device): Promise<void> | undefined {
   if (device.password !== undefined) {
     // TODO Make the password be hashed when the device password is set not in the validation.
     // TODO or make a custom validation for the password.
-    return new Promise(function (resolve, reject) {
-      bcrypt.hash(device.password, 10, function (err, hash) {
-        if (err) {
-          reject(err);
-        } else {
-          device.password = hash;
-          resolve();
-        }
-      });
+    return passwords.hashPassword(device.password).then((hash) => {
+      device.password = hash;
     });
   }
 }
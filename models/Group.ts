@@ -284,6 +284,7 @@ export default function (sequelize, DataTypes): GroupStatic {
     }
 
     await group.addUser(userToAdd, { through: { admin: admin } });
+    userToAdd.clearAccessCache();
   };
 
   /**
@@ -307,6 +308,7 @@ export default function (sequelize, DataTypes): GroupStatic {
     for (const groupUser of groupUsers) {
       await groupUser.destroy();
     }
+    userToRemove.clearAccessCache();
   };
 
   /**
@@ -18,13 +18,19 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import log from "../logging";
 import mime from "mime";
 import moment from "moment-timezone";
-import Sequelize, { FindOptions, Includeable, Order } from "sequelize";
+import Sequelize, {
+  CountOptions,
+  FindOptions,
+  Includeable,
+  Order
+} from "sequelize";
 import assert from "assert";
 import { v4 as uuidv4 } from "uuid";
+import { EventEmitter } from "events";
 import config from "../config";
 import util from "./util/util";
 import validation from "./util/validation";
-import { AuthorizationError } from "../api/customErrors";
+import { AuthorizationError, ClientError } from "../api/customErrors";
 import _ from "lodash";
 import { User } from "./User";
 import { ModelCommon, ModelStaticCommon } from "./index";
@@ -41,11 +47,14 @@ import { Tag } from "./Tag";
 
 import jsonwebtoken from "jsonwebtoken";
 import { TrackTag } from "./TrackTag";
+import { DetailSnapshotId } from "./DetailSnapshot";
 import { Station, StationId } from "./Station";
 import { tryToMatchRecordingToStation } from "../api/V1/recordingUtil";
 
 export type RecordingId = number;
 type SqlString = string;
+// Which tags to consider: human, automatic, or null for both.
+type TagType = "human" | "automatic" | null;
 
 export enum TagMode {
   Any = "any",
@@ -103,15 +112,10 @@ interface RecordingQueryBuilder {
     viewAsSuperAdmin?: boolean
   ) => Promise<RecordingQueryBuilderInstance>;
   handleTagMode: (tagMode: TagMode, tagWhatsIn: string[]) => SqlString;
-  recordingTaggedWith: (tagModes: string[], any) => SqlString;
-  trackTaggedWith: (tags: string[], sql: SqlString) => SqlString;
-  notTagOfType: (tags: string[], sql: SqlString) => SqlString;
-  tagOfType: (tags: string[], sql: SqlString) => SqlString;
-  selectByTagWhat: (
-    tags: string[],
-    whatName: string,
-    useDetail: boolean
-  ) => any;
+  recordingTaggedWith: (tagModes: string[], tagType: TagType) => SqlString;
+  trackTaggedWith: (tags: string[], tagType: TagType) => SqlString;
+  notTagOfType: (tags: string[], tagType: TagType) => SqlString;
+  tagOfType: (tags: string[], tagType: TagType) => SqlString;
 }
 
 interface RecordingQueryBuilderInstance {
@@ -120,8 +124,17 @@ interface RecordingQueryBuilderInstance {
     after?: string
   ) => RecordingQueryBuilderInstance;
   get: () => FindOptions;
+  countOptions: () => CountOptions;
   addColumn: (name: string) => RecordingQueryBuilderInstance;
+  addCursor: (cursor?: string) => RecordingQueryBuilderInstance;
+  nextCursor: (rows: Recording[]) => string | null;
+  selectFields: (fields?: string[]) => RecordingQueryBuilderInstance;
   query: any;
+  userWhere: any;
+  unrequestedAttributes?: string[];
+  defaultOrder: boolean;
+  cursorAdded?: boolean;
+  cursorCondition?: any;
 }
 
 export interface SpeciesClassification {
@@ -210,6 +223,7 @@ export interface Recording extends Sequelize.Model, ModelCommon<Recording> {
   fileKey: string;
   fileMimeType: string;
   processingStartTime: string;
+  processingHeartbeat: string;
   processingMeta: RecordingProcessingMetadata;
   processingState: RecordingProcessingState;
   passedFilter: boolean;
@@ -235,6 +249,10 @@ export interface Recording extends Sequelize.Model, ModelCommon<Recording> {
   getUserPermissions: (user: User) => Promise<RecordingPermission[]>;
 
   reprocess: (user: User) => Promise<Recording>;
+  addTracks: (
+    tracks: TrackWithTags[],
+    algorithmId: DetailSnapshotId
+  ) => Promise<{ trackId: TrackId; trackTagIds: number[] }[]>;
   mergeUpdate: (updates: any) => Promise<void>;
   filterData: (options: any) => void;
   // NOTE: Implicitly created by sequelize associations (along with other
@@ -266,6 +284,11 @@ export interface LimitedTrack {
   needsTagging: boolean;
 }
 
+export interface TrackWithTags {
+  data: any;
+  tags?: { what: string; confidence: number; data?: any }[];
+}
+
 interface TagLimitedRecording {
   RecordingId: RecordingId;
   DeviceId: DeviceId;
@@ -293,6 +316,16 @@ export interface RecordingStatic extends ModelStaticCommon<Recording> {
     type: RecordingType,
     state: RecordingProcessingState
   ) => Promise<Recording>;
+  getBatchForProcessing: (
+    type: RecordingType,
+    state: RecordingProcessingState,
+    count: number
+  ) => Promise<Recording[]>;
+  waitForProcessing: (
+    type: RecordingType,
+    state: RecordingProcessingState,
+    timeout: number
+  ) => Promise<void>;
   userGetAttributes: readonly string[];
   queryGetAttributes: readonly string[];
   queryBuilder: RecordingQueryBuilder;
@@ -361,6 +394,7 @@ export default function (
     fileKey: DataTypes.STRING,
     fileMimeType: DataTypes.STRING,
     processingStartTime: DataTypes.DATE,
+    processingHeartbeat: DataTypes.DATE,
     processingMeta: DataTypes.JSONB,
     processingState: DataTypes.STRING,
     passedFilter: DataTypes.BOOLEAN,
@@ -372,9 +406,16 @@ export default function (
     airplaneModeOn: DataTypes.BOOLEAN
   };
 
+  const options = {
+    hooks: {
+      afterSave: afterSave
+    }
+  };
+
   const Recording = sequelize.define(
     name,
-    attributes
+    attributes,
+    options
   ) as unknown as RecordingStatic;
 
   //---------------
@@ -406,9 +447,17 @@ export default function (
    * arguments given.
    */
   Recording.getOneForProcessing = async function (type, state) {
+    const recordings = await Recording.getBatchForProcessing(type, state, 1);
+    return recordings.length > 0 ? recordings[0] : null;
+  };
+
+  // Claims up to count recordings for processing in one transaction.
+  // Rows locked by a concurrent claim are skipped, so a recording is
+  // never handed out twice.
+  Recording.getBatchForProcessing = async function (type, state, count) {
     return sequelize
-      .transaction(function (transaction) {
-        return Recording.findOne({
+      .transaction(async function (transaction) {
+        const recordings = await Recording.findAll({
           where: {
             type: type,
             processingState: state,
@@ -433,38 +482,83 @@ export default function (
             ["recordingDateTime", "asc"],
             ["id", "asc"] // Adding another order is a "fix" for a bug in postgresql causing the query to be slow
           ],
+          limit: count,
           // @ts-ignore
           skipLocked: true,
           lock: (transaction as any).LOCK.UPDATE,
           transaction
-        }).then(async function (recording) {
-          if (!recording) {
-            return recording;
-          }
-          const date = new Date();
-          recording.set(
-            {
-              jobKey: uuidv4(),
-              processingStartTime: date.toISOString()
-            },
-            {
-              transaction
-            }
-          );
-          recording.save({
-            transaction
-          });
-          return recording;
         });
-      })
-      .then(function (result) {
-        return result;
+        const date = new Date();
+        await Promise.all(
+          recordings.map((recording) => {
+            recording.set(
+              {
+                jobKey: uuidv4(),
+                processingStartTime: date.toISOString(),
+                processingHeartbeat: date.toISOString()
+              },
+              {
+                transaction
+              }
+            );
+            return recording.save({
+              transaction
+            });
+          })
+        );
+        return recordings;
       })
       .catch(() => {
-        return null;
+        return [];
       });
   };
 
+  // Wakes requests waiting for recordings that are ready to process.
+  const processingQueue = new EventEmitter();
+  processingQueue.setMaxListeners(0);
+
+  function processingEvent(type: RecordingType, state: string): string {
+    return `${type}:${state}`;
+  }
+
+  function afterSave(recording: Recording, options) {
+    if (
+      recording.processingStartTime != null ||
+      !(
+        recording.changed("processingState") ||
+        recording.changed("processingStartTime")
+      )
+    ) {
+      return;
+    }
+    const notify = () =>
+      processingQueue.emit(
+        processingEvent(recording.type, recording.processingState)
+      );
+    if (options.transaction) {
+      options.transaction.afterCommit(notify);
+    } else {
+      notify();
+    }
+  }
+
+  // Resolves when a recording of the given type enters the given
+  // processing state on this server, or after timeout milliseconds.
+  // Recordings queued by other servers are only seen once the timeout
+  // expires, so callers should keep the timeout short and check again.
+  Recording.waitForProcessing = function (type, state, timeout) {
+    return new Promise((resolve) => {
+      const event = processingEvent(type, state);
+      const done = () => {
+        clearTimeout(timer);
+        processingQueue.removeListener(event, done);
+        resolve();
+      };
+      const timer = setTimeout(done, timeout);
+      processingQueue.once(event, done);
+    });
+  };
+
   function isUser(modelObj: any): modelObj is User {
     return (modelObj as User).username !== undefined;
   }
@@ -984,10 +1078,50 @@ from (
     );
     await this.update({
       processingStartTime: null,
+      processingHeartbeat: null,
       processingState: RecordingProcessingState.Reprocess
     });
   };
 
+  // Add tracks, along with their automatic tags, in a single transaction.
+  Recording.prototype.addTracks = async function (
+    tracks: TrackWithTags[],
+    algorithmId: DetailSnapshotId
+  ) {
+    return sequelize.transaction(async (transaction) => {
+      const created = await models.Track.bulkCreate(
+        tracks.map((track) => ({
+          RecordingId: this.id,
+          AlgorithmId: algorithmId,
+          data: track.data
+        })),
+        { transaction, returning: true }
+      );
+      const tags = [];
+      created.forEach((track, i) => {
+        for (const tag of tracks[i].tags || []) {
+          tags.push({
+            TrackId: track.id,
+            what: tag.what,
+            confidence: tag.confidence,
+            automatic: true,
+            data: tag.data
+          });
+        }
+      });
+      const createdTags = await models.TrackTag.bulkCreate(tags, {
+        transaction,
+        returning: true
+      });
+      return created.map((track) => ({
+        trackId: track.id,
+        trackTagIds: createdTags
+          .filter((tag) => tag.TrackId == track.id)
+          .map((tag) => tag.id)
+      }));
+    });
+  };
+
   // Return a specific track for the recording.
   Recording.prototype.getTrack = async function (
     trackId: TrackId
@@ -1021,6 +1155,7 @@ from (
     }
 
     delete where._tagged; // remove legacy tag mode selector (if included)
+    this.userWhere = where;
 
     if (!offset) {
       offset = 0;
@@ -1030,6 +1165,7 @@ from (
     } else {
       limit = Math.min(limit, maxQueryResults);
     }
+    this.defaultOrder = !order;
     if (!order) {
       order = [
         // Sort by recordingDatetime but handle the case of the
@@ -1131,6 +1267,15 @@ from (
     ];
   }
 
+  // Tag modes are resolved against the tag summary columns on Recordings,
+  // which triggers keep up to date as tags and track tags are written (see
+  // the add-recording-tag-summary migration).  "<type>TrackTags" holds the
+  // what of the recording's unarchived track tags and "<type>RecordingTags"
+  // the what and detail of its recording tags.  Every tag also adds
+  // ANY_TAG_LABEL, and INTERESTING_LABEL if it counts as interesting.
+  const ANY_TAG_LABEL = "*";
+  const INTERESTING_LABEL = "*interesting";
+
   Recording.queryBuilder.handleTagMode = (
     tagMode: AllTagModes,
     tagWhatsIn: string[]
@@ -1140,20 +1285,18 @@ from (
       tagMode = tagWhats ? TagMode.Tagged : TagMode.Any;
     }
 
-    const humanSQL = 'NOT "Tags".automatic';
-    const AISQL = '"Tags".automatic';
     if (
       (models.Tag as TagStatic).acceptableTags.has(tagMode as AcceptableTag)
     ) {
-      let sqlQuery = `(EXISTS (${Recording.queryBuilder.recordingTaggedWith(
+      let sqlQuery = Recording.queryBuilder.recordingTaggedWith(
         [tagMode],
         null
-      )}))`;
+      );
       if (tagWhats) {
-        sqlQuery = `${sqlQuery} AND EXISTS(${Recording.queryBuilder.trackTaggedWith(
+        sqlQuery = `${sqlQuery} AND ${Recording.queryBuilder.trackTaggedWith(
           tagWhats,
           null
-        )})`;
+        )}`;
       }
       return sqlQuery;
     }
@@ -1166,56 +1309,58 @@ from (
       case "tagged":
         return Recording.queryBuilder.tagOfType(tagWhats, null);
       case "human-tagged":
-        return Recording.queryBuilder.tagOfType(tagWhats, humanSQL);
+        return Recording.queryBuilder.tagOfType(tagWhats, "human");
       case "automatic-tagged":
-        return Recording.queryBuilder.tagOfType(tagWhats, AISQL);
+        return Recording.queryBuilder.tagOfType(tagWhats, "automatic");
       case "both-tagged":
         return `${Recording.queryBuilder.tagOfType(
           tagWhats,
-          humanSQL
-        )} AND ${Recording.queryBuilder.tagOfType(tagWhats, AISQL)}`;
+          "human"
+        )} AND ${Recording.queryBuilder.tagOfType(tagWhats, "automatic")}`;
       case "no-human":
-        return Recording.queryBuilder.notTagOfType(tagWhats, humanSQL);
+        return Recording.queryBuilder.notTagOfType(tagWhats, "human");
       case "automatic-only":
         return `${Recording.queryBuilder.tagOfType(
           tagWhats,
-          AISQL
-        )} AND ${Recording.queryBuilder.notTagOfType(tagWhats, humanSQL)}`;
+          "automatic"
+        )} AND ${Recording.queryBuilder.notTagOfType(tagWhats, "human")}`;
       case "human-only":
         return `${Recording.queryBuilder.tagOfType(
           tagWhats,
-          humanSQL
-        )} AND ${Recording.queryBuilder.notTagOfType(tagWhats, AISQL)}`;
+          "human"
+        )} AND ${Recording.queryBuilder.notTagOfType(tagWhats, "automatic")}`;
       case "automatic+human":
         return `${Recording.queryBuilder.tagOfType(
           tagWhats,
-          humanSQL
-        )} AND ${Recording.queryBuilder.tagOfType(tagWhats, AISQL)}`;
+          "human"
+        )} AND ${Recording.queryBuilder.tagOfType(tagWhats, "automatic")}`;
       default: {
         throw `invalid tag mode: ${tagMode}`;
       }
     }
   };
 
+  // Recording tags are only considered when there is no list of tags or the
+  // list includes a tag that can be applied to a whole recording.
+  const includesRecordingTags = (tagWhats: string[]): boolean =>
+    !tagWhats ||
+    tagWhats.some((tag) =>
+      (models.Tag as TagStatic).acceptableTags.has(tag as AcceptableTag)
+    );
+
   Recording.queryBuilder.tagOfType = (
     tagWhats: string[],
-    tagTypeSql
+    tagType: TagType
   ): SqlString => {
-    let query = `( EXISTS(${Recording.queryBuilder.trackTaggedWith(
+    let query = `( ${Recording.queryBuilder.trackTaggedWith(
       tagWhats,
-      tagTypeSql
-    )})`;
-    if (
-      !tagWhats ||
-      (!tagWhats && tagTypeSql) ||
-      tagWhats.find((tag) =>
-        (models.Tag as TagStatic).acceptableTags.has(tag as AcceptableTag)
-      )
-    ) {
-      query += ` OR EXISTS (${Recording.queryBuilder.recordingTaggedWith(
+      tagType
+    )}`;
+    if (includesRecordingTags(tagWhats)) {
+      query += ` OR ${Recording.queryBuilder.recordingTaggedWith(
         tagWhats,
-        tagTypeSql
-      )})`;
+        tagType
+      )}`;
     }
     query += ")";
     return query;
@@ -1223,23 +1368,17 @@ from (
 
   Recording.queryBuilder.notTagOfType = (
     tagWhats: string[],
-    tagTypeSql
+    tagType: TagType
   ): SqlString => {
-    let query = `( NOT EXISTS(${Recording.queryBuilder.trackTaggedWith(
+    let query = `( NOT ${Recording.queryBuilder.trackTaggedWith(
       tagWhats,
-      tagTypeSql
-    )})`;
-    if (
-      !tagWhats ||
-      (!tagWhats && tagTypeSql) ||
-      tagWhats.find((tag) =>
-        (models.Tag as TagStatic).acceptableTags.has(tag as AcceptableTag)
-      )
-    ) {
-      query += ` AND NOT EXISTS (${Recording.queryBuilder.recordingTaggedWith(
+      tagType
+    )}`;
+    if (includesRecordingTags(tagWhats)) {
+      query += ` AND NOT ${Recording.queryBuilder.recordingTaggedWith(
         tagWhats,
-        tagTypeSql
-      )})`;
+        tagType
+      )}`;
     }
     query += ")";
     return query;
@@ -1247,83 +1386,235 @@ from (
 
   Recording.queryBuilder.recordingTaggedWith = (
     tags: (TagMode | AcceptableTag)[],
-    tagTypeSql
+    tagType: TagType
   ) => {
-    let sql =
-      'SELECT "Recording"."id" FROM "Tags" WHERE  "Tags"."RecordingId" = "Recording".id';
-    if (tags) {
-      sql += ` AND (${Recording.queryBuilder.selectByTagWhat(
-        tags,
-        "what",
-        true
-      )})`;
-    }
-    if (tagTypeSql) {
-      sql += ` AND (${tagTypeSql})`;
-    }
-    return sql;
+    return `(${tagSummaryColumn("RecordingTags", tagType)} && ${tagLabels(
+      tags
+    )})`;
   };
 
   Recording.queryBuilder.trackTaggedWith = (
-    tags?: (TagMode | AcceptableTag)[],
-    tagTypeSql?
+    tags: (TagMode | AcceptableTag)[],
+    tagType: TagType
   ) => {
-    let sql = `SELECT "Recording"."id" FROM "Tracks" INNER JOIN "TrackTags" AS "Tags" ON "Tracks"."id" = "Tags"."TrackId" WHERE "Tracks"."RecordingId" = "Recording".id AND "Tracks"."archivedAt" IS NULL`;
-    if (tags) {
-      sql += ` AND (${Recording.queryBuilder.selectByTagWhat(
-        tags,
-        "what",
-        false
-      )})`;
-    }
-    if (tagTypeSql) {
-      sql += ` AND (${tagTypeSql})`;
-    }
-    return sql;
+    return `(${tagSummaryColumn("TrackTags", tagType)} && ${tagLabels(
+      tags
+    )})`;
   };
 
-  Recording.queryBuilder.selectByTagWhat = (
-    tags: string[],
-    whatName: string,
-    usesDetail: boolean
-  ) => {
-    if (!tags || tags.length === 0) {
-      return null;
-    }
+  function tagSummaryColumn(
+    tagsOn: "RecordingTags" | "TrackTags",
+    tagType: TagType
+  ): SqlString {
+    const column = tagType
+      ? `${tagType}${tagsOn}`
+      : `${tagsOn.charAt(0).toLowerCase()}${tagsOn.slice(1)}`;
+    return `"Recording"."${column}"`;
+  }
 
-    const parts = [];
-    for (let i = 0; i < tags.length; i++) {
-      const tag = tags[i];
-      if (tag === "interesting") {
-        if (usesDetail) {
-          parts.push(
-            `(("Tags"."${whatName}" IS NULL OR "Tags"."${whatName}"!='bird') AND ("Tags"."detail" IS NULL OR "Tags"."detail"!='false positive'))`
-          );
-        } else {
-          parts.push(
-            `("Tags"."${whatName}"!='bird' AND "Tags"."${whatName}"!='false positive')`
-          );
-        }
-      } else {
-        parts.push(`"Tags"."${whatName}" = '${tag}'`);
-        if (usesDetail) {
-          // the label could also be the detail field not the what field
-          parts.push(`"Tags"."detail" = '${tag}'`);
-        }
-      }
-    }
-    return parts.join(" OR ");
-  };
+  function tagLabels(tags: string[]): SqlString {
+    const labels =
+      tags && tags.length > 0
+        ? tags.map((tag) => (tag === "interesting" ? INTERESTING_LABEL : tag))
+        : [ANY_TAG_LABEL];
+    return `ARRAY[${labels
+      .map((label) => sequelize.escape(label))
+      .join(",")}]::TEXT[]`;
+  }
 
   Recording.queryBuilder.prototype.get = function () {
     return this.query;
   };
 
+  // Options for counting every recording the query matches.  Unlike get()
+  // these leave out the condition added for a cursor, so the count doesn't
+  // change from page to page.
+  Recording.queryBuilder.prototype.countOptions = function () {
+    const where = { ...this.query.where };
+    if (this.cursorCondition) {
+      where[Op.and] = where[Op.and].filter(
+        (condition) => condition !== this.cursorCondition
+      );
+    }
+    return { ...this.query, attributes: undefined, where };
+  };
+
   Recording.queryBuilder.prototype.addColumn = function (name: string) {
     this.query.attributes.push(name);
     return this;
   };
 
+  // Associations that selectFields can choose, by the name they appear
+  // under in the results.
+  function queryIncludeFields() {
+    return {
+      Group: models.Group,
+      Station: models.Station,
+      Tags: models.Tag,
+      Tracks: models.Track,
+      Device: models.Device
+    };
+  }
+
+  // Returns the recording columns that order sorts by.
+  function orderColumns(order): string[] {
+    const columns = [];
+    for (const entry of order || []) {
+      const column = Array.isArray(entry) ? entry[0] : entry;
+      if (typeof column === "string") {
+        columns.push(column);
+      } else if (column && column.fn === "COALESCE") {
+        // The default order's COALESCE("recordingDateTime", ...)
+        columns.push(
+          ...column.args
+            .filter((arg) => arg && typeof arg.col === "string")
+            .map((arg) => arg.col)
+        );
+      }
+    }
+    return columns.filter((column) =>
+      Recording.queryGetAttributes.includes(column)
+    );
+  }
+
+  // Only return the given attributes and associations of each recording,
+  // plus its id.  Associations referred to by the query's where clause
+  // are still joined, but their attributes are only returned if asked for.
+  Recording.queryBuilder.prototype.selectFields = function (
+    fields?: string[]
+  ) {
+    if (!fields || fields.length === 0) {
+      return this;
+    }
+    const includeFields = queryIncludeFields();
+    const unknown = fields.filter(
+      (field) =>
+        !Recording.queryGetAttributes.includes(field) &&
+        !includeFields.hasOwnProperty(field)
+    );
+    if (unknown.length > 0) {
+      throw new ClientError(`Unknown fields: ${unknown.join(", ")}.`);
+    }
+
+    // The columns the results are sorted by must still be selected, as
+    // with a limit and a hasMany include they are sorted on outside the
+    // subquery that selects them.  They are removed again by nextCursor.
+    const sortColumns = orderColumns(this.query.order);
+    this.query.attributes = this.query.attributes.filter(
+      (attribute) =>
+        typeof attribute !== "string" ||
+        attribute === "id" ||
+        fields.includes(attribute) ||
+        sortColumns.includes(attribute)
+    );
+    this.unrequestedAttributes = sortColumns.filter(
+      (column) => column !== "id" && !fields.includes(column)
+    );
+    const where = JSON.stringify(this.userWhere);
+    const included = Object.keys(includeFields)
+      .filter((field) => fields.includes(field))
+      .map((field) => includeFields[field]);
+    const joined = Object.keys(includeFields)
+      .filter((field) => where.includes(`"$${field}.`))
+      .map((field) => includeFields[field]);
+    this.query.include = this.query.include
+      .filter(
+        (include) =>
+          included.includes(include.model) || joined.includes(include.model)
+      )
+      .map((include) =>
+        included.includes(include.model)
+          ? include
+          : { ...include, attributes: [] }
+      );
+    return this;
+  };
+
+  // Keyset pagination over the default order.  The cursor encodes the
+  // sort key of the last recording on a page so that the next page
+  // starts straight after it, rather than scanning past OFFSET rows.
+  const cursorSortKey = `COALESCE("Recording"."recordingDateTime", '1970-01-01')`;
+  const cursorAttribute = "cursorSortKey";
+
+  function encodeCursor(sortKey: string, id: RecordingId): string {
+    return Buffer.from(JSON.stringify([sortKey, id])).toString("base64");
+  }
+
+  function decodeCursor(cursor: string): [string, RecordingId] {
+    try {
+      const [sortKey, id] = JSON.parse(
+        Buffer.from(cursor, "base64").toString()
+      );
+      if (
+        moment(sortKey, moment.ISO_8601, true).isValid() &&
+        Number.isInteger(id)
+      ) {
+        return [sortKey, id];
+      }
+    } catch (e) {
+      // fall through
+    }
+    throw new ClientError("Invalid cursor.");
+  }
+
+  // Return the sort key with each recording and, if a cursor is given,
+  // only return the recordings that come after it.  Can be called again
+  // to move the query on to a later cursor.
+  Recording.queryBuilder.prototype.addCursor = function (cursor?: string) {
+    if (!this.defaultOrder) {
+      if (cursor) {
+        throw new ClientError("A cursor can't be used with a custom order.");
+      }
+      return this;
+    }
+    if (!this.cursorAdded) {
+      this.query.attributes = [
+        ...this.query.attributes,
+        [
+          Sequelize.literal(
+            `to_char(${cursorSortKey} AT TIME ZONE 'UTC', ` +
+              `'YYYY-MM-DD"T"HH24:MI:SS.US"Z"')`
+          ),
+          cursorAttribute
+        ]
+      ];
+      this.cursorAdded = true;
+    }
+    if (cursor) {
+      const [sortKey, id] = decodeCursor(cursor);
+      const conditions = this.query.where[Op.and].filter(
+        (condition) => condition !== this.cursorCondition
+      );
+      this.cursorCondition = Sequelize.literal(
+        `(${cursorSortKey}, "Recording"."id") < (${sequelize.escape(
+          sortKey
+        )}::timestamptz, ${id})`
+      );
+      this.query.where[Op.and] = [...conditions, this.cursorCondition];
+      this.query.offset = 0;
+    }
+    return this;
+  };
+
+  // Returns the cursor for the page following rows, or null if rows
+  // was the last page.  The sort keys, and any columns only selected to
+  // sort by, are removed from rows.
+  Recording.queryBuilder.prototype.nextCursor = function (rows: Recording[]) {
+    let sortKey = null;
+    for (const row of rows) {
+      const dataValues = (row as any).dataValues;
+      sortKey = dataValues[cursorAttribute];
+      delete dataValues[cursorAttribute];
+      for (const attribute of this.unrequestedAttributes || []) {
+        delete dataValues[attribute];
+      }
+    }
+    if (!sortKey || rows.length < this.query.limit) {
+      return null;
+    }
+    return encodeCursor(sortKey, rows[rows.length - 1].id);
+  };
+
   // Include details of recent audio bait events in the query output.
   Recording.queryBuilder.prototype.addAudioEvents = function (
     after?: string,
@@ -16,7 +16,6 @@ You should have received a copy of the GNU Affero General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 */
 
-import bcrypt from "bcrypt";
 import Sequelize, {
   BuildOptions,
   ModelAttributes,
@@ -29,6 +28,7 @@ import { bool } from "aws-sdk/clients/signer";
 import Model from "sequelize";
 import { ModelCommon, ModelStaticCommon } from "./index";
 import { Group } from "../models/Group";
+import passwords from "./util/passwords";
 
 const Op = Sequelize.Op;
 
@@ -65,6 +65,7 @@ export interface User extends Sequelize.Model, ModelCommon<User> {
   getDeviceIds: () => Promise<number[]>;
   admin: boolean;
   getGroupDeviceIds: () => Promise<number[]>;
+  clearAccessCache: () => void;
   hasGlobalWrite: () => boolean;
   hasGlobalRead: () => boolean;
   id: UserId;
@@ -247,17 +248,47 @@ export default function (
     return [PERMISSION_WRITE, PERMISSION_READ].includes(this.globalPermission);
   };
 
-  User.prototype.getGroupDeviceIds = async function () {
-    const groupIds = await this.getGroupsIds();
-    if (groupIds.length > 0) {
-      const devices = await models.Device.findAll({
-        where: { GroupId: { [Op.in]: groupIds } },
-        attributes: ["id"]
+  // The groups and devices a user can see are needed by most permission
+  // checks, often several times while handling one request.  The ids are
+  // remembered on the user instance, and as each request loads its own
+  // instance of the authenticated user they are only reused within that
+  // request.
+  function cachedIds(
+    user,
+    name: string,
+    lookup: () => Promise<number[]>
+  ): Promise<number[]> {
+    if (!user._accessCache) {
+      user._accessCache = {};
+    }
+    if (!user._accessCache[name]) {
+      user._accessCache[name] = lookup().catch((err) => {
+        delete user._accessCache[name];
+        throw err;
       });
-      return devices.map((d) => d.id);
-    } else {
-      return [];
     }
+    return user._accessCache[name];
+  }
+
+  // Forgets the remembered group and device ids, for use after this user's
+  // group or device membership has changed.
+  User.prototype.clearAccessCache = function () {
+    this._accessCache = {};
+  };
+
+  User.prototype.getGroupDeviceIds = function () {
+    return cachedIds(this, "groupDeviceIds", async () => {
+      const groupIds = await this.getGroupsIds();
+      if (groupIds.length > 0) {
+        const devices = await models.Device.findAll({
+          where: { GroupId: { [Op.in]: groupIds } },
+          attributes: ["id"]
+        });
+        return devices.map((d) => d.id);
+      } else {
+        return [];
+      }
+    });
   };
 
   User.prototype.getWhereDeviceVisible = async function () {
@@ -296,9 +327,11 @@ export default function (
 
   // Returns the groups that are associated with this user (via
   // GroupUsers).
-  User.prototype.getGroupsIds = async function () {
-    const groups = await this.getGroups();
-    return groups.map((g) => g.id);
+  User.prototype.getGroupsIds = function () {
+    return cachedIds(this, "groupIds", async () => {
+      const groups = await this.getGroups();
+      return groups.map((g) => g.id);
+    });
   };
 
   User.prototype.isInGroup = async function (
@@ -320,9 +353,11 @@ export default function (
 
   // Returns the devices that are directly associated with this user
   // (via DeviceUsers).
-  User.prototype.getDeviceIds = async function () {
-    const devices = await this.getDevices();
-    return devices.map((d) => d.id);
+  User.prototype.getDeviceIds = function () {
+    return cachedIds(this, "deviceIds", async () => {
+      const devices = await this.getDevices();
+      return devices.map((d) => d.id);
+    });
   };
 
   User.prototype.canAccessDevice = async function (deviceId) {
@@ -360,16 +395,7 @@ export default function (
   };
 
   User.prototype.comparePassword = function (password: string) {
-    const user = this;
-    return new Promise(function (resolve, reject) {
-      bcrypt.compare(password, user.password, function (err, isMatch) {
-        if (err) {
-          reject(err);
-        } else {
-          resolve(isMatch);
-        }
-      });
-    });
+    return passwords.comparePassword(password, this.password);
   };
 
   return User;
@@ -381,7 +407,7 @@ export default function (
 
 async function beforeModify(user) {
   if (user.changed("password")) {
-    user.password = await bcrypt.hash(user.password, 10);
+    user.password = await passwords.hashPassword(user.password);
   }
 }
 
@@ -0,0 +1,95 @@
+/*
+cacophony-api: The Cacophony Project API server
+Copyright (C) 2018  The Cacophony Project
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*/
+
+import bcrypt from "bcrypt";
+import process from "process";
+import log from "../../logging";
+
+// Password hashing and comparison for users and devices.
+//
+// bcrypt does its work on libuv's thread pool, which is also used for file
+// system access and compression.  A burst of registrations or logins could
+// otherwise take every thread, so no more than WORKERS bcrypt operations run
+// at once and the rest wait in a queue.  One thread is left free for
+// everything else.
+
+const SALT_ROUNDS = 10;
+const THREAD_POOL_SIZE = Number(process.env.UV_THREADPOOL_SIZE) || 4;
+const WORKERS = Math.max(1, THREAD_POOL_SIZE - 1);
+
+// A warning is logged each time the queue grows by this many operations.
+const QUEUE_WARNING_STEP = 50;
+
+const queue: (() => void)[] = [];
+let active = 0;
+let maxQueueDepth = 0;
+let warnedQueueDepth = 0;
+
+function runInPool<T>(work: () => Promise<T>): Promise<T> {
+  return new Promise((resolve, reject) => {
+    const run = () => {
+      active++;
+      work()
+        .then(resolve, reject)
+        .finally(() => {
+          active--;
+          const next = queue.shift();
+          if (next) {
+            next();
+          } else {
+            warnedQueueDepth = 0;
+          }
+        });
+    };
+
+    if (active < WORKERS) {
+      run();
+      return;
+    }
+    queue.push(run);
+    maxQueueDepth = Math.max(maxQueueDepth, queue.length);
+    if (queue.length >= warnedQueueDepth + QUEUE_WARNING_STEP) {
+      warnedQueueDepth = queue.length;
+      log.warn(`${queue.length} password operations are waiting for bcrypt`);
+    }
+  });
+}
+
+function hashPassword(password: string): Promise<string> {
+  return runInPool(() => bcrypt.hash(password, SALT_ROUNDS));
+}
+
+function comparePassword(password: string, hash: string): Promise<boolean> {
+  return runInPool(() => bcrypt.compare(password, hash));
+}
+
+// Returns how many password operations are running, how many are waiting
+// and the most that have been waiting at once.
+function passwordQueueStats() {
+  return {
+    active,
+    queueDepth: queue.length,
+    maxQueueDepth
+  };
+}
+
+export default {
+  hashPassword,
+  comparePassword,
+  passwordQueueStats
+};
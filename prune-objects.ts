@@ -12,6 +12,12 @@ const keyTypes = Object.freeze([
   { prefix: "rec", table: "Recordings", column: "fileKey" }
 ]);
 
+// Chunked upload sessions live under this prefix, one per
+// <deviceId>/<uploadId>.  A session that has had no chunks for this long
+// has been abandoned and is removed.
+const uploadSessionPrefix = "uploads/";
+const uploadSessionExpiryDays = 7;
+
 async function main() {
   args
     .option("--config <path>", "Configuration file", "./config/app.js")
@@ -30,6 +36,18 @@ async function main() {
   const pgClient = await pgConnect();
   const s3 = modelsUtil.openS3();
 
+  const staleUploadKeys = await loadStaleUploadSessionKeys(
+    s3,
+    Config.s3.bucket
+  );
+  console.log(
+    `${staleUploadKeys.size} keys in abandoned upload sessions to delete`
+  );
+  if (staleUploadKeys.size > 0 && args.delete) {
+    await deleteObjects(s3, Config.s3.bucket, staleUploadKeys);
+    console.log(`abandoned upload sessions deleted`);
+  }
+
   const bucketKeys = await loadAllBucketKeys(
     s3,
     keyTypes.map((x) => x.prefix)
@@ -85,6 +103,48 @@ async function loadBucketKeys(s3, bucket, prefix) {
   return keys;
 }
 
+// Returns the keys of every upload session whose newest object is older
+// than uploadSessionExpiryDays.
+async function loadStaleUploadSessionKeys(s3, bucket) {
+  const params: any = {
+    Bucket: bucket,
+    Prefix: uploadSessionPrefix
+  };
+
+  const sessions = new Map();
+  for (;;) {
+    const data = await s3.listObjectsV2(params).promise();
+
+    data.Contents.forEach((elem) => {
+      const sessionKey = elem.Key.split("/").slice(0, 3).join("/");
+      let session = sessions.get(sessionKey);
+      if (!session) {
+        session = { keys: [], lastModified: 0 };
+        sessions.set(sessionKey, session);
+      }
+      session.keys.push(elem.Key);
+      session.lastModified = Math.max(
+        session.lastModified,
+        new Date(elem.LastModified).getTime()
+      );
+    });
+
+    if (!data.IsTruncated) {
+      break;
+    }
+    params.ContinuationToken = data.NextContinuationToken;
+  }
+
+  const cutoff = Date.now() - uploadSessionExpiryDays * 24 * 60 * 60 * 1000;
+  const keys = new Set();
+  for (const session of sessions.values()) {
+    if (session.lastModified < cutoff) {
+      session.keys.forEach((key) => keys.add(key));
+    }
+  }
+  return keys;
+}
+
 async function pgConnect() {
   const dbconf = Config.database;
   const client = new Client({
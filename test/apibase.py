@@ -1,31 +1,133 @@
+import attr
 import json
+import mmap
 import os
 import requests
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from urllib.parse import urljoin
 
 from requests_toolbelt.multipart.encoder import MultipartEncoder
 
 from .testexception import raise_specific_exception
 
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_DOWNLOAD_RETRIES = 3
+DEFAULT_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+ACCEPT_ENCODING = "gzip, deflate"
+
+
+@attr.s
+class DownloadStats:
+    bytes = attr.ib()
+    seconds = attr.ib()
+
+    @property
+    def throughput(self):
+        "Bytes per second."
+        return self.bytes / self.seconds if self.seconds else float("inf")
+
+
+def copy_response(response, fileobj, chunk_size=DEFAULT_DOWNLOAD_CHUNK_SIZE):
+    """Write the body of a streamed response to fileobj.
+
+    The body is read into one reusable buffer, and written out from
+    there, rather than as a new bytes object per chunk.
+    """
+    start = time.monotonic()
+    buffer = memoryview(bytearray(chunk_size))
+    response.raw.decode_content = True
+    total = 0
+    while True:
+        count = response.raw.readinto(buffer)
+        if not count:
+            break
+        fileobj.write(buffer[:count])
+        total += count
+    return DownloadStats(total, time.monotonic() - start)
+
+
+class PooledSession(requests.Session):
+    """A keep-alive session with a bounded connection pool per host.
+
+    Connections are returned to the pool after each response is read so
+    subsequent calls to the same host reuse them instead of opening a new
+    TCP connection.
+
+    Compressed responses are accepted and decoded transparently.  Byte
+    range requests ask for the identity encoding so that offsets refer to
+    the stored file.
+    """
+
+    def __init__(self, pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE):
+        super().__init__()
+        self.headers["Accept-Encoding"] = ACCEPT_ENCODING
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def connection_stats(self):
+        "Return how many requests were made and how many connections had to be opened for them."
+        num_requests = 0
+        num_connections = 0
+        for adapter in set(self.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                num_requests += pool.num_requests
+                num_connections += pool.num_connections
+        return {
+            "requests": num_requests,
+            "connections": num_connections,
+            "reused": num_requests - num_connections,
+        }
+
+
+_shared_session = None
+
+
+def shared_session():
+    "Return the session shared by all API clients that weren't given their own."
+    global _shared_session
+    if _shared_session is None:
+        _shared_session = PooledSession()
+    return _shared_session
+
+
+def configure_session(pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE):
+    "Replace the shared session with one using the given pool sizes."
+    global _shared_session
+    if _shared_session is not None:
+        _shared_session.close()
+    _shared_session = PooledSession(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    return _shared_session
+
 
 class APIBase:
-    def __init__(self, logintype, baseurl, loginname, password="password"):
+    def __init__(self, logintype, baseurl, loginname, password="password", session=None):
         self._logintype = logintype
         self._baseurl = baseurl
         self._loginname = loginname
         self._password = password
         self._response = None
+        self._session = session or shared_session()
         self.postdata = {}
 
+    def connection_stats(self):
+        return self._session.connection_stats()
+
     def login(self, email=None):
         url = urljoin(self._baseurl, "/authenticate_" + self._logintype)
-        response = requests.post(url, data=self._create_login_and_password_map(email))
+        response = self._session.post(url, data=self._create_login_and_password_map(email))
         self.check_login_response(response)
         return self
 
     def admin_login_as_other_user(self, username):
         url = urljoin(self._baseurl, "/admin_authenticate_as_other_user")
-        response = requests.post(url, headers=self._auth_header, data={"name": username})
+        response = self._session.post(url, headers=self._auth_header, data={"name": username})
         self.check_login_response(response)
         return self
 
@@ -47,7 +149,7 @@ class APIBase:
             data["group"] = group
         if email:
             data["email"] = email
-        response = requests.post(url, data=data)
+        response = self._session.post(url, data=data)
         if response.status_code == 200:
             self._response = response.json()
             self._set_jwt_token(response)
@@ -78,7 +180,7 @@ class APIBase:
         return self._loginname
 
     def _download_signed(self, token):
-        response = requests.get(
+        response = self._session.get(
             urljoin(self._baseurl, "/api/v1/signedUrl"), params={"jwt": token}, stream=True
         )
         raise_specific_exception(response)
@@ -86,12 +188,133 @@ class APIBase:
 
     def get_file(self, file_id):
         url = urljoin(self._baseurl, "/api/v1/files/{}".format(file_id))
-        response = requests.get(url, headers=self._auth_header)
+        response = self._session.get(url, headers=self._auth_header)
         return self._check_response(response)
 
-    def download_file(self, file_id):
+    def download_file(self, file_id, dest=None, resume=False, retries=DEFAULT_DOWNLOAD_RETRIES):
+        """Download a file.
+
+        Without dest, returns an iterator over the file's content.  With
+        dest, writes the file there and checks its size against fileSize.
+        If resume is set an existing partial file at dest is continued
+        rather than replaced.
+        """
         json = self.get_file(file_id)
-        return self._download_signed(json["jwt"])
+        if dest is None:
+            return self._download_signed(json["jwt"])
+        self._download_signed_to(json["jwt"], dest, json["fileSize"], resume, retries)
+        return dest
+
+    def _download_signed_to(self, token, dest, size, resume=False, retries=DEFAULT_DOWNLOAD_RETRIES):
+        "Download to the path dest, continuing after dropped connections."
+        offset = os.path.getsize(dest) if resume and os.path.exists(dest) else 0
+        attempt = 0
+        while True:
+            try:
+                self._download_signed_range(token, dest, offset)
+                break
+            except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError):
+                attempt += 1
+                if attempt > retries:
+                    raise
+                offset = os.path.getsize(dest)
+
+        downloaded = os.path.getsize(dest)
+        if size is not None and downloaded != size:
+            raise ValueError("Downloaded {} bytes to {} but expected {}".format(downloaded, dest, size))
+
+    def download_to(self, token, path_or_fileobj, chunk_size=DEFAULT_DOWNLOAD_CHUNK_SIZE):
+        """Download the file for a signed token to a path or a writable file object.
+
+        Returns DownloadStats for the transfer.
+        """
+        response = self._session.get(
+            urljoin(self._baseurl, "/api/v1/signedUrl"), params={"jwt": token}, stream=True
+        )
+        with response:
+            raise_specific_exception(response)
+            if isinstance(path_or_fileobj, (str, os.PathLike)):
+                with open(path_or_fileobj, "wb") as f:
+                    return copy_response(response, f, chunk_size)
+            return copy_response(response, path_or_fileobj, chunk_size)
+
+    def _download_signed_parallel(self, token, dest, size, parts, retries=DEFAULT_DOWNLOAD_RETRIES):
+        """Download to the path dest using parts concurrent range requests.
+
+        The output file is preallocated and memory mapped so that each part
+        is written straight to its place in the file.
+        """
+        with open(dest, "wb+") as f:
+            f.truncate(size)
+            if size == 0:
+                return
+            with mmap.mmap(f.fileno(), size) as out:
+                part_size = -(-size // parts)
+                with ThreadPoolExecutor(max_workers=parts) as executor:
+                    futures = [
+                        executor.submit(
+                            self._download_signed_part,
+                            token,
+                            out,
+                            start,
+                            min(start + part_size, size),
+                            retries,
+                        )
+                        for start in range(0, size, part_size)
+                    ]
+                    for future in futures:
+                        future.result()
+                out.flush()
+
+    def _download_signed_part(self, token, out, start, end, retries):
+        "Copy bytes start to end (exclusive) of the file into the buffer out."
+        position = start
+        attempt = 0
+        while position < end:
+            headers = {"Range": "bytes={}-{}".format(position, end - 1), "Accept-Encoding": "identity"}
+            try:
+                with self._session.get(
+                    urljoin(self._baseurl, "/api/v1/signedUrl"),
+                    params={"jwt": token},
+                    headers=headers,
+                    stream=True,
+                ) as response:
+                    if response.status_code != 206:
+                        raise_specific_exception(response)
+                        raise ValueError("Range requests are not supported for {}".format(response.url))
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        if position + len(chunk) > end:
+                            raise ValueError("Received more than the requested range")
+                        out[position : position + len(chunk)] = chunk
+                        position += len(chunk)
+            except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError):
+                attempt += 1
+                if attempt > retries:
+                    raise
+
+    def _download_signed_range(self, token, dest, offset):
+        "Write the file from offset onwards to dest, appending to what is already there."
+        headers = {"Range": "bytes={}-".format(offset), "Accept-Encoding": "identity"} if offset else None
+        response = self._session.get(
+            urljoin(self._baseurl, "/api/v1/signedUrl"), params={"jwt": token}, headers=headers, stream=True
+        )
+        with response:
+            if response.status_code == 416:
+                # Nothing after offset, so the file is already complete.
+                return
+            if response.status_code == 206:
+                expected = "bytes {}-".format(offset)
+                if not response.headers.get("Content-Range", "").startswith(expected):
+                    raise ValueError(
+                        "Unexpected Content-Range: {}".format(response.headers.get("Content-Range"))
+                    )
+                mode = "ab"
+            elif response.status_code == 200:
+                mode = "wb"
+            else:
+                raise_specific_exception(response)
+            with open(dest, mode) as f:
+                copy_response(response, f)
 
     def _upload(self, url, filename, props):
         url = urljoin(self._baseurl, url)
@@ -102,6 +325,18 @@ class APIBase:
                 fields={"data": json_props, "file": (os.path.basename(filename), content)}
             )
             headers = {"Content-Type": multipart_data.content_type, "Authorization": self._token}
-            r = requests.post(url, data=multipart_data, headers=headers)
+            r = self._session.post(url, data=multipart_data, headers=headers)
         self._check_response(r)
         return r.json()["recordingId"]
+
+
+def serialise_params(params):
+    out = {}
+    for name, value in params.items():
+        if value is not None:
+            if isinstance(value, (dict, list, tuple)):
+                value = json.dumps(value)
+            elif isinstance(value, datetime):
+                value = value.isoformat()
+            out[name] = value
+    return out
@@ -0,0 +1,218 @@
+import asyncio
+import json
+import os
+from urllib.parse import urljoin
+
+import aiohttp
+import requests
+
+from .testexception import raise_specific_exception
+from .apibase import serialise_params
+
+DEFAULT_MAX_CONCURRENCY = 100
+
+
+class AsyncResponse:
+    "The parts of a finished aiohttp response needed to check it like a requests response."
+
+    def __init__(self, status_code, text, url):
+        self.status_code = status_code
+        self.text = text
+        self.url = url
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError("{} Error for url: {}".format(self.status_code, self.url), response=self)
+
+
+class AsyncSession:
+    """A connection pool shared by asyncio API clients.
+
+    No more than max_concurrency requests are in flight at once; any
+    further requests wait for a free slot.
+
+    The underlying aiohttp session belongs to the event loop it was first
+    used on, and must be closed on that loop, either by using the session
+    with "async with" or by awaiting close() before the loop finishes.
+    After that it can be used again on another loop.
+    """
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY, limit_per_host=0):
+        self._max_concurrency = max_concurrency
+        self._limit_per_host = limit_per_host
+        self._loop = None
+        self._session = None
+        self._semaphore = None
+
+    def _get_session(self):
+        loop = asyncio.get_event_loop()
+        if self._session is not None and self._loop is not loop:
+            raise RuntimeError("AsyncSession was not closed before its event loop finished")
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self._max_concurrency, limit_per_host=self._limit_per_host)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+            self._loop = loop
+        return self._session
+
+    async def request(self, method, url, params=None, **kwargs):
+        session = self._get_session()
+        async with self._semaphore:
+            async with session.request(method, url, params=_stringify(params), **kwargs) as response:
+                text = await response.text()
+                return AsyncResponse(response.status, text, url)
+
+    async def stream(self, method, url, params=None, chunk_size=4096, **kwargs):
+        # A slot is only held while waiting on the server, not while the
+        # caller handles each chunk.  The connector's limit still bounds the
+        # number of open connections.
+        session = self._get_session()
+        async with self._semaphore:
+            response = await session.request(method, url, params=_stringify(params), **kwargs)
+        try:
+            if response.status != 200:
+                async with self._semaphore:
+                    text = await response.text()
+                raise_specific_exception(AsyncResponse(response.status, text, url))
+            while True:
+                async with self._semaphore:
+                    chunk = await response.content.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            response.release()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+_shared_async_session = None
+
+
+def shared_async_session():
+    """Return the session shared by all asyncio API clients that weren't given their own.
+
+    Whoever runs the event loop must close it before the loop finishes, e.g.
+
+        async with shared_async_session():
+            ...
+    """
+    global _shared_async_session
+    if _shared_async_session is None:
+        _shared_async_session = AsyncSession()
+    return _shared_async_session
+
+
+def _stringify(params):
+    "aiohttp only takes strings, so serialise params as the sync client does and drop any that are None."
+    if params is None:
+        return None
+    out = {}
+    for name, value in serialise_params(params).items():
+        if isinstance(value, bool):
+            value = "true" if value else "false"
+        out[name] = str(value)
+    return out
+
+
+class AsyncAPIBase:
+    def __init__(self, logintype, baseurl, loginname, password="password", session=None):
+        self._logintype = logintype
+        self._baseurl = baseurl
+        self._loginname = loginname
+        self._password = password
+        self._response = None
+        self._session = session or shared_async_session()
+        self.postdata = {}
+
+    async def login(self, email=None):
+        response = await self._post(
+            "/authenticate_" + self._logintype, data=self._create_login_and_password_map(email)
+        )
+        self.check_login_response(response)
+        return self
+
+    def check_login_response(self, response):
+        if response.status_code == 200:
+            self._set_jwt_token(response)
+            return
+        if response.status_code == 422:
+            raise ValueError(
+                "Could not log on as '{}'.  Please check {} name.".format(self._loginname, self._logintype)
+            )
+        raise_specific_exception(response)
+
+    async def register_as_new(self, group=None, email=None):
+        data = self._create_login_and_password_map()
+        if group:
+            data["group"] = group
+        if email:
+            data["email"] = email
+        response = await self._post("/api/v1/{}s".format(self._logintype), data=data)
+        if response.status_code == 200:
+            self._response = response.json()
+            self._set_jwt_token(response)
+        else:
+            self._check_response(response)
+        return self
+
+    def _create_login_and_password_map(self, email=None):
+        if email:
+            return {"email": email, "password": self._password}
+
+        nameProp = self._logintype + "name"
+        data = {nameProp: self._loginname, "password": self._password}
+        data.update({name: value for name, value in self.postdata.items() if value is not None})
+        return data
+
+    def _set_jwt_token(self, response):
+        self._token = response.json().get("token")
+        self._auth_header = {"Authorization": self._token}
+
+    def _check_response(self, response):
+        if response.status_code == 200:
+            return response.json()
+        raise_specific_exception(response)
+
+    def get_login_name(self):
+        return self._loginname
+
+    async def _get(self, url, **kwargs):
+        return await self._session.request("GET", urljoin(self._baseurl, url), **kwargs)
+
+    async def _post(self, url, **kwargs):
+        return await self._session.request("POST", urljoin(self._baseurl, url), **kwargs)
+
+    async def _download_signed(self, token):
+        url = urljoin(self._baseurl, "/api/v1/signedUrl")
+        async for chunk in self._session.stream("GET", url, params={"jwt": token}):
+            yield chunk
+
+    async def get_file(self, file_id):
+        response = await self._get("/api/v1/files/{}".format(file_id), headers=self._auth_header)
+        return self._check_response(response)
+
+    async def download_file(self, file_id):
+        file_json = await self.get_file(file_id)
+        async for chunk in self._download_signed(file_json["jwt"]):
+            yield chunk
+
+    async def _upload(self, url, filename, props):
+        with open(filename, "rb") as content:
+            form = aiohttp.FormData()
+            form.add_field("data", json.dumps(props))
+            form.add_field("file", content, filename=os.path.basename(filename))
+            response = await self._post(url, data=form, headers={"Authorization": self._token})
+        return self._check_response(response)["recordingId"]
@@ -0,0 +1,49 @@
+from datetime import datetime
+
+from .asyncapibase import AsyncAPIBase
+
+
+class AsyncDeviceAPI(AsyncAPIBase):
+    "An asyncio counterpart of DeviceAPI for running many requests concurrently."
+
+    def __init__(self, baseurl, devicename, password="password", groupname=None, session=None):
+        super().__init__("device", baseurl, devicename, password, session=session)
+        self.postdata["groupname"] = groupname
+        self.id = None
+
+    async def register_as_new(self, group=None):
+        await super().register_as_new(group=group)
+        if self._response:
+            self.id = self._response.get("id")
+            if group and not self.postdata.get("groupname"):
+                self.postdata["groupname"] = group
+        return self
+
+    async def upload_recording(self, filename, props=None):
+        if not props:
+            props = {"type": "thermalRaw"}
+        return await self._upload("/api/v1/recordings", filename, props)
+
+    async def upload_audio_recording(self, filename, props=None):
+        if not props:
+            props = {"type": "audio"}
+        return await self._upload("/api/v1/recordings", filename, props)
+
+    async def record_event(self, type_, details, times=None):
+        data = {"description": {"type": type_, "details": details}}
+        return await self.record_event_data(data, times)
+
+    async def record_event_from_id(self, eventDetailId, times=None):
+        return await self.record_event_data({"eventDetailId": eventDetailId}, times)
+
+    async def record_event_data(self, eventData, times=None):
+        if times is None:
+            times = [datetime.now()]
+        eventData["dateTimes"] = [t.isoformat() for t in times]
+        response = await self._post("/api/v1/events", headers=self._auth_header, json=eventData)
+        response_data = self._check_response(response)
+        return response_data["eventsAdded"], response_data["eventDetailId"]
+
+    async def get_audio_schedule(self):
+        response = await self._get("/api/v1/schedules", headers=self._auth_header)
+        return self._check_response(response)
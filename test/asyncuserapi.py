@@ -0,0 +1,183 @@
+import json
+from datetime import datetime
+
+from .asyncapibase import AsyncAPIBase
+from .userapi import make_recording_where, serialise_params
+
+
+class AsyncUserAPI(AsyncAPIBase):
+    "An asyncio counterpart of UserAPI for running many requests concurrently."
+
+    def __init__(self, baseurl, username, email, password="password", session=None):
+        super().__init__("user", baseurl, username, password, session=session)
+        self.postdata["email"] = email
+        self.email = email
+
+    async def register_as_new(self):
+        return await super().register_as_new(email=self.email)
+
+    async def login(self):
+        return await super().login(email=self.email)
+
+    async def query(
+        self,
+        startDate=None,
+        endDate=None,
+        min_secs=0,
+        limit=100,
+        offset=0,
+        tagmode=None,
+        tags=None,
+        filterOptions=None,
+        deviceIds=None,
+        return_json=False,
+        where=None,
+    ):
+        where = make_recording_where(where, startDate, endDate, min_secs, deviceIds)
+        return await self._query(
+            "recordings",
+            where=where,
+            limit=limit,
+            offset=offset,
+            tagMode=tagmode,
+            tags=tags,
+            filterOptions=filterOptions,
+            return_json=return_json,
+        )
+
+    async def query_visits(
+        self,
+        startDate=None,
+        endDate=None,
+        min_secs=0,
+        limit=100,
+        offset=0,
+        tagmode=None,
+        tags=None,
+        filterOptions=None,
+        deviceIds=None,
+        return_json=True,
+        where=None,
+    ):
+        where = make_recording_where(where, startDate, endDate, min_secs, deviceIds)
+        return await self._query(
+            "recordings/visits",
+            where=where,
+            limit=limit,
+            offset=offset,
+            tagMode=tagmode,
+            tags=tags,
+            filterOptions=filterOptions,
+            return_json=return_json,
+        )
+
+    async def query_events(
+        self, deviceId=None, startTime=None, endTime=None, type=None, limit=20, latest=None
+    ):
+        return await self._query(
+            "events",
+            deviceId=deviceId,
+            startTime=startTime,
+            endTime=endTime,
+            limit=limit,
+            type=type,
+            latest=latest,
+        )
+
+    async def _query(self, queryname, **params):
+        params.setdefault("limit", 100)
+        params.setdefault("offset", 0)
+        return_json = params.pop("return_json", False)
+
+        response = await self._get(
+            "/api/v1/" + queryname, params=serialise_params(params), headers=self._auth_header
+        )
+        response_data = self._check_response(response)
+        if return_json:
+            return response_data
+        return response_data["rows"]
+
+    async def get_recording(self, recording_id, params=None):
+        return (await self.get_recording_response(recording_id, params))["recording"]
+
+    async def get_recording_response(self, recording_id, params=None):
+        response = await self._get(
+            "/api/v1/recordings/{}".format(recording_id), headers=self._auth_header, params=params
+        )
+        return self._check_response(response)
+
+    async def download_cptv(self, recording_id):
+        recording_json = await self.get_recording_response(recording_id)
+        async for chunk in self._download_signed(recording_json["downloadRawJWT"]):
+            yield chunk
+
+    async def tag_recording(self, recording_id, tagDictionary):
+        tagData = {"tag": json.dumps(tagDictionary), "recordingId": recording_id}
+        response = await self._post("/api/v1/tags/", headers=self._auth_header, data=tagData)
+        return self._check_response(response)
+
+    async def add_track(self, recording_id, data, algorithm={"status": "Test added"}):
+        response = await self._post(
+            "/api/v1/recordings/{}/tracks".format(recording_id),
+            headers=self._auth_header,
+            data={"algorithm": json.dumps(algorithm), "data": json.dumps(data)},
+        )
+        return self._check_response(response)["trackId"]
+
+    async def get_tracks(self, recording_id):
+        response = await self._get(
+            "/api/v1/recordings/{}/tracks".format(recording_id), headers=self._auth_header
+        )
+        return self._check_response(response)["tracks"]
+
+    async def add_track_tag(
+        self, recording_id, track_id, what, confidence, automatic, data, replace=False, tag_jwt=None
+    ):
+        url = "/api/v1/recordings/{}/tracks/{}/"
+        if replace:
+            url += "replaceTag"
+        else:
+            url += "tags"
+        tag_data = {
+            "what": what,
+            "confidence": confidence,
+            "automatic": "true" if automatic else "false",
+            "data": json.dumps(data),
+        }
+        if tag_jwt is not None:
+            tag_data["tagJWT"] = tag_jwt
+
+        response = await self._post(
+            url.format(recording_id, track_id), headers=self._auth_header, data=tag_data
+        )
+        return self._check_response(response)["trackTagId"]
+
+    async def record_event(self, device, type_, details, times=None):
+        data = {"description": {"type": type_, "details": details}}
+        return await self.record_event_data(device, data, times)
+
+    async def record_event_data(self, device, eventData, times=None):
+        if times is None:
+            times = [datetime.now()]
+        eventData["dateTimes"] = [t.isoformat() for t in times]
+        response = await self._post(
+            "/api/v1/events/device/" + str(device._id), headers=self._auth_header, json=eventData
+        )
+        response_data = self._check_response(response)
+        return response_data["eventsAdded"], response_data["eventDetailId"]
+
+    async def upload_recording_for(self, groupname, devicename, filename, props=None):
+        if not props:
+            props = {"type": "thermalRaw"}
+        endpoint = "device/{}".format(devicename)
+        if groupname:
+            endpoint += "/group/{}".format(groupname)
+        return await self._upload("/api/v1/recordings/{}".format(endpoint), filename, props)
+
+    async def get_cacophony_index(self, device_id, from_time=None, window_size=None):
+        response = await self._get(
+            "/api/v1/devices/{}/cacophony-index".format(device_id),
+            headers=self._auth_header,
+            params=serialise_params({"from": from_time, "window-size": window_size}),
+        )
+        return self._check_response(response)
@@ -1,3 +1,7 @@
+import hashlib
+import os
+import threading
+import time
 from urllib.parse import urljoin
 from datetime import datetime
 
@@ -5,10 +9,119 @@ import requests
 
 from .apibase import APIBase
 
+DEFAULT_CHUNKED_UPLOAD_THRESHOLD = 16 * 1024 * 1024
+DEFAULT_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_UPLOAD_RETRIES = 3
+HASH_BLOCK_SIZE = 1024 * 1024
+DEFAULT_EVENT_BATCH_SIZE = 100
+DEFAULT_EVENT_BATCH_INTERVAL = 10
+
+
+def file_sha1(filename):
+    "Return the hex SHA-1 of a file, read a block at a time."
+    sha1 = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+class EventBatcher:
+    """Buffers a device's events and sends them in batches.
+
+    A batch is sent once max_events events are buffered, or interval
+    seconds after the oldest buffered event was added, whichever comes
+    first.  Use as a context manager, or call close(), to send any events
+    still buffered at the end.  If a batch sent from the background thread
+    fails the exception is kept in error and raised again by close().
+    """
+
+    def __init__(self, api, max_events=DEFAULT_EVENT_BATCH_SIZE, interval=DEFAULT_EVENT_BATCH_INTERVAL):
+        self._api = api
+        self.max_events = max_events
+        self.interval = interval
+        self._events = []
+        self._deadline = None
+        self._closed = False
+        self._changed = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self.batches_sent = 0
+        self.events_sent = 0
+        self.error = None
+
+    def record_event(self, type_, details, times=None):
+        self.record_event_data({"description": {"type": type_, "details": details}}, times)
+
+    def record_event_from_id(self, eventDetailId, times=None):
+        self.record_event_data({"eventDetailId": eventDetailId}, times)
+
+    def record_event_data(self, eventData, times=None):
+        if times is None:
+            times = [datetime.now()]
+        event = dict(eventData, dateTimes=[t.isoformat() for t in times])
+        with self._changed:
+            if self._closed:
+                raise ValueError("EventBatcher is closed")
+            self._events.append(event)
+            if len(self._events) == 1:
+                self._deadline = time.monotonic() + self.interval
+                self._changed.notify()
+            if len(self._events) < self.max_events:
+                return
+            batch = self._take()
+        self._send(batch)
+
+    def flush(self):
+        "Send any buffered events now."
+        with self._changed:
+            batch = self._take()
+        self._send(batch)
+
+    def close(self):
+        with self._changed:
+            self._closed = True
+            self._changed.notify()
+        self._thread.join()
+        self.flush()
+        if self.error:
+            raise self.error
+
+    def _take(self):
+        batch, self._events = self._events, []
+        return batch
+
+    def _send(self, batch):
+        if not batch:
+            return
+        self._api.record_events(batch)
+        self.batches_sent += 1
+        self.events_sent += len(batch)
+
+    def _run(self):
+        while True:
+            with self._changed:
+                while not self._closed and (not self._events or time.monotonic() < self._deadline):
+                    timeout = self._deadline - time.monotonic() if self._events else None
+                    self._changed.wait(timeout)
+                if self._closed:
+                    return
+                batch = self._take()
+            try:
+                self._send(batch)
+            except Exception as e:
+                self.error = e
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
 
 class DeviceAPI(APIBase):
-    def __init__(self, baseurl, devicename, password="password", groupname=None):
-        super().__init__("device", baseurl, devicename, password)
+    def __init__(self, baseurl, devicename, password="password", groupname=None, session=None):
+        super().__init__("device", baseurl, devicename, password, session=session)
         self.postdata["groupname"] = groupname
         self.id = None
 
@@ -16,18 +129,115 @@ class DeviceAPI(APIBase):
         super().register_as_new(group=group)
         if self._response:
             self.id = self._response.get("id")
+            # Logging in with the group lets the server check the password
+            # against just this device rather than every device with its name.
+            if group and not self.postdata.get("groupname"):
+                self.postdata["groupname"] = group
         return self
 
-    def upload_recording(self, filename, props=None):
+    def upload_recording(
+        self,
+        filename,
+        props=None,
+        chunked_threshold=DEFAULT_CHUNKED_UPLOAD_THRESHOLD,
+        chunk_size=DEFAULT_UPLOAD_CHUNK_SIZE,
+    ):
+        """Upload a recording.
+
+        Files larger than chunked_threshold bytes are sent in chunks through
+        a resumable upload session rather than in a single request.
+
+        The file's SHA-1 is sent as fileHash, so if the device has already
+        uploaded it the server returns the existing recording's id instead
+        of storing it again.
+        """
         if not props:
             props = {"type": "thermalRaw"}
-        return self._upload("/api/v1/recordings", filename, props)
+        return self._upload_recording(filename, props, chunked_threshold, chunk_size)
 
     def upload_audio_recording(self, filename, props=None):
         if not props:
             props = {"type": "audio"}
+        return self._upload_recording(
+            filename, props, DEFAULT_CHUNKED_UPLOAD_THRESHOLD, DEFAULT_UPLOAD_CHUNK_SIZE
+        )
+
+    def _upload_recording(self, filename, props, chunked_threshold, chunk_size):
+        if "fileHash" not in props:
+            props = dict(props, fileHash=file_sha1(filename))
+        if os.path.getsize(filename) > chunked_threshold:
+            upload = self.start_upload(filename, props)
+            if "recordingId" in upload:
+                return upload["recordingId"]
+            return self.resume_upload(upload["uploadId"], filename, chunk_size)
         return self._upload("/api/v1/recordings", filename, props)
 
+    def start_upload(self, filename, props):
+        """Start a resumable upload session for filename.
+
+        Returns the server's response, with the session's uploadId, or with
+        a recordingId if the file has already been uploaded.
+        """
+        data = {"data": props, "size": os.path.getsize(filename), "filename": os.path.basename(filename)}
+        response = self._session.post(
+            urljoin(self._baseurl, "/api/v1/recordings/uploads"), headers=self._auth_header, json=data
+        )
+        return self._check_response(response)
+
+    def upload_offset(self, upload_id):
+        "Return how many bytes from the start of the file the server has received."
+        response = self._session.get(self._upload_url(upload_id), headers=self._auth_header)
+        return self._check_response(response)["offset"]
+
+    def upload_chunk(self, upload_id, filename, offset, chunk_size=DEFAULT_UPLOAD_CHUNK_SIZE):
+        """Send the chunk of filename starting at offset.
+
+        Returns how many bytes from the start of the file the server has
+        received, which is where the next chunk should start.
+        """
+        with open(filename, "rb") as f:
+            f.seek(offset)
+            chunk = f.read(chunk_size)
+        headers = dict(self._auth_header, **{"Content-Type": "application/octet-stream"})
+        response = self._session.put(
+            self._upload_url(upload_id), params={"offset": offset}, headers=headers, data=chunk
+        )
+        return self._check_response(response)["offset"]
+
+    def resume_upload(
+        self, upload_id, filename, chunk_size=DEFAULT_UPLOAD_CHUNK_SIZE, retries=DEFAULT_UPLOAD_RETRIES
+    ):
+        """Send the parts of filename the server doesn't have yet, then finish the upload.
+
+        After a failed chunk the server is asked where to continue from, so
+        only chunks that didn't arrive are sent again.  Returns the id of
+        the new recording.
+        """
+        size = os.path.getsize(filename)
+        offset = self.upload_offset(upload_id)
+        attempt = 0
+        while offset < size:
+            try:
+                offset = self.upload_chunk(upload_id, filename, offset, chunk_size)
+            except (requests.ConnectionError, requests.Timeout):
+                attempt += 1
+                if attempt > retries:
+                    raise
+                offset = self.upload_offset(upload_id)
+
+        return self.finalize_upload(upload_id)
+
+    def finalize_upload(self, upload_id):
+        """Finish an upload whose chunks have all been sent and return the id of the recording.
+
+        It is safe to call again if the response was lost; the same id is returned.
+        """
+        response = self._session.post(self._upload_url(upload_id) + "/finalize", headers=self._auth_header)
+        return self._check_response(response)["recordingId"]
+
+    def _upload_url(self, upload_id):
+        return urljoin(self._baseurl, "/api/v1/recordings/uploads/{}".format(upload_id))
+
     def record_event(self, type_, details, times=None):
         data = {"description": {"type": type_, "details": details}}
         return self.record_event_data(data, times)
@@ -41,18 +251,34 @@ class DeviceAPI(APIBase):
         eventData["dateTimes"] = [t.isoformat() for t in times]
         url = urljoin(self._baseurl, "/api/v1/events")
 
-        response = requests.post(url, headers=self._auth_header, json=eventData)
+        response = self._session.post(url, headers=self._auth_header, json=eventData)
         response_data = self._check_response(response)
         return response_data["eventsAdded"], response_data["eventDetailId"]
 
+    def record_events(self, events):
+        """Record many events in one request.
+
+        Each event is a dict as for record_event_data, with dateTimes given
+        as ISO formatted strings.  Returns the number of events added and
+        the event detail id used for each entry.
+        """
+        url = urljoin(self._baseurl, "/api/v1/events/batch")
+        response = self._session.post(url, headers=self._auth_header, json={"events": events})
+        response_data = self._check_response(response)
+        return response_data["eventsAdded"], response_data["eventDetailIds"]
+
+    def event_batcher(self, max_events=DEFAULT_EVENT_BATCH_SIZE, interval=DEFAULT_EVENT_BATCH_INTERVAL):
+        "Return an EventBatcher that records events through this device."
+        return EventBatcher(self, max_events, interval)
+
     def get_audio_schedule(self):
         url = urljoin(self._baseurl, "/api/v1/schedules")
-        response = requests.get(url, headers=self._auth_header)
+        response = self._session.get(url, headers=self._auth_header)
         self._check_response(response)
         return response.json()
 
     def reregister(self, new_name, new_group, new_password):
         url = urljoin(self._baseurl, "/api/v1/devices/reregister")
         data = {"newName": new_name, "newGroup": new_group, "newPassword": new_password}
-        response = requests.post(url, headers=self._auth_header, json=data)
+        response = self._session.post(url, headers=self._auth_header, json=data)
         self._check_response(response)
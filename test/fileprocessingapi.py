@@ -1,18 +1,100 @@
 import json
+import threading
+from collections import OrderedDict
 from urllib.parse import urljoin
 
-import requests
-
+from .apibase import shared_session
 from .testexception import raise_specific_exception
 from .recording import Recording
 
 
+DEFAULT_ALGORITHM_CACHE_SIZE = 128
+DEFAULT_HEARTBEAT_INTERVAL = 30
+
+
+class AlgorithmCache:
+    "A bounded, least recently used map from algorithm details to their ids."
+
+    def __init__(self, maxsize=DEFAULT_ALGORITHM_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._ids = OrderedDict()
+
+    @staticmethod
+    def key(algorithm):
+        return json.dumps(algorithm, sort_keys=True, separators=(",", ":"))
+
+    def get(self, algorithm, lookup):
+        "Return the id for algorithm, calling lookup(algorithm) if it isn't cached."
+        key = self.key(algorithm)
+        if key in self._ids:
+            self._ids.move_to_end(key)
+            self.hits += 1
+            return self._ids[key]
+        self.misses += 1
+        algorithm_id = lookup(algorithm)
+        self._ids[key] = algorithm_id
+        if len(self._ids) > self.maxsize:
+            self._ids.popitem(last=False)
+        return algorithm_id
+
+    def invalidate(self, algorithm=None):
+        "Forget the id for algorithm, or every id if no algorithm is given."
+        if algorithm is None:
+            self._ids.clear()
+        else:
+            self._ids.pop(self.key(algorithm), None)
+
+
+class Heartbeat:
+    """Sends heartbeats for a processing job from a background thread.
+
+    Use as a context manager around the processing of a recording.  If a
+    heartbeat fails the thread stops and the exception is kept in error.
+    """
+
+    def __init__(self, api, recording, interval=DEFAULT_HEARTBEAT_INTERVAL):
+        self._api = api
+        self._recording = recording
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self.beats = 0
+        self.error = None
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            try:
+                self._api.heartbeat(self._recording)
+            except Exception as e:
+                self.error = e
+                return
+            self.beats += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
 class FileProcessingAPI:
-    def __init__(self, baseurl):
+    def __init__(self, baseurl, session=None, algorithm_cache_size=DEFAULT_ALGORITHM_CACHE_SIZE):
         self._url = urljoin(baseurl, "/api/fileProcessing")
+        self._session = session or shared_session()
+        self.algorithm_cache = AlgorithmCache(algorithm_cache_size)
 
-    def get(self, recording_type, state):
-        r = requests.get(self._url, params={"type": recording_type, "state": state})
+    def connection_stats(self):
+        return self._session.connection_stats()
+
+    def get(self, recording_type, state, wait=None):
+        params = {"type": recording_type, "state": state}
+        if wait is not None:
+            params["wait"] = wait
+        r = self._session.get(self._url, params=params)
         if r.status_code == 204:
             return None
         if r.status_code == 200:
@@ -21,6 +103,32 @@ class FileProcessingAPI:
             return Recording(id_, data, None)
         raise_specific_exception(r)
 
+    def get_batch(self, recording_type, state, count, wait=None):
+        params = {"type": recording_type, "state": state, "count": count}
+        if wait is not None:
+            params["wait"] = wait
+        r = self._session.get(self._url, params=params)
+        if r.status_code == 204:
+            return []
+        if r.status_code == 200:
+            recordings = []
+            for data in r.json()["recordings"]:
+                id_ = data.pop("id")
+                recordings.append(Recording(id_, data, None))
+            return recordings
+        raise_specific_exception(r)
+
+    def heartbeat(self, recording):
+        url = self._url + "/{}/heartbeat".format(recording.id_)
+        r = self._session.post(url, data={"jobKey": recording["jobKey"]})
+        if r.status_code == 200:
+            return
+        raise_specific_exception(r)
+
+    def keep_alive(self, recording, interval=DEFAULT_HEARTBEAT_INTERVAL):
+        "Return a context manager that sends heartbeats for recording while it is processed."
+        return Heartbeat(self, recording, interval)
+
     def put(self, recording, success, complete, updates=None, new_object_key=None):
         post_data = {
             "id": recording.id_,
@@ -33,7 +141,7 @@ class FileProcessingAPI:
         if new_object_key:
             post_data["newProcessedFileKey"] = new_object_key
 
-        r = requests.put(self._url, data=post_data)
+        r = self._session.put(self._url, data=post_data)
         if r.status_code == 200:
             return
         raise_specific_exception(r)
@@ -41,28 +149,53 @@ class FileProcessingAPI:
     def get_algorithm_id(self, algorithm):
         url = self._url + "/algorithm"
         post_data = {"algorithm": json.dumps(algorithm)}
-        r = requests.post(url, data=post_data)
+        r = self._session.post(url, data=post_data)
         if r.status_code == 200:
             return r.json()["algorithmId"]
         raise_specific_exception(r)
 
     def add_track(self, recording, track, algorithm={"tracking-format": 42}):
-        algorithm_id = self.get_algorithm_id(algorithm)
+        algorithm_id = self.algorithm_cache.get(algorithm, self.get_algorithm_id)
         url = self._url + "/{}/tracks".format(recording.id_)
         post_data = {"data": json.dumps(track.data), "algorithmId": algorithm_id}
-        r = requests.post(url, data=post_data)
+        r = self._session.post(url, data=post_data)
         if r.status_code == 200:
             return r.json()["trackId"]
         raise_specific_exception(r)
 
+    def submit_tracks(self, recording, tracks, algorithm={"tracking-format": 42}):
+        """Add tracks and their tags to a recording in a single request.
+
+        The ids of the new tracks and tags are set on the given objects.
+        """
+        url = self._url + "/{}/tracks/batch".format(recording.id_)
+        tracks_data = [
+            {
+                "data": track.data,
+                "tags": [
+                    {"what": tag.what, "confidence": tag.confidence, "data": tag.data} for tag in track.tags
+                ],
+            }
+            for track in tracks
+        ]
+        post_data = {"tracks": json.dumps(tracks_data), "algorithm": json.dumps(algorithm)}
+        r = self._session.post(url, data=post_data)
+        if r.status_code != 200:
+            raise_specific_exception(r)
+        for track, added in zip(tracks, r.json()["tracks"]):
+            track.id_ = added["trackId"]
+            for tag, tag_id in zip(track.tags, added["trackTagIds"]):
+                tag.id_ = tag_id
+        return [track.id_ for track in tracks]
+
     def clear_tracks(self, recording):
-        r = requests.delete(self._url + "/{}/tracks".format(recording.id_))
+        r = self._session.delete(self._url + "/{}/tracks".format(recording.id_))
         raise_specific_exception(r)
 
     def add_track_tag(self, track, tag):
         url = self._url + "/{}/tracks/{}/tags".format(track.recording.id_, track.id_)
         post_data = {"what": tag.what, "confidence": tag.confidence, "data": json.dumps(tag.data)}
-        r = requests.post(url, data=post_data)
+        r = self._session.post(url, data=post_data)
         if r.status_code == 200:
             tag.id_ = r.json()["trackTagId"]
             track.tags.append(tag)
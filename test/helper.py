@@ -39,6 +39,10 @@ class Helper:
         api.name_or_email_login(nameOrEmail)
         return TestUser(username, api)
 
+    def device_api(self, devicename, groupname=None) -> DeviceAPI:
+        "Return a client for devicename using the password the helper gives it, without logging in."
+        return DeviceAPI(self.config.api_url, devicename, self._make_password(devicename), groupname)
+
     def login_as_device(self, devicename, groupname=None, password=None) -> TestDevice:
         if not password:
             password = self._make_password(devicename)
@@ -14,6 +14,21 @@ class TestBait:
         print("And a device should be able to download the file")
         helper.given_new_device(self, "possum-gone-ator", description="").download_audio_bait(audio_bait)
 
+    def test_can_resume_audio_bait_download(self, helper, tmp_path):
+        print("If a user Grant uploads an audio file")
+        grant = helper.given_new_user(self, "grant")
+        audio_bait = grant.upload_audio_bait()
+        with open("files/small.cptv", "rb") as f:
+            content = f.read()
+
+        print("And an earlier download of it was cut short")
+        dest = tmp_path / "bait.cptv"
+        dest.write_bytes(content[: len(content) // 2])
+
+        print("Then resuming the download should complete the file")
+        grant.download_audio_bait_to(audio_bait, str(dest), resume=True)
+        assert dest.read_bytes() == content
+
     def test_check_get_all_audio_baits(self, helper):
         print("If an audio bait file is uploaded")
         special_id = helper.random_id()
@@ -0,0 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from .testexception import AuthorizationError
+
+
+class TestDeviceRegistration:
+    def test_can_register_many_devices_at_once(self, helper):
+        num_devices = 50
+        user = helper.given_new_user(self, "fleet_manager")
+        group = helper.make_unique_group_name(self, "fleet")
+        user.create_group(group)
+        names = ["drone-{}-{}".format(helper.random_id(), n) for n in range(num_devices)]
+
+        def register(name):
+            return helper.device_api(name).register_as_new(group)
+
+        print("When {} devices register at the same time".format(num_devices))
+        with ThreadPoolExecutor(max_workers=20) as executor:
+            devices = list(executor.map(register, names))
+
+        print("Then each device should be registered with its own id")
+        ids = [device.id for device in devices]
+        assert None not in ids
+        assert len(set(ids)) == num_devices
+
+        print("And each device should be able to log in at the same time")
+        with ThreadPoolExecutor(max_workers=20) as executor:
+            logins = list(executor.map(lambda device: device.login(), devices))
+        assert len(logins) == num_devices
+
+        print("And the password queue should have drained afterwards")
+        stats = helper.admin_user().get_password_queue_stats()
+        assert stats["active"] == 0
+        assert stats["queueDepth"] == 0
+        assert "maxQueueDepth" in stats
+
+    def test_only_admins_can_see_password_queue(self, helper):
+        user = helper.given_new_user(self, "queue_watcher")
+        print("A user who isn't an admin shouldn't see the password queue")
+        with pytest.raises(AuthorizationError):
+            user.get_password_queue_stats()
@@ -1,8 +1,11 @@
+import asyncio
 import pytest
 import json
+import time
 
 from datetime import datetime, timedelta, timezone
 from test.testexception import AuthorizationError, UnprocessableError
+from test.asyncapibase import AsyncSession
 
 
 class TestEvent:
@@ -60,6 +63,57 @@ class TestEvent:
         print("Then the event with no details should should have a different eventDetailId.")
         assert screech != no_lure_id, "Events with no details should link to different eventDetailId."
 
+    def test_can_record_events_concurrently(self, helper):
+        user, device = helper.given_new_user_with_device(self, "busy_bee")
+        new_event_name = "E-" + helper.random_id()
+
+        async def record_events(count):
+            async with AsyncSession(max_concurrency=5) as session:
+                api = await device.async_api(session=session).login()
+                return await asyncio.gather(
+                    *(api.record_event(new_event_name, {"n": n}) for n in range(count))
+                )
+
+        print("When '{}' records 20 events concurrently".format(device.devicename))
+        results = asyncio.get_event_loop().run_until_complete(record_events(20))
+        assert all(added == 1 for added, _ in results)
+
+        print("Then every event should be stored against its own details")
+        assert len(set(detail_id for _, detail_id in results)) == 20
+        assert len(user.can_see_events(device, limit=100)) == 20
+
+    def test_can_record_batches_of_events(self, helper):
+        user, device = helper.given_new_user_with_device(self, "batcher")
+        new_event_name = "E-" + helper.random_id()
+        now = datetime.now()
+
+        print("When '{}' records events of different types through a batcher".format(device.devicename))
+        with device.event_batcher(max_events=3, interval=60) as batcher:
+            batcher.record_event("rpi-power-on", {})
+            batcher.record_event(new_event_name, {"n": 1})
+            print("Then nothing should be sent until the batch is full")
+            assert batcher.batches_sent == 0
+
+            batcher.record_event(new_event_name, {"n": 2}, times=[now, now - timedelta(seconds=2)])
+            assert batcher.batches_sent == 1
+            batcher.record_event(new_event_name, {"n": 1})
+
+        print("And the rest should be sent when the batcher is closed")
+        assert batcher.batches_sent == 2
+        assert len(user.can_see_events(device, limit=100)) == 5
+        assert len(user.can_see_events(device, type=new_event_name, limit=100)) == 4
+
+    def test_event_batcher_sends_after_interval(self, helper):
+        user, device = helper.given_new_user_with_device(self, "slow_batcher")
+
+        print("When '{}' records a single event through a batcher".format(device.devicename))
+        with device.event_batcher(max_events=100, interval=1) as batcher:
+            batcher.record_event("rpi-power-on", {})
+            print("Then it should be sent once the interval has passed")
+            time.sleep(3)
+            assert batcher.batches_sent == 1
+            assert len(user.can_see_events(device)) == 1
+
     def test_can_upload_event_for_device(self, helper):
         data_collector, device = helper.given_new_user_with_device(self, "data_collector")
 
@@ -2,7 +2,11 @@ from datetime import datetime, timezone
 from .recording import Recording
 from .track import Track
 from .track import TrackTag
+from .testexception import BadRequestError
 from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import time
 
 
 class TestFileProcessing:
@@ -27,6 +31,60 @@ class TestFileProcessing:
         recordings = [record for record in results if record]
         assert len(set(recordings)) == len(recordings)
 
+    def get_recording_batch(file_processing):
+        recordings = file_processing.get_batch("thermalRaw", "analyse", 3)
+        for recording in recordings:
+            assert "rawFileKey" in recording
+        return recordings
+
+    # tests that concurrent batch claims never hand out the same recording twice
+    def test_multi_thread_batch_processing(self, helper, file_processing):
+        num_recordings = 10
+        threads = num_recordings
+        for _ in range(num_recordings):
+            helper.given_a_recording(self)
+
+        thread_params = [file_processing for i in range(threads)]
+        p = Pool(threads)
+        results = p.map(TestFileProcessing.get_recording_batch, thread_params)
+        ids = [record.id_ for batch in results for record in batch]
+        assert len(ids) >= num_recordings
+        assert len(set(ids)) == len(ids)
+
+    def test_waiting_for_a_recording(self, helper, file_processing):
+        # A state of its own keeps this queue empty whatever other tests upload.
+        state = "waiting-{}".format(helper.random_id())
+        print("Given there are no recordings waiting in state '{}'".format(state))
+        assert file_processing.get("thermalRaw", state) is None
+
+        print("When a worker waits for a recording and then one is uploaded")
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            waiting = executor.submit(file_processing.get, "thermalRaw", state, wait=30)
+            time.sleep(1)
+            recording = helper.given_a_recording(self, props={"processingState": state})
+            claimed = waiting.result()
+
+        print("Then the worker should be given the new recording")
+        assert claimed is not None
+        assert claimed.id_ == recording.id_
+
+    def test_heartbeat_keeps_job_alive(self, helper, file_processing):
+        helper.given_a_recording(self)
+        recording = file_processing.get("thermalRaw", "analyse")
+
+        print("When a worker sends heartbeats while processing a recording")
+        with file_processing.keep_alive(recording, interval=0.2) as heartbeat:
+            time.sleep(1)
+
+        print("Then the heartbeats should have been accepted")
+        assert heartbeat.error is None
+        assert heartbeat.beats > 0
+
+        print("But a heartbeat with the wrong jobKey should be rejected")
+        recording["jobKey"] = "not-the-job-key"
+        with pytest.raises(BadRequestError):
+            file_processing.heartbeat(recording)
+
     def test_thermal_video(self, helper, file_processing):
         user = helper.admin_user()
 
@@ -128,6 +186,26 @@ class TestFileProcessing:
         assert algorithm1 != algorithm2
         assert algorithm2 == algorithm3
 
+    def test_add_track_caches_algorithm_ids(self, helper, file_processing):
+        helper.given_a_recording(self)
+        recording = file_processing.get("thermalRaw", "analyse")
+        algorithm = {"timestamp": datetime.now(timezone.utc).isoformat(), "speed": "quick"}
+        file_processing.algorithm_cache.invalidate()
+        misses = file_processing.algorithm_cache.misses
+
+        print("When two tracks are added with the same algorithm, its keys in a different order")
+        file_processing.add_track(recording, Track.create(recording), algorithm)
+        reordered = dict(reversed(list(algorithm.items())))
+        file_processing.add_track(recording, Track.create(recording), reordered)
+
+        print("Then the algorithm id should only be looked up once")
+        assert file_processing.algorithm_cache.misses == misses + 1
+
+        print("And looked up again once it has been invalidated")
+        file_processing.algorithm_cache.invalidate(algorithm)
+        file_processing.add_track(recording, Track.create(recording), algorithm)
+        assert file_processing.algorithm_cache.misses == misses + 2
+
     def test_can_add_track_to_recording(self, helper, file_processing):
         user = helper.admin_user()
         helper.given_a_recording(self)
@@ -171,6 +249,25 @@ class TestFileProcessing:
         file_processing.add_track_tag(track, tag)
         user.can_see_track(track)
 
+    def test_can_submit_tracks_with_tags(self, helper, file_processing):
+        user = helper.admin_user()
+        helper.given_a_recording(self)
+
+        recording = file_processing.get("thermalRaw", "analyse")
+
+        tracks = [Track.create(recording, start_s=start_s) for start_s in (0, 20)]
+        for track in tracks:
+            track.tags = [TrackTag.create(track, automatic=True) for _ in range(2)]
+
+        print("When the tracks and their tags are submitted in one request")
+        file_processing.submit_tracks(recording, tracks)
+
+        print("Then each track and tag should be visible")
+        for track in tracks:
+            assert track.id_ is not None
+            assert all(tag.id_ is not None for tag in track.tags)
+            user.can_see_track(track)
+
     def test_reprocess_multiple_recordings(self, helper, file_processing):
         user = helper.admin_user()
 
@@ -1,7 +1,11 @@
+from datetime import datetime, timedelta
 from urllib.parse import urljoin
 
 import requests
 
+from .apibase import PooledSession
+from .userapi import UserAPI
+
 
 class TestMiddleware:
     def test_invalid_json_body_in_post_returns_400_level_status(self, test_config):
@@ -27,3 +31,47 @@ class TestMiddleware:
         response = requests.patch(url, data="{}")
         print("  The response code should be 401")
         assert response.status_code == 401
+
+    def test_pooled_session_reuses_connections(self, test_config):
+        print("When I make several API calls through one pooled session")
+
+        session = PooledSession()
+        api = UserAPI(
+            test_config.api_url,
+            test_config.admin_username,
+            test_config.admin_email,
+            test_config.admin_password,
+            session=session,
+        ).login()
+        for _ in range(5):
+            api.get_groups_as_string()
+
+        print("  Only one connection should have been opened")
+        stats = api.connection_stats()
+        assert stats["requests"] == 6
+        assert stats["connections"] == 1
+        assert stats["reused"] == 5
+
+    def test_large_responses_are_compressed(self, helper, test_config):
+        user, device = helper.given_new_user_with_device(self, "squeezer")
+        now = datetime.now()
+        times = [now - timedelta(seconds=n) for n in range(50)]
+        added, _ = device._deviceapi.record_event("test", {"note": "a large response"}, times)
+        assert added == 50
+
+        url = urljoin(test_config.api_url, "/api/v1/events")
+        params = {"deviceId": device.get_id(), "limit": 100}
+        auth_header = user._userapi._auth_header
+
+        print("When the user asks for the device's events and accepts gzip")
+        response = requests.get(url, params=params, headers=dict(auth_header, **{"Accept-Encoding": "gzip"}))
+        print("  The response should be compressed, and decode to all of the events")
+        assert response.headers.get("Content-Encoding") == "gzip"
+        assert len(response.json()["rows"]) == 50
+
+        print("But if the user doesn't accept gzip the response should not be compressed")
+        response = requests.get(
+            url, params=params, headers=dict(auth_header, **{"Accept-Encoding": "identity"})
+        )
+        assert "Content-Encoding" not in response.headers
+        assert len(response.json()["rows"]) == 50
@@ -1,6 +1,9 @@
+import io
 import pytest
 import json
 
+from test.testexception import BadRequestError
+
 
 class TestRecordings:
     def test_unprocessed_recording_doesnt_return_processed_jwt(self, helper):
@@ -33,3 +36,127 @@ class TestRecordings:
         print("  The recording response should not contain the fileKeys")
         assert "rawFileKey" not in recording_response
         assert "fileKey" not in recording_response
+
+    def test_can_iterate_over_all_recordings(self, helper):
+        print("If a new user uploads several recordings")
+        bob = helper.given_new_user(self, "bob_iter")
+        bobsGroup = helper.make_unique_group_name(self, "bobs_group")
+        bob.create_group(bobsGroup)
+        bobsDevice = helper.given_new_device(self, "bobs_device", bobsGroup)
+        recordings = [bobsDevice.upload_recording() for _ in range(5)]
+
+        print("And then iterates over them two at a time")
+        rows = list(bob.iter_recordings(page_size=2))
+
+        print("  Every recording should be returned exactly once")
+        assert sorted(row["id"] for row in rows) == sorted(recording.id_ for recording in recordings)
+
+    def test_can_page_through_recordings_with_cursor(self, helper):
+        print("If a new user uploads three recordings")
+        bob = helper.given_new_user(self, "bob_cursor")
+        bobsGroup = helper.make_unique_group_name(self, "bobs_group")
+        bob.create_group(bobsGroup)
+        bobsDevice = helper.given_new_device(self, "bobs_device", bobsGroup)
+        recordings = [bobsDevice.upload_recording() for _ in range(3)]
+
+        print("And then queries the first two")
+        first = bob.query_recordings(limit=2, return_json=True)
+        assert len(first["rows"]) == 2
+        assert first["nextCursor"] is not None
+
+        print("  Following the cursor should return the remaining recording and no further cursor")
+        second = bob.query_recordings(limit=2, cursor=first["nextCursor"], return_json=True)
+        assert len(second["rows"]) == 1
+        assert second["nextCursor"] is None
+
+        ids = [row["id"] for row in first["rows"] + second["rows"]]
+        assert sorted(ids) == sorted(recording.id_ for recording in recordings)
+
+        print("  And both pages should count all three recordings, as offset paging does")
+        assert first["count"] == 3
+        assert second["count"] == 3
+        assert second["hasMore"] is False
+
+    def test_can_query_recordings_without_counting(self, helper):
+        print("If a new user uploads three recordings")
+        bob = helper.given_new_user(self, "bob_count")
+        bobsGroup = helper.make_unique_group_name(self, "bobs_group")
+        bob.create_group(bobsGroup)
+        bobsDevice = helper.given_new_device(self, "bobs_device", bobsGroup)
+        for _ in range(3):
+            bobsDevice.upload_recording()
+
+        print("And then queries two of them without counting them all")
+        first = bob.query_recordings(limit=2, count_mode="none", return_json=True)
+
+        print("  There should be no count, but the response should say there are more")
+        assert first["count"] is None
+        assert len(first["rows"]) == 2
+        assert first["hasMore"]
+
+        print("  And the last page should say there are no more")
+        last = bob.query_recordings(limit=2, offset=2, count_mode="none", return_json=True)
+        assert len(last["rows"]) == 1
+        assert not last["hasMore"]
+
+    def test_can_query_selected_fields_of_recordings(self, helper):
+        print("If a new user uploads a recording")
+        bob = helper.given_new_user(self, "bob_fields")
+        bobsGroup = helper.make_unique_group_name(self, "bobs_group")
+        bob.create_group(bobsGroup)
+        bobsDevice = helper.given_new_device(self, "bobs_device", bobsGroup)
+        recording = bobsDevice.upload_recording()
+
+        print("And then queries only the recording times")
+        rows = bob.query_recordings(fields=["recordingDateTime"])
+
+        print("  Only the id and recording time should be returned")
+        assert [row["id"] for row in rows] == [recording.id_]
+        assert set(rows[0].keys()) == {"id", "recordingDateTime"}
+
+        print("  And associations can be selected too")
+        rows = bob.query_recordings(fields=["type", "Device"])
+        assert set(rows[0].keys()) == {"id", "type", "Device"}
+        assert rows[0]["Device"]["devicename"] == bobsDevice.devicename
+
+        print("  Including associations with many rows per recording")
+        bob.tag_recording(recording, {"what": "possum", "confidence": 0.9})
+        rows = bob.query_recordings(fields=["id", "Tags"], limit=10)
+        assert set(rows[0].keys()) == {"id", "Tags"}
+        assert [tag["what"] for tag in rows[0]["Tags"]] == ["possum"]
+
+        print("  But asking for an unknown field should fail")
+        with pytest.raises(BadRequestError):
+            bob.query_recordings(fields=["rawFileKey"])
+
+    def test_can_download_recording_in_parallel_parts(self, helper, tmp_path):
+        print("If a new user uploads a recording")
+        bob = helper.given_new_user(self, "bob_parts")
+        bobsGroup = helper.make_unique_group_name(self, "bobs_group")
+        bob.create_group(bobsGroup)
+        bobsDevice = helper.given_new_device(self, "bobs_device", bobsGroup)
+        recording = bobsDevice.upload_recording()
+
+        print("And then downloads it in three parts at once")
+        dest = tmp_path / "recording.cptv"
+        bob.download_cptv_parallel(recording, str(dest), parts=3)
+
+        print("  The downloaded file should match the upload")
+        assert dest.read_bytes() == recording.content
+
+    def test_can_download_recording_to_file(self, helper):
+        print("If a new user uploads a recording")
+        bob = helper.given_new_user(self, "bob_download")
+        bobsGroup = helper.make_unique_group_name(self, "bobs_group")
+        bob.create_group(bobsGroup)
+        bobsDevice = helper.given_new_device(self, "bobs_device", bobsGroup)
+        recording = bobsDevice.upload_recording()
+
+        print("And then downloads it to a file in small chunks")
+        content = io.BytesIO()
+        stats = bob.download_cptv_to(recording, content, chunk_size=1000)
+
+        print("  The file should match the upload and the transfer should be measured")
+        assert content.getvalue() == recording.content
+        assert stats.bytes == len(recording.content)
+        assert stats.throughput > 0
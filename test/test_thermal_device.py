@@ -1,3 +1,9 @@
+import pytest
+
+from .recording import Recording
+from .testexception import BadRequestError
+
+
 class TestThermalDevice:
     def test_can_upload_cptv(self, helper):
         description = "If a new device 'Destroyer' signs up"
@@ -11,3 +17,77 @@ class TestThermalDevice:
 
         print("And the CPTV file should be visible to super users")
         helper.admin_user().can_see_recording_from(destroyer)
+
+    def test_can_upload_cptv_in_chunks(self, helper):
+        print("If a new user's device uploads a CPTV file in small chunks")
+        bob, bobsDevice = helper.given_new_user_with_device(self, "bob_chunks")
+        recording = bobsDevice.upload_recording_in_chunks(chunk_size=100000)
+
+        print("Then the user should be able to download the whole file with the recording's details")
+        bob.can_download_correct_recording(recording)
+
+    def test_chunked_upload_only_resends_missing_chunks(self, helper):
+        print("If a new user's device starts a chunked upload")
+        bob, bobsDevice = helper.given_new_user_with_device(self, "bob_resume")
+        deviceapi = bobsDevice._deviceapi
+        filename = "files/small.cptv"
+        props = bobsDevice.get_new_recording_props()
+        chunk_size = 100000
+        upload_id = deviceapi.start_upload(filename, props)["uploadId"]
+
+        print("  and the second chunk goes missing")
+        assert deviceapi.upload_chunk(upload_id, filename, 0, chunk_size) == chunk_size
+        assert deviceapi.upload_chunk(upload_id, filename, 2 * chunk_size, chunk_size) == chunk_size
+
+        print("Then the server should report where to carry on from")
+        assert deviceapi.upload_offset(upload_id) == chunk_size
+
+        print("And once the missing chunk is sent the chunk after it isn't needed again")
+        assert deviceapi.upload_chunk(upload_id, filename, chunk_size, chunk_size) == 3 * chunk_size
+
+        print("And the rest of the file can be sent to finish the upload")
+        recording_id = deviceapi.resume_upload(upload_id, filename, chunk_size)
+        props["rawMimeType"] = "application/x-cptv"
+        bob.can_download_correct_recording(Recording(recording_id, props, filename))
+
+    def test_finishing_a_chunked_upload_again_returns_the_same_recording(self, helper):
+        print("If a device finishes a chunked upload")
+        device = helper.given_new_device(self, "refinisher")
+        deviceapi = device._deviceapi
+        filename = "files/small.cptv"
+        upload_id = deviceapi.start_upload(filename, device.get_new_recording_props())["uploadId"]
+        recording_id = deviceapi.resume_upload(upload_id, filename, 100000)
+
+        print("Then finishing it again, as if the response was lost, should give the same recording")
+        assert deviceapi.finalize_upload(upload_id) == recording_id
+
+    def test_chunked_upload_with_wrong_hash_is_discarded(self, helper):
+        print("If a device sends a file in chunks that doesn't match its fileHash")
+        device = helper.given_new_device(self, "mismatcher")
+        deviceapi = device._deviceapi
+        filename = "files/small.cptv"
+        props = dict(device.get_new_recording_props(), fileHash="0" * 40)
+        upload_id = deviceapi.start_upload(filename, props)["uploadId"]
+
+        print("Then finishing the upload should fail")
+        with pytest.raises(BadRequestError):
+            deviceapi.resume_upload(upload_id, filename, 100000)
+
+        print("And the session should be gone, so the file has to be uploaded again")
+        with pytest.raises(BadRequestError):
+            deviceapi.upload_offset(upload_id)
+
+    def test_duplicate_upload_returns_existing_recording(self, helper):
+        print("If a new device uploads a CPTV file")
+        device = helper.given_new_device(self, "duplicator")
+        recording = device.upload_recording()
+        same_time = {"recordingDateTime": recording["recordingDateTime"]}
+
+        print("Then uploading the same file again should give back the same recording")
+        assert device.upload_recording(properties=same_time).id_ == recording.id_
+
+        print("And so should uploading it again in chunks")
+        assert device.upload_recording_in_chunks(100000, properties=same_time).id_ == recording.id_
+
+        print("But the same file with a different recording time is a new recording")
+        assert device.upload_recording().id_ != recording.id_
@@ -1,4 +1,5 @@
 from datetime import datetime, timedelta, timezone
+from .asyncdeviceapi import AsyncDeviceAPI
 from .deviceapi import DeviceAPI
 from .recording import Recording
 
@@ -12,6 +13,11 @@ class TestDevice:
         self.group = group
         self.location = location
 
+    def async_api(self, session=None) -> AsyncDeviceAPI:
+        "Return an asyncio client with this device's credentials.  It still needs to log in."
+        api = self._deviceapi
+        return AsyncDeviceAPI(api._baseurl, api._loginname, api._password, self.group, session=session)
+
     def get_id(self):
         return self._id
 
@@ -35,6 +41,17 @@ class TestDevice:
 
         return Recording(recording_id, props, filename)
 
+    def upload_recording_in_chunks(self, chunk_size, properties=None):
+        props = self.get_new_recording_props()
+        if properties:
+            props.update(properties)
+        filename = "files/small.cptv"
+        recording_id = self._deviceapi.upload_recording(
+            filename, props, chunked_threshold=0, chunk_size=chunk_size
+        )
+        props["rawMimeType"] = "application/x-cptv"
+        return Recording(recording_id, props, filename)
+
     def get_new_recording_props(self):
         props = {
             "type": "thermalRaw",
@@ -91,6 +108,9 @@ class TestDevice:
         assert count == 1
         return detailsId
 
+    def event_batcher(self, max_events, interval):
+        return self._deviceapi.event_batcher(max_events, interval)
+
     def record_three_events_at_once(self, detailId):
         print("    which has three events uploaded with detail id {}.".format(detailId))
         now = datetime.now()
@@ -1,4 +1,3 @@
-import csv
 import io
 import pytest
 
@@ -62,6 +61,9 @@ class TestUser:
     def query_recordings(self, **options):
         return self._userapi.query(**options)
 
+    def iter_recordings(self, page_size=100, **options):
+        return self._userapi.iter_recordings(page_size=page_size, **options)
+
     def query_visits(self, **options):
         return self._userapi.query_visits(**options)
 
@@ -147,10 +149,17 @@ class TestUser:
             )
 
     def get_report(self, raw=False, **args):
-        text = self._userapi.report(**args)
         if raw:
-            return text.splitlines()
-        return csv.DictReader(text.splitlines())
+            return self._userapi.report(**args).splitlines()
+        return self._userapi.iter_report(**args)
+
+    def download_cptv_to(self, recording, path_or_fileobj, chunk_size=None):
+        if chunk_size is None:
+            return self._userapi.download_cptv_to(recording.id_, path_or_fileobj)
+        return self._userapi.download_cptv_to(recording.id_, path_or_fileobj, chunk_size)
+
+    def download_cptv_parallel(self, recording, dest, parts=4):
+        return self._userapi.download_cptv_parallel(recording.id_, dest, parts)
 
     def can_download_correct_recording(self, recording):
         r = self._userapi.get_recording_response(recording.id_)
@@ -307,6 +316,9 @@ class TestUser:
     def download_audio_bait(self, file_id):
         return self._userapi.download_file(file_id)
 
+    def download_audio_bait_to(self, file_id, dest, resume=False):
+        return self._userapi.download_file(file_id, dest, resume=resume)
+
     def get_all_audio_baits(self):
         return AudioBaitList(self._userapi.query_files(where={"type": "audioBait"}))
 
@@ -360,6 +372,9 @@ class TestUser:
     def set_global_permission(self, user, permission):
         self._userapi.set_global_permission(user, permission)
 
+    def get_password_queue_stats(self):
+        return self._userapi.get_password_queue_stats()
+
     def add_to_group(self, newuser, groupname):
         self._userapi.add_user_to_group(newuser, groupname)
 
@@ -1,20 +1,22 @@
+import csv
+import io
 import json
 import os
-import requests
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from requests_toolbelt.multipart.encoder import MultipartEncoder
 from urllib.parse import urljoin
 from datetime import datetime
 
 from .testexception import raise_specific_exception
-from .apibase import APIBase
+from .apibase import APIBase, DEFAULT_DOWNLOAD_CHUNK_SIZE, serialise_params
 from typing import List
 from .testdevice import TestDevice
 
 
 class UserAPI(APIBase):
-    def __init__(self, baseurl, username, email, password="password"):
-        super().__init__("user", baseurl, username, password)
+    def __init__(self, baseurl, username, email, password="password", session=None):
+        super().__init__("user", baseurl, username, password, session=session)
         self.postdata["email"] = email
         self.email = email
 
@@ -29,7 +31,7 @@ class UserAPI(APIBase):
 
     def list_users(self):
         url = urljoin(self._baseurl, "/api/v1/listUsers")
-        response = requests.get(url, headers=self._auth_header)
+        response = self._session.get(url, headers=self._auth_header)
         if response.status_code == 200:
             return response
         raise_specific_exception(response)
@@ -39,7 +41,9 @@ class UserAPI(APIBase):
         if access is not None:
             post_data["access"] = access
 
-        response = requests.post(urljoin(self._baseurl, "/token"), headers=self._auth_header, json=post_data)
+        response = self._session.post(
+            urljoin(self._baseurl, "/token"), headers=self._auth_header, json=post_data
+        )
         json_response = self._check_response(response)
 
         if set_token:
@@ -49,7 +53,7 @@ class UserAPI(APIBase):
     def name_or_email_login(self, nameOrEmail):
         url = urljoin(self._baseurl, "/authenticate_" + self._logintype)
         data = {"nameOrEmail": nameOrEmail, "password": self._password}
-        response = requests.post(url, data=data)
+        response = self._session.post(url, data=data)
         self.check_login_response(response)
         return self
 
@@ -66,22 +70,27 @@ class UserAPI(APIBase):
         deviceIds=None,
         return_json=False,
         where=None,
+        cursor=None,
+        fields=None,
+        count_mode=None,
     ):
-        if where is None:
-            where = defaultdict(dict)
-        where["duration"] = {"$gte": min_secs}
-        if startDate is not None:
-            where["recordingDateTime"]["$gte"] = startDate.isoformat()
-        if endDate is not None:
-            where["recordingDateTime"]["$lte"] = endDate.isoformat()
-        if deviceIds is not None:
-            where["DeviceId"] = deviceIds
+        """Query recordings.
+
+        If fields is given only those fields (and the id) are returned for
+        each recording, e.g. fields=["recordingDateTime"].  A count_mode of
+        "none" skips counting all of the matching recordings; the response's
+        hasMore still says whether there is another page.
+        """
+        where = make_recording_where(where, startDate, endDate, min_secs, deviceIds)
 
         return self._query(
             "recordings",
             where=where,
             limit=limit,
             offset=offset,
+            cursor=cursor,
+            fields=fields,
+            countMode=count_mode,
             tagMode=tagmode,
             tags=tags,
             filterOptions=filterOptions,
@@ -102,15 +111,7 @@ class UserAPI(APIBase):
         return_json=True,
         where=None,
     ):
-        if where is None:
-            where = defaultdict(dict)
-        where["duration"] = {"$gte": min_secs}
-        if startDate is not None:
-            where["recordingDateTime"]["$gte"] = startDate.isoformat()
-        if endDate is not None:
-            where["recordingDateTime"]["$lte"] = endDate.isoformat()
-        if deviceIds is not None:
-            where["DeviceId"] = deviceIds
+        where = make_recording_where(where, startDate, endDate, min_secs, deviceIds)
         return self._query(
             "recordings/visits",
             where=where,
@@ -122,7 +123,26 @@ class UserAPI(APIBase):
             return_json=return_json,
         )
 
-    def report(
+    def report(self, **options):
+        "Return the text of a CSV report. Takes the same options as iter_report."
+        return self._report_response(**options).text
+
+    def iter_report(self, chunk_size=64 * 1024, **options):
+        """Yield the rows of a CSV report as dicts.
+
+        The report is parsed as it is downloaded so memory use doesn't grow
+        with the size of the report.
+        """
+        response = self._report_response(stream=True, **options)
+        with response:
+            response.raw.decode_content = True
+            response.raw.auto_close = False
+            text = io.TextIOWrapper(
+                io.BufferedReader(response.raw, buffer_size=chunk_size), encoding="utf-8", newline=""
+            )
+            yield from csv.DictReader(text)
+
+    def _report_response(
         self,
         startDate=None,
         endDate=None,
@@ -136,15 +156,9 @@ class UserAPI(APIBase):
         jwt=None,
         report_type=None,
         audiobait=None,
+        stream=False,
     ):
-        where = defaultdict(dict)
-        where["duration"] = {"$gte": min_secs}
-        if startDate is not None:
-            where["recordingDateTime"]["$gte"] = startDate.isoformat()
-        if endDate is not None:
-            where["recordingDateTime"]["$lte"] = endDate.isoformat()
-        if deviceIds is not None:
-            where["DeviceId"] = deviceIds
+        where = make_recording_where(None, startDate, endDate, min_secs, deviceIds)
 
         url = urljoin(self._baseurl, "/api/v1/recordings/report")
         params = {
@@ -168,14 +182,14 @@ class UserAPI(APIBase):
         else:
             headers = self._auth_header
 
-        response = requests.get(url, params=serialise_params(params), headers=headers)
+        response = self._session.get(url, params=serialise_params(params), headers=headers, stream=stream)
         if response.status_code == 200:
-            return response.text
+            return response
         raise_specific_exception(response)
 
     def update_user(self, body):
         url = urljoin(self._baseurl, "/api/v1/users")
-        response = requests.patch(url, data=body, headers=self._auth_header)
+        response = self._session.patch(url, data=body, headers=self._auth_header)
         self._check_response(response)
 
     def get_recording(self, recording_id, params=None):
@@ -187,32 +201,32 @@ class UserAPI(APIBase):
         else:
             request = "/api/v1/recordings/needs-tag"
         url = urljoin(self._baseurl, request)
-        r = requests.get(url, headers=self._auth_header, params=None)
+        r = self._session.get(url, headers=self._auth_header, params=None)
         return self._check_response(r)
 
     def get_recording_response(self, recording_id, params=None):
         url = urljoin(self._baseurl, "/api/v1/recordings/{}".format(recording_id))
-        r = requests.get(url, headers=self._auth_header, params=params)
+        r = self._session.get(url, headers=self._auth_header, params=params)
         return self._check_response(r)
 
     def delete_recording(self, recording_id):
         url = urljoin(self._baseurl, "/api/v1/recordings/{}".format(recording_id))
-        r = requests.delete(url, headers=self._auth_header)
+        r = self._session.delete(url, headers=self._auth_header)
         return self._check_response(r)
 
     def update_recording(self, recording_id, updates):
         url = urljoin(self._baseurl, "/api/v1/recordings/{}".format(recording_id))
-        r = requests.patch(url, headers=self._auth_header, data={"updates": json.dumps(updates)})
+        r = self._session.patch(url, headers=self._auth_header, data={"updates": json.dumps(updates)})
         return self._check_response(r)
 
     def reprocess(self, recording_id, params=None):
         reprocessURL = urljoin(self._baseurl, "/api/v1/reprocess/{}".format(recording_id))
-        r = requests.get(reprocessURL, headers=self._auth_header, params=params)
+        r = self._session.get(reprocessURL, headers=self._auth_header, params=params)
         return self._check_response(r)
 
     def reprocess_recordings(self, recordings, params=None):
         reprocessURL = urljoin(self._baseurl, "/api/v1/reprocess")
-        r = requests.post(
+        r = self._session.post(
             reprocessURL, headers=self._auth_header, data={"recordings": json.dumps(recordings)}
         )
         return r.status_code, r.json()
@@ -220,14 +234,27 @@ class UserAPI(APIBase):
     def download_cptv(self, recording_id):
         return self._download_recording(recording_id, "downloadRawJWT")
 
+    def download_cptv_to(self, recording_id, path_or_fileobj, chunk_size=DEFAULT_DOWNLOAD_CHUNK_SIZE):
+        "Download a recording's raw file to a path or file object, returning DownloadStats."
+        recording_json = self.get_recording_response(recording_id)
+        return self.download_to(recording_json["downloadRawJWT"], path_or_fileobj, chunk_size)
+
+    def download_cptv_parallel(self, recording_id, dest, parts=4):
+        "Download a recording's raw file to dest using parts concurrent range requests."
+        recording_json = self.get_recording_response(recording_id)
+        self._download_signed_parallel(
+            recording_json["downloadRawJWT"], dest, recording_json["rawSize"], parts
+        )
+        return dest
+
     def _download_recording(self, id, jwt_key):
         url = urljoin(self._baseurl, "/api/v1/recordings/{}".format(id))
-        r = requests.get(url, headers=self._auth_header)
+        r = self._session.get(url, headers=self._auth_header)
         d = self._check_response(r)
         return self._download_signed(d[jwt_key])
 
     def _get_all(self, url):
-        r = requests.get(urljoin(self._baseurl, url), params={"where": "{}"}, headers=self._auth_header)
+        r = self._session.get(urljoin(self._baseurl, url), params={"where": "{}"}, headers=self._auth_header)
         if r.status_code == 200:
             return r.json()
         raise_specific_exception(r)
@@ -244,7 +271,7 @@ class UserAPI(APIBase):
             query["operator"] = operator
 
         url = urljoin(self._baseurl, "/api/v1/devices/query")
-        r = requests.get(url, headers=self._auth_header, params=serialise_params(query))
+        r = self._session.get(url, headers=self._auth_header, params=serialise_params(query))
         return self._check_response(r)
 
     def get_devices_as_json(self):
@@ -265,24 +292,24 @@ class UserAPI(APIBase):
 
     def create_group(self, groupname):
         url = urljoin(self._baseurl, "/api/v1/groups")
-        response = requests.post(url, headers=self._auth_header, data={"groupname": groupname})
+        response = self._session.post(url, headers=self._auth_header, data={"groupname": groupname})
         self._check_response(response)
         return response.json()
 
     def get_user_details(self, username):
         url = urljoin(self._baseurl, "/api/v1/users/{}".format(username))
-        response = requests.get(url, headers=self._auth_header)
+        response = self._session.get(url, headers=self._auth_header)
         return response.json()
 
     def tag_recording(self, recording_id, tagDictionary):
         url = urljoin(self._baseurl, "/api/v1/tags/")
         tagData = {"tag": json.dumps(tagDictionary), "recordingId": recording_id}
-        response = requests.post(url, headers=self._auth_header, data=tagData)
+        response = self._session.post(url, headers=self._auth_header, data=tagData)
         return self._check_response(response)
 
     def delete_recording_tag(self, tag_id):
         tagData = {"tagId": tag_id}
-        response = requests.delete(
+        response = self._session.delete(
             urljoin(self._baseurl, "/api/v1/tags".format(tag_id)), headers=self._auth_header, data=tagData
         )
         return self._check_response(response)["messages"]
@@ -292,14 +319,16 @@ class UserAPI(APIBase):
             "events/errors", deviceId=deviceId, startTime=startTime, endTime=endTime, limit=limit
         )
 
-    def query_events(self, deviceId=None, startTime=None, endTime=None, type=None, limit=20, latest=None):
-
+    def query_events(
+        self, deviceId=None, startTime=None, endTime=None, type=None, limit=20, latest=None, offset=None
+    ):
         return self._query(
             "events",
             deviceId=deviceId,
             startTime=startTime,
             endTime=endTime,
             limit=limit,
+            offset=offset,
             type=type,
             latest=latest,
         )
@@ -309,9 +338,30 @@ class UserAPI(APIBase):
             where = {}
         return self._query("files", where=where, limit=limit, offset=offset)
 
+    def iter_recordings(self, page_size=100, **options):
+        """Yield every recording matching the query options, fetching the next page in the background.
+
+        The recordings aren't counted unless a count_mode is given.
+        """
+        options.setdefault("count_mode", "none")
+
+        def fetch_page(cursor):
+            response = self.query(limit=page_size, cursor=cursor, return_json=True, **options)
+            return response["rows"], response["nextCursor"]
+
+        return iter_pages(fetch_page, None)
+
+    def iter_events(self, page_size=100, **options):
+        "Yield every event matching the query options, fetching the next page in the background."
+        return iter_pages(offset_pages(self.query_events, page_size, **options), 0)
+
+    def iter_files(self, where=None, page_size=100):
+        "Yield every file matching where, fetching the next page in the background."
+        return iter_pages(offset_pages(self.query_files, page_size, where=where), 0)
+
     def _do_delete(self, deleteType, id):
         url = urljoin(self._baseurl, "/api/v1/{}/{}".format(deleteType, id))
-        response = requests.delete(url, headers=self._auth_header)
+        response = self._session.delete(url, headers=self._auth_header)
         return self._check_response(response)
 
     def _query(self, queryname, **params):
@@ -320,7 +370,7 @@ class UserAPI(APIBase):
         params.setdefault("offset", 0)
         return_json = params.pop("return_json", False)
 
-        response = requests.get(url, params=serialise_params(params), headers=self._auth_header)
+        response = self._session.get(url, params=serialise_params(params), headers=self._auth_header)
         if response.status_code == 200:
             if return_json:
                 return response.json()
@@ -337,7 +387,7 @@ class UserAPI(APIBase):
                 fields={"data": json_props, "file": (os.path.basename(filename), content)}
             )
             headers = {"Content-Type": multipart_data.content_type, "Authorization": self._token}
-            r = requests.post(url, data=multipart_data, headers=headers)
+            r = self._session.post(url, data=multipart_data, headers=headers)
         self._check_response(r)
         return r.json()["recordingId"]
 
@@ -347,12 +397,12 @@ class UserAPI(APIBase):
     def upload_schedule(self, devicesIds, schedule):
         url = urljoin(self._baseurl, "api/v1/schedules")
         props = {"devices": json.dumps(devicesIds), "schedule": json.dumps(schedule)}
-        response = requests.post(url, data=props, headers=self._auth_header)
+        response = self._session.post(url, data=props, headers=self._auth_header)
         self._check_response(response)
 
     def get_audio_schedule(self, deviceID):
         url = urljoin(self._baseurl, "/api/v1/schedules/{}".format(deviceID))
-        response = requests.get(url, headers=self._auth_header)
+        response = self._session.get(url, headers=self._auth_header)
         self._check_response(response)
         return response.json()
 
@@ -372,25 +422,30 @@ class UserAPI(APIBase):
 
     def set_global_permission(self, user, permission):
         url = urljoin(self._baseurl, "/api/v1/admin/global_permission/" + user)
-        response = requests.patch(url, headers=self._auth_header, data={"permission": permission})
+        response = self._session.patch(url, headers=self._auth_header, data={"permission": permission})
         self._check_response(response)
 
+    def get_password_queue_stats(self):
+        url = urljoin(self._baseurl, "/api/v1/admin/password_queue")
+        response = self._session.get(url, headers=self._auth_header)
+        return self._check_response(response)
+
     def add_user_to_group(self, newuser, groupname):
         url = urljoin(self._baseurl, "/api/v1/groups/users")
         props = {"group": groupname, "username": newuser.username, "admin": "false"}
-        response = requests.post(url, headers=self._auth_header, data=props)
+        response = self._session.post(url, headers=self._auth_header, data=props)
         self._check_response(response)
 
     def add_to_group_as_group_admin(self, newuser, groupname):
         url = urljoin(self._baseurl, "/api/v1/groups/users")
         props = {"group": groupname, "username": newuser.username, "admin": "true"}
-        response = requests.post(url, headers=self._auth_header, data=props)
+        response = self._session.post(url, headers=self._auth_header, data=props)
         self._check_response(response)
 
     def remove_user_from_group(self, olduser, groupname):
         url = urljoin(self._baseurl, "/api/v1/groups/users")
         props = {"group": groupname, "username": olduser.username}
-        response = requests.delete(url, headers=self._auth_header, data=props)
+        response = self._session.delete(url, headers=self._auth_header, data=props)
         self._check_response(response)
 
     def add_stations_to_group(self, group_id_or_name, stations, fromDate=None):
@@ -400,35 +455,35 @@ class UserAPI(APIBase):
             props["stations"] = stations
         if fromDate is not None:
             props["fromDate"] = fromDate
-        response = requests.post(url, headers=self._auth_header, data=props)
+        response = self._session.post(url, headers=self._auth_header, data=props)
         self._check_response(response)
         return response.json()
 
     def get_stations_for_group(self, group_id_or_name):
         url = urljoin(self._baseurl, "/api/v1/groups/{}/stations".format(group_id_or_name))
-        response = requests.get(url, headers=self._auth_header)
+        response = self._session.get(url, headers=self._auth_header)
         self._check_response(response)
         return response.json()
 
     def add_user_to_device(self, newuser, deviceid):
         url = urljoin(self._baseurl, "/api/v1/devices/users")
         props = {"deviceId": deviceid, "username": newuser.username, "admin": "false"}
-        response = requests.post(url, headers=self._auth_header, data=props)
+        response = self._session.post(url, headers=self._auth_header, data=props)
         self._check_response(response)
 
     def remove_user_from_device(self, olduser, deviceid):
         url = urljoin(self._baseurl, "/api/v1/devices/users")
         props = {"deviceId": deviceid, "username": olduser.username}
-        response = requests.delete(url, headers=self._auth_header, data=props)
+        response = self._session.delete(url, headers=self._auth_header, data=props)
         self._check_response(response)
 
     def list_device_users(self, deviceid):
         url = urljoin(self._baseurl, "/api/v1/devices/users")
-        response = requests.get(url, headers=self._auth_header, params={"deviceId": deviceid})
+        response = self._session.get(url, headers=self._auth_header, params={"deviceId": deviceid})
         return self._check_response(response).get("rows", [])
 
     def add_track(self, recording_id, data, algorithm={"status": "Test added"}):
-        response = requests.post(
+        response = self._session.post(
             urljoin(self._baseurl, "/api/v1/recordings/{}/tracks".format(recording_id)),
             headers=self._auth_header,
             data={"algorithm": json.dumps(algorithm), "data": json.dumps(data)},
@@ -436,14 +491,14 @@ class UserAPI(APIBase):
         return self._check_response(response)["trackId"]
 
     def get_tracks(self, recording_id):
-        response = requests.get(
+        response = self._session.get(
             urljoin(self._baseurl, "/api/v1/recordings/{}/tracks".format(recording_id)),
             headers=self._auth_header,
         )
         return self._check_response(response)["tracks"]
 
     def delete_track(self, recording_id, track_id):
-        response = requests.delete(
+        response = self._session.delete(
             urljoin(self._baseurl, "/api/v1/recordings/{}/tracks/{}".format(recording_id, track_id)),
             headers=self._auth_header,
         )
@@ -466,7 +521,7 @@ class UserAPI(APIBase):
         if tag_jwt is not None:
             tag_data["tagJWT"] = tag_jwt
 
-        response = requests.post(
+        response = self._session.post(
             urljoin(self._baseurl, url.format(recording_id, track_id)),
             headers=self._auth_header,
             data=tag_data,
@@ -481,7 +536,7 @@ class UserAPI(APIBase):
         else:
             url = "/api/v1/recordings/{}/tracks/{}/tags/{}".format(recording_id, track_id, track_tag_id)
 
-        response = requests.delete(urljoin(self._baseurl, url), headers=self._auth_header)
+        response = self._session.delete(urljoin(self._baseurl, url), headers=self._auth_header)
         return self._check_response(response)["messages"]
 
     def record_event(self, device, type_, details, times=None):
@@ -494,13 +549,13 @@ class UserAPI(APIBase):
         eventData["dateTimes"] = [t.isoformat() for t in times]
         url = urljoin(self._baseurl, "/api/v1/events/device/" + str(device._id))
 
-        response = requests.post(url, headers=self._auth_header, json=eventData)
+        response = self._session.post(url, headers=self._auth_header, json=eventData)
         response_data = self._check_response(response)
         return response_data["eventsAdded"], response_data["eventDetailId"]
 
     def get_cacophony_index(self, device_id, from_time=None, window_size=None):
         url = urljoin(self._baseurl, f"/api/v1/devices/{device_id}/cacophony-index")
-        response = requests.get(
+        response = self._session.get(
             url, headers=self._auth_header, params={"from": from_time, "window-size": window_size}
         )
         self._check_response(response)
@@ -508,7 +563,7 @@ class UserAPI(APIBase):
 
     def get_cacophony_index_histogram(self, device_id, from_time=None, window_size=None):
         url = urljoin(self._baseurl, f"/api/v1/devices/{device_id}/cacophony-index-histogram")
-        response = requests.get(
+        response = self._session.get(
             url, headers=self._auth_header, params={"from": from_time, "window-size": window_size}
         )
         self._check_response(response)
@@ -518,7 +573,7 @@ class UserAPI(APIBase):
         props = {"name": name, "conditions": json.dumps(conditions), "deviceId": device_id}
         if frequency is not None:
             props["frequencySeconds"] = frequency
-        response = requests.post(
+        response = self._session.post(
             urljoin(self._baseurl, "/api/v1/alerts"),
             headers=self._auth_header,
             data=props,
@@ -526,7 +581,7 @@ class UserAPI(APIBase):
         return self._check_response(response)["id"]
 
     def get_alerts(self, device_id):
-        response = requests.get(
+        response = self._session.get(
             urljoin(self._baseurl, f"/api/v1/alerts/device/{device_id}"),
             headers=self._auth_header,
             data={"deviceId": device_id},
@@ -535,13 +590,47 @@ class UserAPI(APIBase):
         return response.json()["Alerts"]
 
 
-def serialise_params(params):
-    out = {}
-    for name, value in params.items():
-        if value is not None:
-            if isinstance(value, (dict, list, tuple)):
-                value = json.dumps(value)
-            elif isinstance(value, datetime):
-                value = value.isoformat()
-            out[name] = value
-    return out
+def make_recording_where(where, startDate, endDate, min_secs, deviceIds):
+    if where is None:
+        where = defaultdict(dict)
+    where["duration"] = {"$gte": min_secs}
+    if startDate is not None:
+        where["recordingDateTime"]["$gte"] = startDate.isoformat()
+    if endDate is not None:
+        where["recordingDateTime"]["$lte"] = endDate.isoformat()
+    if deviceIds is not None:
+        where["DeviceId"] = deviceIds
+    return where
+
+
+def iter_pages(fetch_page, first_page):
+    """Yield the rows from a sequence of pages.
+
+    fetch_page(page) returns the rows on a page along with the page that
+    follows it, or None after the last page.  The following page is
+    requested on a background thread while the current one is consumed.
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = executor.submit(fetch_page, first_page)
+        try:
+            while pending is not None:
+                rows, next_page = pending.result()
+                pending = None
+                if next_page is not None:
+                    pending = executor.submit(fetch_page, next_page)
+                yield from rows
+        finally:
+            if pending is not None:
+                pending.cancel()
+
+
+def offset_pages(query, page_size, **options):
+    "Make a fetch_page function for iter_pages that pages through query by offset."
+
+    def fetch_page(offset):
+        rows = query(offset=offset, limit=page_size, **options)
+        if len(rows) < page_size:
+            return rows, None
+        return rows, offset + len(rows)
+
+    return fetch_page